@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Batch benchmark: splits one synthetic dataset into audit files for several practices of different sizes, serves it
+from the local mock Tebra server and runs tebra_audit_batch.run_batch_audit with one process and with one process per
+practice. With enough processes the batch should take about as long as its slowest practice, not the sum of all.
+
+    python benchmarks/bench_batch.py --practices 6 --rows 3000 --latency 0.05
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from synthetic_audit_data import generate_dataset, write_audit_file, write_dataset
+from bench_e2e import start_server_process
+from tebra_audit_batch import run_batch_audit
+
+def split_rows(rows, practices):
+    """Practice sizes grow linearly (1, 2, ..., n shares), so one practice is clearly the slowest."""
+    weights = list(range(1, practices + 1)); total = sum(weights); bounds = [0]
+    for weight in weights: bounds.append(bounds[-1] + round(len(rows) * weight / total))
+    bounds[-1] = len(rows)
+    return [rows[bounds[number]:bounds[number + 1]] for number in range(practices)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--practices", type=int, default=6)
+    parser.add_argument("--rows", type=int, default=3000, help="Rows over all practices.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock server seconds per call.")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--fault-rate", type=float, default=0.0)
+    parser.add_argument("--padding-fields", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent Tebra requests per practice.")
+    parser.add_argument("--match-mode", default="join")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file.")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="tebra_batch_")
+    try:
+        dataset = generate_dataset(args.rows, mismatch_ratio=0.1, seed=args.seed); dataset_path = write_dataset(dataset, os.path.join(work_dir, "dataset.json"))
+        practices = {}; files = []
+        for number, rows in enumerate(split_rows(dataset["rows"], args.practices), start=1):
+            practice = f"Practice {number:02d}"; practices[practice] = {"CustomerKey": f"key-{number}", "User": "benchmark", "Password": "benchmark", "Files": []}
+            files.append((f"{practice}.xlsx", write_audit_file({"rows": rows}, os.path.join(work_dir, f"{practice}.xlsx"))))
+        server, wsdl_url = start_server_process(dataset_path, args)
+        try:
+            settings = {"wsdl_url": wsdl_url, "prefetch_workers": args.workers, "match_mode": args.match_mode, "use_response_cache": False, "resume_runs": False}
+            results = {}
+            for processes in (1, args.practices):
+                batch = run_batch_audit(files, practices, os.path.join(work_dir, f"out_{processes}"), settings=settings, max_processes=processes)
+                practice_seconds = {row["practice"]: round(row["seconds"], 2) for row in batch["practices"]}
+                results[processes] = {"elapsed_s": round(batch["elapsed_seconds"], 2), "slowest_practice_s": max(practice_seconds.values()), "sum_of_practices_s": round(sum(practice_seconds.values()), 2),
+                                      "verified": sum(row["Verified"] for row in batch["practices"]), "failed_files": sum(row["failed_files"] for row in batch["practices"]), "practice_seconds": practice_seconds}
+                print(f"{processes:3d} process(es): {results[processes]['elapsed_s']:7.2f} s  (slowest practice {results[processes]['slowest_practice_s']:.2f} s, sum of practices {results[processes]['sum_of_practices_s']:.2f} s, "
+                      f"{results[processes]['verified']} verified of {args.rows}, expected {dataset['expected']['verified']}, {results[processes]['failed_files']} failed files)")
+        finally: server.terminate(); server.wait(timeout=10)
+    finally: shutil.rmtree(work_dir, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump({"settings": vars(args), "results": results}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
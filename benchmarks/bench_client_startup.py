@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark: time to a ready zeep client for the three WSDL sources create_api_client supports.
+
+A stand-in for the Kareo singleWsdl (--types complex types of --fields elements each, plus the GetPatient/GetCharges
+operations) is served from a local HTTP server that adds --latency seconds per request, since the real endpoint is
+not reachable from CI. Measured: a cold start that downloads and parses the WSDL (no cache dir), a start from the
+on-disk snapshot, and a start from a local WSDL file.
+
+    python benchmarks/bench_client_startup.py --types 400 --latency 1.0
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import http.server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tebra_audit_engine import create_api_client
+
+def build_wsdl(types, fields):
+    """Kareo-shaped WSDL: namespace, request/response wrappers and many unrelated complex types, as in the real file."""
+    sequence = "".join(f'<xs:element minOccurs="0" name="Field{f}" nillable="true" type="xs:string"/>' for f in range(fields))
+    filler = "".join(f'<xs:complexType name="Type{t}"><xs:sequence>{sequence}</xs:sequence></xs:complexType>' for t in range(types))
+    operations = ("GetPatient", "GetCharges")
+    elements = "".join(f'<xs:element name="{op}"><xs:complexType><xs:sequence><xs:element minOccurs="0" name="request" type="tns:Type0"/></xs:sequence></xs:complexType></xs:element>'
+                       f'<xs:element name="{op}Response"><xs:complexType><xs:sequence><xs:element minOccurs="0" name="{op}Result" type="tns:Type1"/></xs:sequence></xs:complexType></xs:element>' for op in operations)
+    messages = "".join(f'<wsdl:message name="{op}In"><wsdl:part name="parameters" element="tns:{op}"/></wsdl:message><wsdl:message name="{op}Out"><wsdl:part name="parameters" element="tns:{op}Response"/></wsdl:message>' for op in operations)
+    port_ops = "".join(f'<wsdl:operation name="{op}"><wsdl:input message="tns:{op}In"/><wsdl:output message="tns:{op}Out"/></wsdl:operation>' for op in operations)
+    binding_ops = "".join(f'<wsdl:operation name="{op}"><soap:operation soapAction="http://www.kareo.com/api/schemas/KareoServices/{op}" style="document"/><wsdl:input><soap:body use="literal"/></wsdl:input><wsdl:output><soap:body use="literal"/></wsdl:output></wsdl:operation>' for op in operations)
+    return ('<?xml version="1.0" encoding="utf-8"?><wsdl:definitions xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/" xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/" xmlns:xs="http://www.w3.org/2001/XMLSchema" '
+            'xmlns:tns="http://www.kareo.com/api/schemas/" targetNamespace="http://www.kareo.com/api/schemas/" name="KareoServices">'
+            f'<wsdl:types><xs:schema elementFormDefault="qualified" targetNamespace="http://www.kareo.com/api/schemas/">{filler}{elements}</xs:schema></wsdl:types>{messages}'
+            f'<wsdl:portType name="KareoServices">{port_ops}</wsdl:portType><wsdl:binding name="BasicHttpBinding_KareoServices" type="tns:KareoServices"><soap:binding transport="http://schemas.xmlsoap.org/soap/http"/>{binding_ops}</wsdl:binding>'
+            '<wsdl:service name="KareoServices"><wsdl:port name="BasicHttpBinding_KareoServices" binding="tns:BasicHttpBinding_KareoServices"><soap:address location="http://127.0.0.1:9/"/></wsdl:port></wsdl:service></wsdl:definitions>')
+
+def serve(content, latency):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency); self.send_response(200); self.send_header("Content-Type", "text/xml"); self.send_header("Content-Length", str(len(content))); self.end_headers(); self.wfile.write(content)
+        def log_message(self, *args): pass
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def timed_client(**kwargs):
+    start = time.perf_counter(); client = create_api_client(**kwargs); return time.perf_counter() - start, client.tebra_wsdl_info["source"]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--types", type=int, default=400)
+    parser.add_argument("--fields", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=1.0, help="Seconds the stand-in endpoint waits before answering.")
+    args = parser.parse_args(argv)
+    content = build_wsdl(args.types, args.fields).encode("utf-8"); server = serve(content, args.latency)
+    wsdl_url = f"http://127.0.0.1:{server.server_address[1]}/KareoServices.svc?singleWsdl"
+    work_dir = tempfile.mkdtemp(prefix="tebra_wsdl_bench_")
+    try:
+        local_path = os.path.join(work_dir, "KareoServices.wsdl")
+        with open(local_path, "wb") as f: f.write(content)
+        cache_dir = os.path.join(work_dir, "cache")
+        runs = [("cold (download + parse, no cache)", dict(wsdl_url=wsdl_url, wsdl_path=None, cache_dir=None)),
+                ("first start with cache (downloads snapshot)", dict(wsdl_url=wsdl_url, wsdl_path=None, cache_dir=cache_dir)),
+                ("warm start from snapshot", dict(wsdl_url=wsdl_url, wsdl_path=None, cache_dir=cache_dir)),
+                ("stale snapshot, checksum unchanged", dict(wsdl_url=wsdl_url, wsdl_path=None, cache_dir=cache_dir, refresh_hours=0)),
+                ("local WSDL file", dict(wsdl_url=wsdl_url, wsdl_path=local_path, cache_dir=cache_dir))]
+        print(f"WSDL: {len(content) / 1024:.0f} KB, endpoint latency {args.latency:.2f} s")
+        for label, kwargs in runs:
+            seconds, source = timed_client(**kwargs); print(f"{label:45s} {seconds:6.2f} s  ({source})")
+    finally: server.shutdown(); shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark: runs the full audit pipeline (file read, zeep client, Tebra calls, comparison) against the local
+mock Tebra server with a synthetic audit file, and reports throughput, SOAP calls per row, peak memory and per-row
+service time. The mock server runs in a subprocess so the memory figures only cover the audit.
+
+Per-row service time is the gap between two consecutive results of AuditRun.iter_results in row match mode: the row's
+comparison plus any Tebra request it still needs after the batched prefetch. The first result also waits for the
+prefetch, so it is reported separately (first_row_s) and left out of the percentiles. Join mode yields every row at
+once after one set-based comparison, so it has no per-row service time (reported as null and not regression-checked).
+
+    python benchmarks/bench_e2e.py --rows 5000 --latency 0.05 --json results.json
+    python benchmarks/bench_e2e.py --rows 5000 --latency 0.05 --baseline results.json  # exits 1 on a regression
+    python benchmarks/bench_e2e.py --rows 5000 --latency 0.05 --capacity 12 --fault-rate 0.02  # throttling server: adaptive vs --fixed-concurrency
+    python benchmarks/bench_e2e.py --rows 20000 --latency 0.05 --patient-directory --page-limit 500  # paged GetPatients instead of GetPatient per ID
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from synthetic_audit_data import generate_dataset, write_audit_file, write_dataset
+from tebra_audit_engine import AuditRun, CHARGE_FETCH_MODES, MATCH_MODES, DEFAULT_PREFETCH_WORKERS, create_api_client, build_request_header, read_audit_file, build_output_frame
+from tebra_request_control import DEFAULT_MAX_RETRIES
+from tebra_patient_directory import load_patient_directory
+
+REGRESSION_CHECKS = (("rows_per_second", "lower"), ("soap_calls_per_row", "higher"), ("peak_rss_mb", "higher"), ("row_service_p95_s", "higher")) # (metric, direction that is worse)
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def percentile(sorted_values, fraction):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+def start_server_process(dataset_path, args):
+    command = [sys.executable, os.path.join(BENCH_DIR, "mock_tebra_server.py"), "--dataset", dataset_path, "--port", "0", "--latency", str(args.latency), "--jitter", str(args.jitter),
+               "--error-rate", str(args.error_rate), "--fault-rate", str(args.fault_rate), "--padding-fields", str(args.padding_fields), "--capacity", str(getattr(args, "capacity", 0)), "--page-limit", str(getattr(args, "page_limit", 1000)), "--seed", str(args.seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    wsdl_url = process.stdout.readline().strip()
+    if not wsdl_url: process.kill(); raise RuntimeError("Mock Tebra server did not start.")
+    return process, wsdl_url
+
+def run_benchmark(args):
+    work_dir = tempfile.mkdtemp(prefix="tebra_e2e_")
+    try:
+        dataset = generate_dataset(args.rows, args.patients, args.mismatch_ratio, args.days, args.noise_charges, seed=args.seed)
+        audit_path = write_audit_file(dataset, os.path.join(work_dir, f"audit.{args.file_format}")); dataset_path = write_dataset(dataset, os.path.join(work_dir, "dataset.json"))
+        expected = dataset["expected"]; del dataset
+        server, wsdl_url = start_server_process(dataset_path, args)
+        try:
+            rss_before_mb = _peak_rss_mb(); start_time = time.perf_counter()
+            client = create_api_client(wsdl_url=wsdl_url, wsdl_path=None, cache_dir=None); client_seconds = time.perf_counter() - start_time
+            header = build_request_header({"CustomerKey": "benchmark", "User": "benchmark", "Password": "benchmark"}, client)
+            df = read_audit_file(audit_path)
+            audit_run = AuditRun(client, header, prefetch_workers=args.workers, charge_fetch_mode=args.charge_mode, match_mode=args.match_mode, adaptive_concurrency=not args.fixed_concurrency, max_retries=args.retries)
+            audit_start = time.perf_counter(); yield_times = []; results = []
+            if args.patient_directory: audit_run.patient_directory, _ = load_patient_directory(client, header, "benchmark", metrics=audit_run.metrics, request_controller=audit_run.request_controller)
+            for result in audit_run.iter_results(df): yield_times.append(time.perf_counter()); results.append(result)
+            audit_seconds = time.perf_counter() - audit_start
+            statuses = build_output_frame(df, results)["Audit Results"].value_counts().to_dict()
+            total_seconds = time.perf_counter() - start_time; peak_rss_mb = _peak_rss_mb()
+            with urllib.request.urlopen(wsdl_url.split("?")[0].rsplit("/", 1)[0] + "/stats") as response: server_stats = json.load(response)
+        finally: server.terminate(); server.wait(timeout=10)
+    finally: shutil.rmtree(work_dir, ignore_errors=True)
+    row_service_times = sorted(later - earlier for earlier, later in zip(yield_times, yield_times[1:])) if args.match_mode == "row" else []; soap_calls = sum(server_stats["calls"].values())
+    return {"rows": args.rows, "client_ready_s": round(client_seconds, 3), "audit_s": round(audit_seconds, 3), "total_s": round(total_seconds, 3), "rows_per_second": round(args.rows / audit_seconds, 1),
+            "soap_calls": server_stats["calls"], "soap_calls_per_row": round(soap_calls / args.rows, 4), "charges_returned": server_stats["charges_returned"],
+            "injected_errors": server_stats["errors"] + server_stats["faults"], "throttled": server_stats["throttled"], "server_peak_in_flight": server_stats["peak_in_flight"],
+            "request_control": audit_run.request_controller.stats(), "error_rows": sum(result["Status"] == "Error" for result in results), "peak_rss_mb": round(peak_rss_mb, 1), "rss_growth_mb": round(peak_rss_mb - rss_before_mb, 1),
+            "first_row_s": round(yield_times[0] - audit_start, 4) if yield_times else None,
+            "row_service_p50_s": round(percentile(row_service_times, 0.50), 6) if row_service_times else None, "row_service_p95_s": round(percentile(row_service_times, 0.95), 6) if row_service_times else None,
+            "verified": statuses.get("Verified", 0), "expected_verified": expected["verified"],
+            "phase_seconds": {name: round(entry["seconds"], 3) for name, entry in audit_run.metrics.to_dict()["phases"].items()},
+            "settings": {key: getattr(args, key) for key in ("latency", "jitter", "error_rate", "fault_rate", "padding_fields", "noise_charges", "capacity", "page_limit", "patient_directory", "workers", "fixed_concurrency", "retries", "charge_mode", "match_mode", "file_format")}}
+
+def find_regressions(metrics, baseline, tolerance):
+    """Metrics worse than the baseline by more than tolerance (a fraction), as readable strings."""
+    regressions = []
+    for metric, worse in REGRESSION_CHECKS:
+        current, previous = metrics.get(metric), baseline.get(metric)
+        if not current or not previous: continue
+        change = (current - previous) / previous
+        if (worse == "lower" and change < -tolerance) or (worse == "higher" and change > tolerance): regressions.append(f"{metric}: {previous} -> {current} ({change:+.0%})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--patients", type=int, default=None)
+    parser.add_argument("--mismatch-ratio", type=float, default=0.1)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--noise-charges", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.02, help="Mock server seconds per call.")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--fault-rate", type=float, default=0.0)
+    parser.add_argument("--padding-fields", type=int, default=40, help="Unused ChargeData fields per charge (payload size).")
+    parser.add_argument("--capacity", type=int, default=0, help="Mock server capacity in concurrent requests (0: unlimited).")
+    parser.add_argument("--page-limit", type=int, default=1000, help="Mock server page limit (most patients or charges per response).")
+    parser.add_argument("--patient-directory", action="store_true", help="Load the patient directory (paged GetPatients) before the audit.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_PREFETCH_WORKERS)
+    parser.add_argument("--fixed-concurrency", action="store_true", help="Keep --workers requests in flight instead of adapting.")
+    parser.add_argument("--retries", type=int, default=DEFAULT_MAX_RETRIES)
+    parser.add_argument("--charge-mode", choices=CHARGE_FETCH_MODES, default="auto")
+    parser.add_argument("--match-mode", choices=MATCH_MODES, default="join")
+    parser.add_argument("--file-format", choices=("xlsx", "csv"), default="xlsx")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the metrics to this file.")
+    parser.add_argument("--baseline", help="Metrics JSON from an earlier run; exit 1 if this run is worse beyond --tolerance.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    metrics = run_benchmark(args)
+    print(f"rows: {metrics['rows']}  ({metrics['verified']} verified, {metrics['expected_verified']} expected)")
+    print(f"client ready:     {metrics['client_ready_s']:8.2f} s")
+    print(f"audit:            {metrics['audit_s']:8.2f} s  {metrics['rows_per_second']:10.1f} rows/s")
+    print(f"SOAP calls:       {metrics['soap_calls']}  {metrics['soap_calls_per_row']:.4f} calls/row  ({metrics['injected_errors']} injected errors)")
+    print(f"peak RSS:         {metrics['peak_rss_mb']:8.1f} MB  (+{metrics['rss_growth_mb']:.1f} MB during the run)")
+    control = metrics["request_control"]
+    print(f"Tebra requests:   {control['retries']} retries, concurrency {control['lowest_limit']:g}-{control['peak_limit']:g} (end {control['limit']:g}), {metrics['throttled']} throttled, {control['breaker_trips']} breaker trips, {metrics['error_rows']} error rows")
+    if metrics["row_service_p50_s"] is None: print(f"first row:        {metrics['first_row_s']:8.2f} s  (per-row service time needs --match-mode row)")
+    else: print(f"first row:        {metrics['first_row_s']:8.2f} s  row service p50 {metrics['row_service_p50_s'] * 1000:.3f} ms  p95 {metrics['row_service_p95_s'] * 1000:.3f} ms")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(metrics, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f: baseline = json.load(f)
+        regressions = find_regressions(metrics, baseline, args.tolerance)
+        for regression in regressions: print(f"REGRESSION {regression}")
+        if regressions: return 1
+    return 0 if metrics["verified"] == metrics["expected_verified"] or args.error_rate or args.fault_rate else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
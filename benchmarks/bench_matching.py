@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark: charge comparison cost of the per-row loop (compare_charge_row) vs. compare_charges_joined.
+
+Rows are extracted and patient-checked up front (not timed); only the comparison phase is measured, with every
+(patient, DOS) key holding several charges including duplicate CPT/amount candidates.
+
+    python benchmarks/bench_matching.py --rows 20000
+"""
+
+import os
+import sys
+import copy
+import time
+import random
+import argparse
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_normalization import build_frame
+from tebra_audit_engine import TebraCharge, TebraPatient, prepare_audit_frame, prepared_records, extract_row_state, check_patient_row, compare_charge_row, compare_charges_joined
+
+def tebra_charge(row, rnd):
+    """Charge echoing an Excel row, with an occasional mismatching field."""
+    pick = lambda value, alt: alt if rnd.random() < 0.05 else value
+    return TebraCharge.from_soap(SimpleNamespace(ID=pick(row['claimID'], '1'), EncounterID=row['EncounterID'], ProcedureCode=row['ProcedureCode'], TotalCharges=pick(str(row['ServiceChargeAmount']), '1.00'),
+                           RenderingProviderName=pick(row['RenderingProvider'], 'Other Doc'), ReferringProviderName=row['ReferringProvider'] or None, ServiceLocationName=row['ServiceLocationName'],
+                           ServiceLocationPlaceOfServiceCode={'11': '11', 'Office': '11', 'Telehealth Home': '10'}[row['PlaceOfServiceCode']], Units=str(row['ServiceUnitCount']),
+                           PrimaryInsuranceCompanyName=row['PriIns_CompanyName'], ProcedureModifier1=row['ProcedureModifier1'] or None, ProcedureModifier2=row['ProcedureModifier2'] or None,
+                           ProcedureModifier3=None, ProcedureModifier4=None, EncounterDiagnosisID1=pick(row['EncounterDiagnosisID1'], 'R69'), EncounterDiagnosisID2=row['EncounterDiagnosisID2'] or None,
+                           EncounterDiagnosisID3=None, EncounterDiagnosisID4=None))
+
+def build_states(df, prepared):
+    norm_records = prepared_records(prepared); states = []
+    for position, (index, row) in enumerate(df.iterrows()):
+        state = extract_row_state(index, row, norm_records[position]); last_name, first_name = row['PatientName'].split(', ')
+        check_patient_row(state, TebraPatient.from_soap(SimpleNamespace(PatientFullName=f"{first_name} {last_name}", FirstName=first_name, LastName=last_name, DOB=row['DOB'])), None)
+        states.append(state)
+    return states
+
+def build_charges_cache(df, states, seed=0):
+    rnd = random.Random(seed); charges_cache = {}
+    for (_, row), state in zip(df.iterrows(), states):
+        charges = charges_cache.setdefault((state["patient_name"], state["dos_str"]), ([], None))[0]
+        charges.append(tebra_charge(row, rnd))
+        if rnd.random() < 0.1: duplicate = copy.copy(charges[-1]); duplicate.ID = 'dup'; duplicate.TotalCharges = '5.00'; charges.append(duplicate)
+    return charges_cache
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    df = build_frame(args.rows); df.reset_index(inplace=True); df.rename(columns={'index': 'Original Excel Row Index'}, inplace=True)
+    prepared = prepare_audit_frame(df); charges_cache = build_charges_cache(df, build_states(df, prepared))
+
+    def timed(compare):
+        states = build_states(df, prepared) # compare_* mutate the states, so every repetition starts from fresh ones
+        start = time.perf_counter(); results = compare(states); return time.perf_counter() - start, results
+    row_loop = lambda states: [compare_charge_row(state, *charges_cache[(state["patient_name"], state["dos_str"])]) if state["proceed"] else compare_charge_row(state, [], None) for state in states]
+    before, before_results = min((timed(row_loop) for _ in range(args.repeat)), key=lambda timing: timing[0])
+    after, after_results = min((timed(lambda states: compare_charges_joined(states, prepared, charges_cache)) for _ in range(args.repeat)), key=lambda timing: timing[0])
+    same = [(r["Status"], r["Reason"]) for r in before_results] == [(r["Status"], r["Reason"]) for r in after_results]
+    print(f"rows: {args.rows}  charges: {sum(len(charges) for charges, _ in charges_cache.values())}  identical results: {same}")
+    print(f"before (row loop): {before:8.3f} s  {before / args.rows * 1e6:8.2f} us/row")
+    print(f"after (join):      {after:8.3f} s  {after / args.rows * 1e6:8.2f} us/row")
+    print(f"speedup: {before / after:.1f}x")
+
+if __name__ == "__main__":
+    main()
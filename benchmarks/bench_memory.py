@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Peak-memory benchmark of the file-to-file path on a large synthetic audit file: read the .xlsx, audit it (Tebra
+patients and charges are preloaded into the run caches, so no SOAP calls are made), build the output frame and write
+the results workbook. Each engine runs in its own subprocess; peak RSS is read after every stage.
+
+To compare against another version of the engine, point --engine-dir at a checkout of it:
+    git worktree add /tmp/tebra-before HEAD~1
+    python benchmarks/bench_memory.py --rows 100000 --engine-dir . --engine-dir /tmp/tebra-before
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ("read", "preload", "audit", "output_frame", "export") # "preload" is the benchmark filling the run caches in place of Tebra
+
+def _peak_rss_mb():
+    # VmHWM starts fresh in each subprocess; ru_maxrss on Linux keeps the parent's peak across exec
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"): return int(line.split()[1]) / 1024
+    except OSError: pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KiB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def prepare_files(rows, work_dir, seed):
+    """Writes (or reuses) the synthetic audit file and its Tebra-side dataset JSON."""
+    sys.path.insert(0, BENCH_DIR); sys.path.insert(0, os.path.dirname(BENCH_DIR))
+    from synthetic_audit_data import generate_dataset, write_audit_file, write_dataset
+    audit_path = os.path.join(work_dir, f"memory_{rows}_{seed}.xlsx"); dataset_path = os.path.join(work_dir, f"memory_{rows}_{seed}.json")
+    if not (os.path.exists(audit_path) and os.path.exists(dataset_path)):
+        dataset = generate_dataset(rows, mismatch_ratio=0.1, seed=seed); write_audit_file(dataset, audit_path); write_dataset(dataset, dataset_path)
+    return audit_path, dataset_path
+
+def run_stages(engine_dir, audit_path, dataset_path, output_path, match_mode):
+    """Runs inside the subprocess: imports tebra_audit_engine from engine_dir and reports time and peak RSS per stage."""
+    sys.path.insert(0, os.path.abspath(engine_dir))
+    import tebra_audit_engine as engine
+    from types import SimpleNamespace
+    report = {"engine_dir": os.path.abspath(engine_dir), "baseline_rss_mb": round(_peak_rss_mb(), 1), "stages": {}}
+    def stage(name, func):
+        start = time.perf_counter(); value = func()
+        report["stages"][name] = {"seconds": round(time.perf_counter() - start, 2), "peak_rss_mb": round(_peak_rss_mb(), 1)}
+        return value
+    df = stage("read", lambda: engine.read_audit_file(audit_path))
+    audit_kwargs = {"match_mode": match_mode} if hasattr(engine, "MATCH_MODES") else {}
+    audit_run = engine.AuditRun(None, None, **audit_kwargs)
+    def preload():
+        with open(dataset_path, encoding="utf-8") as f: dataset = json.load(f)
+        patients = {patient_id: engine.TebraPatient.from_soap(SimpleNamespace(**fields)) for patient_id, fields in dataset["patients"].items()}
+        for charge in dataset["charges"]:
+            patient = patients[charge["PatientID"]]; key = (engine.get_tebra_patient_filter_name(patient), engine.normalize_service_date(charge["ServiceStartDate"]))
+            audit_run.tebra_charges_cache.setdefault(key, ([], None))[0].append(engine.TebraCharge.from_soap(SimpleNamespace(**charge)))
+        audit_run.tebra_patient_cache.update({patient_id: (patient, None) for patient_id, patient in patients.items()})
+    stage("preload", preload)
+    results = stage("audit", lambda: audit_run.run(df))
+    df_output = stage("output_frame", lambda: engine.build_output_frame(df, results))
+    stage("export", lambda: engine.write_results_file(df_output, output_path))
+    report["statuses"] = df_output["Audit Results"].value_counts().to_dict(); report["output_mb"] = round(os.path.getsize(output_path) / (1024 * 1024), 1)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--match-mode", default="join")
+    parser.add_argument("--engine-dir", action="append", help="Directory containing tebra_audit_engine.py (repeatable; default: this checkout).")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "tebra_bench_memory"), help="Where the synthetic files are generated and reused.")
+    parser.add_argument("--json", help="Write all reports to this file.")
+    parser.add_argument("--stage-runner", nargs=4, metavar=("ENGINE_DIR", "AUDIT", "DATASET", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.stage_runner: print(json.dumps(run_stages(*args.stage_runner, args.match_mode))); return 0
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    audit_path, dataset_path = prepare_files(args.rows, args.work_dir, args.seed); reports = []
+    for engine_dir in args.engine_dir or [os.path.dirname(BENCH_DIR)]:
+        output_path = os.path.join(args.work_dir, "results.xlsx")
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--match-mode", args.match_mode, "--stage-runner", engine_dir, audit_path, dataset_path, output_path], capture_output=True, text=True, check=True)
+        report = json.loads(completed.stdout.strip().splitlines()[-1]); reports.append(report)
+        print(f"{report['engine_dir']}  ({args.rows} rows, {report['statuses']}, output {report['output_mb']} MB)")
+        for name in STAGES: print(f"  {name:<13} {report['stages'][name]['seconds']:8.2f} s   peak RSS {report['stages'][name]['peak_rss_mb']:8.1f} MB")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(reports, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
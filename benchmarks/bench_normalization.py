@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark: per-row Excel normalization cost of the row loop vs. prepare_audit_frame.
+
+"before" calls the scalar normalizers row by row (what each iteration of the audit loop did);
+"after" builds every normalized column once with prepare_audit_frame.
+
+    python benchmarks/bench_normalization.py --rows 20000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from tebra_audit_engine import (prepare_audit_frame, prepared_records, excel_patient_name_key, parse_excel_dos, parse_excel_units, normalize_code, normalize_string, normalize_name,
+                                normalize_dob, round_half_up)
+
+def build_frame(rows, seed=0):
+    """Excel-like frame where providers, payers, POS, modifiers and ICDs repeat heavily, as in real audit files."""
+    rnd = random.Random(seed)
+    providers = ["Jane Roe MD", "Bob Stone, DO", "Al Park NP", "Sue Wu", "Omar Khan, PA"]
+    payers = ["BCBS of Texas", "Aetna", "Medicare", "United Healthcare", "Cigna"]
+    patients = [(f"Last{i}, First{i}", (datetime.date(1950, 1, 1) + datetime.timedelta(days=rnd.randint(0, 20000))).strftime('%m/%d/%Y')) for i in range(max(1, rows // 5))]
+    records = []
+    for i in range(rows):
+        name, dob = rnd.choice(patients)
+        records.append({"PatientID": str(1000 + i % len(patients)), "PatientName": name, "DOB": dob,
+                        "DateOfService": (datetime.date(2024, 1, 1) + datetime.timedelta(days=rnd.randint(0, 60))).strftime('%m/%d/%Y'),
+                        "RenderingProvider": rnd.choice(providers), "ReferringProvider": rnd.choice(["", "Dr Who MD"]), "PlaceOfServiceCode": rnd.choice(["11", "Office", "Telehealth Home"]),
+                        "ProcedureCode": rnd.choice(["99213", "99214", "90834", "J1100"]), "ProcedureModifier1": rnd.choice(["", "25", "59"]), "ProcedureModifier2": rnd.choice(["", "GT"]),
+                        "ProcedureModifier3": "", "ProcedureModifier4": "", "ServiceUnitCount": rnd.choice([1, 2]), "EncounterDiagnosisID1": rnd.choice(["E11.9", "I10", "Z00.00"]),
+                        "EncounterDiagnosisID2": rnd.choice(["", "F41.1"]), "EncounterDiagnosisID3": "", "EncounterDiagnosisID4": "", "ServiceChargeAmount": rnd.choice([100, 125.5, 80.25]),
+                        "PriIns_CompanyName": rnd.choice(payers), "PriIns_CompanyPlanName": "Plan", "EncounterID": str(50000 + i), "claimID": str(90000 + i), "ServiceLocationName": rnd.choice(["Main Office", "Clinic-2"])})
+    return pd.DataFrame(records)
+
+def normalize_row_by_row(df):
+    for _, row in df.iterrows():
+        str(row.get('PatientID', '')).strip(); str(row.get('claimID', 'UNKNOWN')); parse_excel_dos(row.get('DateOfService'))
+        excel_patient_name_key(row.get('PatientName')); normalize_dob(row.get('DOB'))
+        normalize_code(row.get('ProcedureCode')); round_half_up(row.get('ServiceChargeAmount'), decimals=2)
+        normalize_code(str(row.get('claimID'))); normalize_code(str(row.get('EncounterID')))
+        normalize_name(row.get('RenderingProvider')); normalize_name(row.get('ReferringProvider'))
+        normalize_string(row.get('ServiceLocationName')); normalize_string(row.get('PlaceOfServiceCode'), remove_spaces=True); normalize_string(row.get('PriIns_CompanyName'))
+        parse_excel_units(row.get('ServiceUnitCount', '0'))
+        for i in range(1, 5): normalize_code(row.get(f'ProcedureModifier{i}')); normalize_code(row.get(f'EncounterDiagnosisID{i}'))
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter(); func(); timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    df = build_frame(args.rows)
+    before = best_of(lambda: normalize_row_by_row(df), args.repeat)
+    after = best_of(lambda: prepared_records(prepare_audit_frame(df)), args.repeat)
+    print(f"rows: {args.rows}")
+    print(f"before (row-by-row):        {before:8.3f} s  {before / args.rows * 1e6:8.2f} us/row")
+    print(f"after (prepare_audit_frame): {after:8.3f} s  {after / args.rows * 1e6:8.2f} us/row")
+    print(f"speedup: {before / after:.1f}x")
+
+if __name__ == "__main__":
+    main()
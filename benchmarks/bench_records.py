@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark: memory and attribute-access cost of retaining zeep ChargeData objects vs. TebraCharge records.
+
+zeep objects are built from a ChargeData-like xsd type: the fields the audit compares plus --extra-fields string fields
+standing in for the ChargeData columns the audit never reads. Memory is the tracemalloc size retained by the list.
+
+    python benchmarks/bench_records.py --charges 50000
+"""
+
+import os
+import sys
+import gc
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zeep import xsd
+from tebra_audit_engine import TebraCharge, to_charge_records, get_nested_attribute
+
+def build_charge_type(extra_fields):
+    elements = [xsd.Element(field, xsd.String()) for field in TebraCharge.__slots__] + [xsd.Element(f'UnusedField{i}', xsd.String()) for i in range(extra_fields)]
+    return xsd.ComplexType(xsd.Sequence(elements))
+
+def build_zeep_charges(count, extra_fields, seed=0):
+    rnd = random.Random(seed); charge_type = build_charge_type(extra_fields)
+    return [charge_type(ID=str(100000 + i), EncounterID=str(500000 + i), PatientID=str(rnd.randint(1, 5000)), PatientName=f"First{i % 5000} Last{i % 5000}", ServiceStartDate='2024-03-01T00:00:00',
+                        ProcedureCode=rnd.choice(['99213', '99214', '90834']), TotalCharges=rnd.choice(['100.00', '125.50']), Units='1', RenderingProviderName='Jane Roe', ServiceLocationName='Main Office',
+                        ServiceLocationPlaceOfServiceCode='11', PrimaryInsuranceCompanyName='Aetna', ProcedureModifier1='25', EncounterDiagnosisID1='E11.9',
+                        **{f'UnusedField{j}': f'value {i} {j}' for j in range(extra_fields)}) for i in range(count)]
+
+def retained_bytes(build):
+    gc.collect(); tracemalloc.start()
+    try: value = build(); gc.collect(); size = tracemalloc.get_traced_memory()[0]
+    finally: tracemalloc.stop()
+    return value, size
+
+def access_seconds(charges, read):
+    start = time.perf_counter()
+    for charge in charges:
+        for field in TebraCharge.__slots__: read(charge, field)
+    return time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--charges", type=int, default=50000)
+    parser.add_argument("--extra-fields", type=int, default=60)
+    args = parser.parse_args(argv)
+    zeep_charges, zeep_bytes = retained_bytes(lambda: build_zeep_charges(args.charges, args.extra_fields))
+    # Records are built from their own zeep objects (dropped right away, as in the SOAP layer) so the field values they keep are counted
+    records, record_bytes = retained_bytes(lambda: to_charge_records(build_zeep_charges(args.charges, args.extra_fields)))
+    zeep_access = access_seconds(zeep_charges, get_nested_attribute); record_access = access_seconds(records, getattr)
+    reads = args.charges * len(TebraCharge.__slots__)
+    print(f"charges: {args.charges}  fields per zeep charge: {len(TebraCharge.__slots__) + args.extra_fields}  audited fields: {len(TebraCharge.__slots__)}")
+    print(f"before (zeep objects):     {zeep_bytes / 2**20:8.1f} MB  {zeep_bytes / args.charges:8.0f} B/charge  {zeep_access / reads * 1e9:6.0f} ns/field read")
+    print(f"after (TebraCharge slots): {record_bytes / 2**20:8.1f} MB  {record_bytes / args.charges:8.0f} B/charge  {record_access / reads * 1e9:6.0f} ns/field read")
+    print(f"memory: {zeep_bytes / record_bytes:.1f}x smaller  access: {zeep_access / record_access:.1f}x faster")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Tebra (Kareo) SOAP service, for benchmarks and offline runs without production data.
+
+Serves a hand-written subset of the Kareo WSDL (?singleWsdl) with the GetPatient, GetPatients and GetCharges operations
+and the types the audit reads, and answers them from a synthetic dataset (synthetic_audit_data.py). Latency, jitter, error and
+SOAP fault rates, the payload size (unused ChargeData padding fields) and a capacity are configurable: above capacity
+concurrent requests responses slow down in proportion, and above twice the capacity requests are throttled with a fault.
+GetPatients filters on creation/last-modified date (a date derived from the PatientID); GetPatients and GetCharges return at most --page-limit records, like the real API. GET /stats returns the call
+counters as JSON.
+
+    python benchmarks/mock_tebra_server.py --dataset synthetic_dataset.json --port 8099 --latency 0.05
+    python tebra_audit_cli.py audit.xlsx --wsdl-url "http://127.0.0.1:8099/KareoServices.svc?singleWsdl" --no-wsdl-cache ...
+"""
+
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+import http.server
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+TEBRA_NAMESPACE = "http://www.kareo.com/api/schemas/"
+SOAP_ENV_NAMESPACE = "http://schemas.xmlsoap.org/soap/envelope/"
+PATIENT_FIELDS = ("ID", "FirstName", "LastName", "PatientFullName", "DOB")
+CHARGE_FIELDS = ("ID", "EncounterID", "PatientID", "PatientName", "ServiceStartDate", "ProcedureCode", "TotalCharges", "Units", "RenderingProviderName", "ReferringProviderName",
+                 "ServiceLocationName", "ServiceLocationPlaceOfServiceCode", "PrimaryInsuranceCompanyName", "ProcedureModifier1", "ProcedureModifier2", "ProcedureModifier3", "ProcedureModifier4",
+                 "EncounterDiagnosisID1", "EncounterDiagnosisID2", "EncounterDiagnosisID3", "EncounterDiagnosisID4")
+
+def _string_elements(names): return "".join(f'<xs:element minOccurs="0" name="{name}" nillable="true" type="xs:string"/>' for name in names)
+
+def build_wsdl(service_url, padding_fields=0):
+    """Kareo-compatible WSDL for GetPatient/GetPatients/GetCharges (document/literal, same namespace and type names as KareoServices)."""
+    charge_fields = CHARGE_FIELDS + tuple(f"UnusedField{i}" for i in range(padding_fields))
+    schema = (
+        f'<xs:complexType name="RequestHeader"><xs:sequence>{_string_elements(("ClientVersion", "CustomerKey", "Password", "User"))}</xs:sequence></xs:complexType>'
+        '<xs:complexType name="ErrorResponse"><xs:sequence><xs:element minOccurs="0" name="ErrorMessage" nillable="true" type="xs:string"/><xs:element minOccurs="0" name="IsError" type="xs:boolean"/>'
+        '<xs:element minOccurs="0" name="StackTrace" nillable="true" type="xs:string"/></xs:sequence></xs:complexType>'
+        '<xs:complexType name="SinglePatientFilter"><xs:sequence><xs:element minOccurs="0" name="ExternalID" nillable="true" type="xs:string"/><xs:element minOccurs="0" name="ExternalVendorID" nillable="true" type="xs:string"/>'
+        '<xs:element minOccurs="0" name="PatientID" type="xs:int"/></xs:sequence></xs:complexType>'
+        '<xs:complexType name="GetPatientReq"><xs:sequence><xs:element minOccurs="0" name="RequestHeader" nillable="true" type="tns:RequestHeader"/><xs:element minOccurs="0" name="Filter" nillable="true" type="tns:SinglePatientFilter"/></xs:sequence></xs:complexType>'
+        f'<xs:complexType name="PatientData"><xs:sequence>{_string_elements(PATIENT_FIELDS)}</xs:sequence></xs:complexType>'
+        '<xs:complexType name="GetPatientResp"><xs:sequence><xs:element minOccurs="0" name="ErrorResponse" nillable="true" type="tns:ErrorResponse"/><xs:element minOccurs="0" name="Patient" nillable="true" type="tns:PatientData"/></xs:sequence></xs:complexType>'
+        f'<xs:complexType name="PatientFilter"><xs:sequence>{_string_elements(("FromCreatedDate", "ToCreatedDate", "FromLastModifiedDate", "ToLastModifiedDate"))}</xs:sequence></xs:complexType>'
+        '<xs:complexType name="GetPatientsReq"><xs:sequence><xs:element minOccurs="0" name="RequestHeader" nillable="true" type="tns:RequestHeader"/><xs:element minOccurs="0" name="Filter" nillable="true" type="tns:PatientFilter"/></xs:sequence></xs:complexType>'
+        '<xs:complexType name="ArrayOfPatientData"><xs:sequence><xs:element minOccurs="0" maxOccurs="unbounded" name="PatientData" nillable="true" type="tns:PatientData"/></xs:sequence></xs:complexType>'
+        '<xs:complexType name="GetPatientsResp"><xs:sequence><xs:element minOccurs="0" name="ErrorResponse" nillable="true" type="tns:ErrorResponse"/><xs:element minOccurs="0" name="Patients" nillable="true" type="tns:ArrayOfPatientData"/></xs:sequence></xs:complexType>'
+        f'<xs:complexType name="ChargeFilter"><xs:sequence>{_string_elements(("FromServiceDate", "ToServiceDate", "PatientName", "PatientID"))}</xs:sequence></xs:complexType>'
+        '<xs:complexType name="GetChargesReq"><xs:sequence><xs:element minOccurs="0" name="RequestHeader" nillable="true" type="tns:RequestHeader"/><xs:element minOccurs="0" name="Filter" nillable="true" type="tns:ChargeFilter"/></xs:sequence></xs:complexType>'
+        f'<xs:complexType name="ChargeData"><xs:sequence>{_string_elements(charge_fields)}</xs:sequence></xs:complexType>'
+        '<xs:complexType name="ArrayOfChargeData"><xs:sequence><xs:element minOccurs="0" maxOccurs="unbounded" name="ChargeData" nillable="true" type="tns:ChargeData"/></xs:sequence></xs:complexType>'
+        '<xs:complexType name="GetChargesResp"><xs:sequence><xs:element minOccurs="0" name="ErrorResponse" nillable="true" type="tns:ErrorResponse"/><xs:element minOccurs="0" name="Charges" nillable="true" type="tns:ArrayOfChargeData"/></xs:sequence></xs:complexType>'
+    )
+    operations = (("GetPatient", "GetPatientReq", "GetPatientResp"), ("GetPatients", "GetPatientsReq", "GetPatientsResp"), ("GetCharges", "GetChargesReq", "GetChargesResp"))
+    for operation, request_type, response_type in operations:
+        schema += (f'<xs:element name="{operation}"><xs:complexType><xs:sequence><xs:element minOccurs="0" name="request" nillable="true" type="tns:{request_type}"/></xs:sequence></xs:complexType></xs:element>'
+                   f'<xs:element name="{operation}Response"><xs:complexType><xs:sequence><xs:element minOccurs="0" name="{operation}Result" nillable="true" type="tns:{response_type}"/></xs:sequence></xs:complexType></xs:element>')
+    messages = "".join(f'<wsdl:message name="KareoServices_{op}_InputMessage"><wsdl:part name="parameters" element="tns:{op}"/></wsdl:message>'
+                       f'<wsdl:message name="KareoServices_{op}_OutputMessage"><wsdl:part name="parameters" element="tns:{op}Response"/></wsdl:message>' for op, _, _ in operations)
+    port_operations = "".join(f'<wsdl:operation name="{op}"><wsdl:input message="tns:KareoServices_{op}_InputMessage"/><wsdl:output message="tns:KareoServices_{op}_OutputMessage"/></wsdl:operation>' for op, _, _ in operations)
+    binding_operations = "".join(f'<wsdl:operation name="{op}"><soap:operation soapAction="{TEBRA_NAMESPACE}KareoServices/{op}" style="document"/><wsdl:input><soap:body use="literal"/></wsdl:input>'
+                                 '<wsdl:output><soap:body use="literal"/></wsdl:output></wsdl:operation>' for op, _, _ in operations)
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            f'<wsdl:definitions name="KareoServices" targetNamespace="{TEBRA_NAMESPACE}" xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/" xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/" '
+            f'xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:tns="{TEBRA_NAMESPACE}">'
+            f'<wsdl:types><xs:schema elementFormDefault="qualified" targetNamespace="{TEBRA_NAMESPACE}">{schema}</xs:schema></wsdl:types>{messages}'
+            f'<wsdl:portType name="KareoServices">{port_operations}</wsdl:portType>'
+            f'<wsdl:binding name="BasicHttpBinding_KareoServices" type="tns:KareoServices"><soap:binding transport="http://schemas.xmlsoap.org/soap/http"/>{binding_operations}</wsdl:binding>'
+            f'<wsdl:service name="KareoServices"><wsdl:port name="BasicHttpBinding_KareoServices" binding="tns:BasicHttpBinding_KareoServices"><soap:address location="{escape(service_url)}"/></wsdl:port></wsdl:service>'
+            '</wsdl:definitions>')
+
+def _parse_filter_date(value):
+    # Filters arrive as the audit sends them ('YYYY-MM-DD'); dataset service dates use Tebra's 'MM/DD/YYYY 12:00:00 AM'
+    if not value: return None
+    value = str(value).split()[0]
+    return datetime.datetime.strptime(value, '%m/%d/%Y').date() if '/' in value else datetime.date.fromisoformat(value[:10])
+
+def _patient_created_date(patient_id):
+    # Spreads patients over 2012-2023 deterministically, so GetPatients date windows have something to page through
+    number = int(patient_id) if str(patient_id).isdigit() else sum(map(ord, str(patient_id)))
+    return datetime.date(2012, 1, 1) + datetime.timedelta(days=number * 7919 % 4380)
+
+def _xml_fields(record, fields):
+    return "".join(f"<{field}>{escape(str(record[field]))}</{field}>" if record.get(field) is not None else f'<{field} xsi:nil="true"/>' for field in fields)
+
+class MockTebraService:
+    """Answers GetPatient/GetPatients/GetCharges from a dataset dict ({"patients": {id: fields}, "charges": [fields]}); thread-safe."""
+    def __init__(self, dataset, latency=0.0, jitter=0.0, error_rate=0.0, fault_rate=0.0, padding_fields=0, seed=0, capacity=0, page_limit=1000):
+        self.patients = dataset["patients"]; self.latency = latency; self.jitter = jitter; self.error_rate = error_rate; self.fault_rate = fault_rate; self.padding_fields = padding_fields
+        self.capacity = capacity; self.in_flight = 0; self.peak_in_flight = 0; self.throttled = 0; self.page_limit = page_limit
+        self.patients_by_created = sorted((_patient_created_date(patient_id), patient_id) for patient_id in self.patients)
+        self.charges_by_date = {}
+        for charge in dataset["charges"]: self.charges_by_date.setdefault(_parse_filter_date(charge["ServiceStartDate"]), []).append(charge)
+        self._random = random.Random(seed); self._lock = threading.Lock()
+        self.calls = {"GetPatient": 0, "GetPatients": 0, "GetCharges": 0}; self.errors = 0; self.faults = 0; self.charges_returned = 0
+
+    def _roll(self):
+        with self._lock: return self._random.random(), self._random.uniform(-self.jitter, self.jitter)
+
+    def handle(self, body):
+        """Returns (HTTP status, response XML) for a SOAP request body."""
+        request = etree.fromstring(body); operation_element = request.find(f"{{{SOAP_ENV_NAMESPACE}}}Body")[0]
+        operation = etree.QName(operation_element).localname
+        values = {etree.QName(element).localname: element.text for element in operation_element.iter() if element.text and len(element) == 0}
+        error_roll, jitter = self._roll()
+        with self._lock:
+            if operation in self.calls: self.calls[operation] += 1
+            self.in_flight += 1; self.peak_in_flight = max(self.peak_in_flight, self.in_flight); load = self.in_flight / self.capacity if self.capacity else 0.0
+        try:
+            if self.latency or self.jitter: time.sleep(max(0.0, self.latency + jitter) * max(1.0, load)) # Beyond capacity requests share the server, so each one takes longer
+            if load > 2:
+                with self._lock: self.throttled += 1
+                return 503, self._fault("Server too busy, too many requests. Try again later.")
+            return self._answer(operation, values, error_roll)
+        finally:
+            with self._lock: self.in_flight -= 1
+
+    def _answer(self, operation, values, error_roll):
+        if operation not in self.calls: return 500, self._fault(f"Unknown operation {operation}")
+        if error_roll < self.fault_rate:
+            with self._lock: self.faults += 1
+            return 500, self._fault("Simulated service fault")
+        if error_roll < self.fault_rate + self.error_rate:
+            with self._lock: self.errors += 1
+            return 200, self._envelope(operation, '<ErrorResponse><ErrorMessage>Simulated API error</ErrorMessage><IsError>true</IsError></ErrorResponse>')
+        if operation == "GetPatient": return 200, self._get_patient(values.get("PatientID"))
+        if operation == "GetPatients": return 200, self._get_patients(values)
+        return 200, self._get_charges(values.get("FromServiceDate"), values.get("ToServiceDate"), values.get("PatientName"))
+
+    def _get_patient(self, patient_id):
+        patient = self.patients.get(str(patient_id).strip()) if patient_id is not None else None
+        if patient is None: return self._envelope("GetPatient", '<ErrorResponse><ErrorMessage>Patient not found.</ErrorMessage><IsError>true</IsError></ErrorResponse>')
+        return self._envelope("GetPatient", f'<ErrorResponse><IsError>false</IsError></ErrorResponse><Patient>{_xml_fields(patient, PATIENT_FIELDS)}</Patient>')
+
+    def _get_patients(self, values):
+        # Patients are never modified here, so the last-modified date is the creation date
+        from_date = _parse_filter_date(values.get("FromCreatedDate") or values.get("FromLastModifiedDate")) or datetime.date.min
+        to_date = _parse_filter_date(values.get("ToCreatedDate") or values.get("ToLastModifiedDate")) or datetime.date.max
+        matched = [self.patients[patient_id] for created, patient_id in self.patients_by_created if from_date <= created <= to_date][:self.page_limit]
+        patient_xml = "".join(f"<PatientData>{_xml_fields(patient, PATIENT_FIELDS)}</PatientData>" for patient in matched)
+        return self._envelope("GetPatients", f'<ErrorResponse><IsError>false</IsError></ErrorResponse><Patients>{patient_xml}</Patients>')
+
+    def _get_charges(self, from_date, to_date, patient_name):
+        from_date = _parse_filter_date(from_date); to_date = _parse_filter_date(to_date) or from_date
+        matched = []
+        if from_date:
+            day = from_date
+            while day <= to_date:
+                matched.extend(charge for charge in self.charges_by_date.get(day, ()) if not patient_name or charge.get("PatientName") == patient_name)
+                day += datetime.timedelta(days=1)
+        matched = matched[:self.page_limit]
+        with self._lock: self.charges_returned += len(matched)
+        padding = "".join(f"<UnusedField{i}>padding value {i}</UnusedField{i}>" for i in range(self.padding_fields))
+        charge_xml = "".join(f"<ChargeData>{_xml_fields(charge, CHARGE_FIELDS)}{padding}</ChargeData>" for charge in matched)
+        return self._envelope("GetCharges", f'<ErrorResponse><IsError>false</IsError></ErrorResponse><Charges>{charge_xml}</Charges>')
+
+    @staticmethod
+    def _envelope(operation, result_xml):
+        return (f'<s:Envelope xmlns:s="{SOAP_ENV_NAMESPACE}" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><s:Body><{operation}Response xmlns="{TEBRA_NAMESPACE}">'
+                f'<{operation}Result>{result_xml}</{operation}Result></{operation}Response></s:Body></s:Envelope>')
+
+    @staticmethod
+    def _fault(message):
+        return f'<s:Envelope xmlns:s="{SOAP_ENV_NAMESPACE}"><s:Body><s:Fault><faultcode>s:Server</faultcode><faultstring>{escape(message)}</faultstring></s:Fault></s:Body></s:Envelope>'
+
+    def stats(self):
+        with self._lock: return {"calls": dict(self.calls), "errors": self.errors, "faults": self.faults, "throttled": self.throttled, "peak_in_flight": self.peak_in_flight, "charges_returned": self.charges_returned}
+
+def start_mock_server(service, host="127.0.0.1", port=0):
+    """Starts a threaded HTTP server for service in a daemon thread. Returns (server, wsdl_url); stop with server.shutdown()."""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive, like the real endpoint, so the client's connection pool is exercised
+        def _send(self, status, content, content_type="text/xml; charset=utf-8"):
+            payload = content.encode("utf-8"); self.send_response(status); self.send_header("Content-Type", content_type); self.send_header("Content-Length", str(len(payload))); self.end_headers(); self.wfile.write(payload)
+        def do_GET(self):
+            if self.path.startswith("/stats"): self._send(200, json.dumps(service.stats()), "application/json")
+            else: self._send(200, build_wsdl(service_url, service.padding_fields))
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try: status, content = service.handle(body)
+            except Exception as e: status, content = 500, service._fault(f"Mock server error: {e}")
+            self._send(status, content)
+        def log_message(self, *args): pass
+    server = http.server.ThreadingHTTPServer((host, port), Handler); server.daemon_threads = True
+    service_url = f"http://{host}:{server.server_address[1]}/KareoServices.svc"
+    threading.Thread(target=server.serve_forever, name="mock-tebra", daemon=True).start()
+    return server, f"{service_url}?singleWsdl"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dataset", required=True, help="JSON written by synthetic_audit_data.py.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099, help="0 picks a free port.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every call.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- seconds around --latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls answered with ErrorResponse.IsError.")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="Share of calls answered with a SOAP fault (HTTP 500).")
+    parser.add_argument("--padding-fields", type=int, default=0, help="Unused string fields added to every ChargeData, to mimic real payload sizes.")
+    parser.add_argument("--capacity", type=int, default=0, help="Concurrent requests served at full speed (0: unlimited); beyond that calls slow down, beyond twice that they are throttled.")
+    parser.add_argument("--page-limit", type=int, default=1000, help="Most patients (GetPatients) or charges (GetCharges) one response returns.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    with open(args.dataset, encoding="utf-8") as f: dataset = json.load(f)
+    service = MockTebraService(dataset, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, fault_rate=args.fault_rate, padding_fields=args.padding_fields, seed=args.seed, capacity=args.capacity, page_limit=args.page_limit)
+    server, wsdl_url = start_mock_server(service, args.host, args.port)
+    print(wsdl_url, flush=True) # First stdout line: callers (bench_e2e.py) read the URL from here
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt: pass
+    finally: server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic audit data: an Excel/CSV audit file with the required columns plus the matching Tebra patients and charges
+the mock server (mock_tebra_server.py) answers with. Each row either matches its charge exactly or carries exactly one
+deliberate mismatch, so the expected Verified/Invalid split is known up front.
+
+    python benchmarks/synthetic_audit_data.py --rows 5000 --mismatch-ratio 0.2 -o audit.xlsx --dataset dataset.json
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from tebra_audit_engine import REQUIRED_COLUMNS
+
+FIRST_NAMES = ["John", "Mary", "Ana", "Li", "Omar", "Zoe", "Sam", "Kim", "Raj", "Eva", "Noah", "Ines"]
+LAST_NAMES = ["Smith", "Doe", "Nguyen", "Khan", "Lee", "Brown", "Diaz", "Okafor", "Rossi", "Novak", "Silva", "Haddad"]
+PROVIDERS = ["Jane Roe", "Bob Stone", "Al Park", "Sue Wu", "Omar Farouk"]
+PAYERS = ["Aetna", "Medicare", "United Healthcare", "Cigna", "Humana"]
+LOCATIONS = ["Main Office", "Clinic 2", "North Campus"]
+CPT_CODES = ["99213", "99214", "99215", "90834", "90837", "J1100", "G0439", "36415"]
+AMOUNTS = ["80.00", "100.00", "125.50", "150.25", "200.00", "99.99"]
+MODIFIERS = ["", "", "25", "59", "GT", "95"]
+ICD_CODES = ["E11.9", "I10", "Z00.00", "F41.1", "M54.5", "J06.9"]
+POS_VALUES = [("11", "11"), ("Office", "11"), ("Telehealth Home", "10"), ("10", "10")] # (Excel value, Tebra code)
+MISMATCH_KINDS = ("amount", "cpt", "modifier", "units", "rendering_provider", "icd", "place_of_service", "missing_charge")
+
+def _tebra_date(value): return value.strftime('%m/%d/%Y 12:00:00 AM') # Tebra's date format for DOB and ServiceStartDate
+
+def generate_dataset(rows=1000, patients=None, mismatch_ratio=0.1, days=60, noise_charges=0, start_date=datetime.date(2024, 1, 1), seed=0):
+    """
+    Returns {"rows": [Excel row dicts], "patients": {PatientID: patient fields}, "charges": [charge dicts], "expected": {...}}.
+    mismatch_ratio of the rows get one mismatch from MISMATCH_KINDS; noise_charges extra charges for patients/dates not
+    in the file are added so practice-wide GetCharges windows return realistic extra data.
+    """
+    rnd = random.Random(seed); patients = patients or max(1, rows // 8)
+    patient_records = {}
+    for i in range(patients):
+        first_name = rnd.choice(FIRST_NAMES); last_name = f"{rnd.choice(LAST_NAMES)}{i}" # Unique last names keep name filters unambiguous
+        dob = datetime.date(1940, 1, 1) + datetime.timedelta(days=rnd.randint(0, 25000))
+        patient_records[str(10000 + i)] = {"ID": str(10000 + i), "FirstName": first_name, "LastName": last_name, "PatientFullName": f"{first_name} {last_name}", "DOB": _tebra_date(dob), "_dob": dob}
+    patient_ids = list(patient_records)
+    excel_rows = []; charges = []; used_keys = set(); mismatches = {kind: 0 for kind in MISMATCH_KINDS}
+    for row_number in range(rows):
+        while True: # (patient, DOS, CPT) is unique per row so every row has exactly one candidate charge
+            patient_id = rnd.choice(patient_ids); dos = start_date + datetime.timedelta(days=rnd.randrange(days)); cpt = rnd.choice(CPT_CODES)
+            if (patient_id, dos, cpt) not in used_keys: used_keys.add((patient_id, dos, cpt)); break
+        patient = patient_records[patient_id]; amount = rnd.choice(AMOUNTS); units = rnd.choice([1, 1, 1, 2, 3]); excel_pos, tebra_pos = rnd.choice(POS_VALUES)
+        modifiers = [rnd.choice(MODIFIERS), rnd.choice(MODIFIERS) if rnd.random() < 0.3 else "", "", ""]; icds = [rnd.choice(ICD_CODES), rnd.choice(ICD_CODES) if rnd.random() < 0.5 else "", "", ""]
+        provider = rnd.choice(PROVIDERS); referring = rnd.choice(["", "", "Dr Who"]); payer = rnd.choice(PAYERS); location = rnd.choice(LOCATIONS)
+        claim_id = str(700000 + row_number); encounter_id = str(300000 + row_number)
+        excel_rows.append({"PatientID": patient_id, "PatientName": f"{patient['LastName']}, {patient['FirstName']}", "DOB": patient["_dob"].strftime('%m/%d/%Y'), "DateOfService": dos.strftime('%m/%d/%Y'),
+                           "RenderingProvider": provider, "ReferringProvider": referring, "PlaceOfServiceCode": excel_pos, "ProcedureCode": cpt,
+                           **{f"ProcedureModifier{i}": modifiers[i - 1] for i in range(1, 5)}, "ServiceUnitCount": units, **{f"EncounterDiagnosisID{i}": icds[i - 1] for i in range(1, 5)},
+                           "ServiceChargeAmount": float(amount), "PriIns_CompanyName": payer, "PriIns_CompanyPlanName": f"{payer} PPO", "EncounterID": encounter_id, "claimID": claim_id, "ServiceLocationName": location})
+        charge = {"ID": claim_id, "EncounterID": encounter_id, "PatientID": patient_id, "PatientName": patient["PatientFullName"], "ServiceStartDate": _tebra_date(dos), "ProcedureCode": cpt,
+                  "TotalCharges": amount, "Units": str(units), "RenderingProviderName": provider, "ReferringProviderName": referring or None, "ServiceLocationName": location,
+                  "ServiceLocationPlaceOfServiceCode": tebra_pos, "PrimaryInsuranceCompanyName": payer, **{f"ProcedureModifier{i}": modifiers[i - 1] or None for i in range(1, 5)},
+                  **{f"EncounterDiagnosisID{i}": icds[i - 1] or None for i in range(1, 5)}}
+        if rnd.random() < mismatch_ratio:
+            kind = rnd.choice(MISMATCH_KINDS); mismatches[kind] += 1
+            if kind == "amount": charge["TotalCharges"] = "1.00"
+            elif kind == "cpt": charge["ProcedureCode"] = "99499"
+            elif kind == "modifier": charge["ProcedureModifier1"] = "XU"
+            elif kind == "units": charge["Units"] = str(units + 1)
+            elif kind == "rendering_provider": charge["RenderingProviderName"] = "Other Doctor"
+            elif kind == "icd": charge["EncounterDiagnosisID1"] = "R69"
+            elif kind == "place_of_service": charge["ServiceLocationPlaceOfServiceCode"] = "21"
+            elif kind == "missing_charge": charge = None
+        if charge is not None: charges.append(charge)
+    for i in range(noise_charges):
+        patient = patient_records[rnd.choice(patient_ids)]; dos = start_date + datetime.timedelta(days=rnd.randrange(days))
+        charges.append({"ID": str(900000 + i), "EncounterID": str(800000 + i), "PatientID": patient["ID"], "PatientName": patient["PatientFullName"], "ServiceStartDate": _tebra_date(dos),
+                        "ProcedureCode": "99024", "TotalCharges": "0.00", "Units": "1", "RenderingProviderName": rnd.choice(PROVIDERS), "ServiceLocationName": rnd.choice(LOCATIONS),
+                        "ServiceLocationPlaceOfServiceCode": "11", "PrimaryInsuranceCompanyName": rnd.choice(PAYERS), "EncounterDiagnosisID1": rnd.choice(ICD_CODES)})
+    for patient in patient_records.values(): patient.pop("_dob")
+    mismatched_rows = sum(mismatches.values())
+    return {"rows": excel_rows, "patients": patient_records, "charges": charges, "expected": {"rows": rows, "verified": rows - mismatched_rows, "invalid": mismatched_rows, "mismatches": mismatches}}
+
+def dataset_frame(dataset):
+    df = pd.DataFrame(dataset["rows"]); missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing: raise ValueError(f"Generated rows miss required columns: {missing}")
+    return df
+
+def write_audit_file(dataset, path):
+    """Writes the Excel-side rows as .xlsx or .csv (by extension)."""
+    df = dataset_frame(dataset)
+    if path.lower().endswith('.csv'): df.to_csv(path, index=False)
+    else: df.to_excel(path, index=False)
+    return path
+
+def write_dataset(dataset, path):
+    """Writes the Tebra-side patients/charges (and the expected split) as JSON for mock_tebra_server.py."""
+    with open(path, 'w', encoding='utf-8') as f: json.dump({key: dataset[key] for key in ("patients", "charges", "expected")}, f)
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--patients", type=int, default=None, help="Distinct patients (default: rows / 8).")
+    parser.add_argument("--mismatch-ratio", type=float, default=0.1)
+    parser.add_argument("--days", type=int, default=60, help="Spread of dates of service.")
+    parser.add_argument("--noise-charges", type=int, default=0, help="Extra Tebra charges that match no row.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="synthetic_audit.xlsx", help="Audit file to write (.xlsx or .csv).")
+    parser.add_argument("--dataset", default="synthetic_dataset.json", help="Tebra-side JSON for the mock server.")
+    args = parser.parse_args(argv)
+    dataset = generate_dataset(args.rows, args.patients, args.mismatch_ratio, args.days, args.noise_charges, seed=args.seed)
+    write_audit_file(dataset, args.output); write_dataset(dataset, args.dataset)
+    print(f"Wrote {args.rows} rows to {args.output} and {len(dataset['patients'])} patients / {len(dataset['charges'])} charges to {args.dataset} (expected: {dataset['expected']}).")
+
+if __name__ == "__main__":
+    main()
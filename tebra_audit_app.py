@@ -1,223 +1,34 @@
 # -*- coding: utf-8 -*-
 """
 Streamlit App for Tebra Audit v2 (Corrected Syntax Error)
+The audit itself lives in tebra_audit_engine.py and runs as a background job (tebra_audit_jobs.py); this script only
+collects inputs, submits jobs, polls their progress and displays results.
 """
 
 # -----------------------------------------------------------------------------
 # PART 1: Dependencies
 # -----------------------------------------------------------------------------
 import streamlit as st
-import pandas as pd
-import zeep
-import zeep.helpers
-from zeep.exceptions import Fault as SoapFault
-from requests import Session
-from zeep.transports import Transport
 import datetime # Import the module
-import time
-import re
-from decimal import Decimal, ROUND_HALF_UP
-import io
-import base64 # For download link
-
-# -----------------------------------------------------------------------------
-# PART 5: Utility Functions
-# -----------------------------------------------------------------------------
-# (These functions remain the same as the final working version in Colab,
-#  except for the corrected normalize_dob)
-
-print("--- Defining Utility Functions (Part 5 - Corrected normalize_dob) ---") # Keep print for debugging module load
-
-def normalize_string(text, remove_spaces=False):
-  if isinstance(text, str): text = text.lower().strip(); text = re.sub(r'[.,()-]', '', text);
-  if remove_spaces: text = re.sub(r'\s+', '', text)
-  else: text = ' '.join(text.split())
-  return text; return text
-def normalize_code(code):
-  if isinstance(code, str): return re.sub(r'[^a-zA-Z0-9]', '', code).upper()
-  elif isinstance(code, (int, float)): return str(int(code))
-  return code
-def normalize_name(name):
-    if isinstance(name, str): name = re.sub(r'[,.\s]*(md|do|rn|np|pa|pcp|facp|dpm|lcsw|lpcc|rnfa|fnp|aprn)[\s.]*$', '', name.strip(), flags=re.IGNORECASE | re.DOTALL); name = name.lower(); name = re.sub(r'(?<![-’\'])[,."](?![-’\'])', '', name); name = ' '.join(name.split()); return name
-    return name
-def compare_names(excel_name, tebra_name):
-    norm_excel = normalize_name(excel_name); norm_tebra = normalize_name(tebra_name);
-    if not norm_excel or not norm_tebra: return not norm_excel and not norm_tebra
-    parts_excel = norm_excel.split(); parts_tebra = norm_tebra.split();
-    if not parts_excel or not parts_tebra: return False
-    first_name_match = (parts_excel[0] == parts_tebra[0]); last_name_match = (parts_excel[-1] == parts_tebra[-1])
-    return first_name_match and last_name_match
-
-# *** CORRECTED normalize_dob function ***
-def normalize_dob(date_input):
-    """
-    Attempts to parse a date string or datetime object into YYYY-MM-DD format.
-    Handles MM/DD/YYYY and YYYY-MM-DD string inputs.
-    """
-    if date_input is None:
-        return None
-
-    date_str = None
-    # Check if input is datetime.datetime object
-    if isinstance(date_input, datetime.datetime):
-        try:
-            return date_input.strftime('%Y-%m-%d')
-        except ValueError:
-             # st.warning(f"Could not format datetime object {date_input}.") # Optional UI warning
-             return None
-    # Check if input is already a string
-    elif isinstance(date_input, str):
-        date_str = date_input.strip()
-    # Try converting other types to string
-    else:
-        try:
-            date_str = str(date_input).strip()
-        except Exception:
-            # st.warning(f"Could not convert date input '{date_input}' to string.") # Optional UI warning
-            return None
-
-    # *** Check if date_str became empty AFTER potential conversion/stripping ***
-    if not date_str:
-        return None
-
-    # At this point, date_str should be a non-empty string
-    # Clean up potential time part
-    try:
-        date_part = date_str.split()[0]
-    except IndexError:
-        # st.warning(f"Could not extract date part from '{date_str}'.") # Optional UI warning
-        return None
-    except AttributeError: # Should not happen if not date_str check above worked
-        return None
-
-    # Try parsing known formats
-    try:
-        dt = datetime.datetime.strptime(date_part, '%m/%d/%Y')
-        return dt.strftime('%Y-%m-%d')
-    except ValueError:
-        try:
-            dt = datetime.datetime.strptime(date_part, '%Y-%m-%d')
-            return dt.strftime('%Y-%m-%d')
-        except ValueError:
-            # st.warning(f"Could not parse date string '{date_part}' using known formats.") # Optional UI warning
-            return None
-# *** End of corrected normalize_dob ***
-
-def compare_dob(excel_dob_input, tebra_dob_str):
-    norm_excel = normalize_dob(excel_dob_input); norm_tebra = normalize_dob(tebra_dob_str)
-    if not norm_excel or not norm_tebra: return False if norm_excel or norm_tebra else True
-    return norm_excel == norm_tebra
-def get_nested_attribute(obj, attribute_path, default=None):
-    current = obj;
-    try:
-        for attr in attribute_path.split('.'):
-            if current is None: return default
-            current = getattr(current, attr, None)
-        return current if current is not None else default
-    except AttributeError: return default
-def round_half_up(n, decimals=2):
-    if n is None: return None
-    try: number = Decimal(str(n))
-    except (decimal.InvalidOperation, ValueError, TypeError): return None
-    quantizer = Decimal('1e-' + str(decimals)); return number.quantize(quantizer, rounding=ROUND_HALF_UP)
-def compare_providers(excel_provider, tebra_provider): return compare_names(excel_provider, tebra_provider)
-def compare_pos_codes(excel_pos, tebra_pos):
-    norm_excel = normalize_string(excel_pos, remove_spaces=True); norm_tebra = normalize_string(str(tebra_pos), remove_spaces=True)
-    if not norm_excel or not norm_tebra: return not norm_excel and not norm_tebra
-    if norm_excel == 'office' and norm_tebra == '11': return True
-    if ('telehealth' in norm_excel and 'home' in norm_excel) and norm_tebra == '10': return True
-    if norm_excel == norm_tebra: return True; return False
-def compare_ins_plans(excel_plan, tebra_plan): # Assuming this custom logic is desired now
-    norm_excel = normalize_string(excel_plan, remove_spaces=True); norm_tebra = normalize_string(tebra_plan, remove_spaces=True)
-    if not norm_excel or not norm_tebra: return not norm_excel and not norm_tebra
-    excel_is_bcbs = norm_excel == 'bcbs'; tebra_is_bluecross = 'bluecross' in norm_tebra or 'bcbs' in norm_tebra
-    if excel_is_bcbs and tebra_is_bluecross: return True
-    if tebra_is_bluecross and ('bluecross' in norm_excel or 'bcbs' in norm_excel): return True
-    if norm_excel == norm_tebra: return True; return False
-def format_mismatch_reason(field, excel_val, tebra_val, identifier=None):
-  excel_str = str(excel_val) if excel_val is not None else 'NULL'; tebra_str = str(tebra_val) if tebra_val is not None else 'NULL'
-  reason = f"{field} Mismatch (Excel: '{excel_str}', Tebra: '{tebra_str}')"
-  if identifier: reason += f" for Claim ID {identifier}"
-  return reason
-# --- End of Part 5 Functions ---
-
-# -----------------------------------------------------------------------------
-# PART 2 & 6 Functions (Adapted for Streamlit where needed)
-# -----------------------------------------------------------------------------
-
-@st.cache_resource(ttl=3600)
-def create_api_client(wsdl_url="https://webservice.kareo.com/services/soap/2.1/KareoServices.svc?singleWsdl"):
-    st.write("🔌 Connecting to Tebra SOAP API...")
-    try:
-        session = Session(); session.timeout = 120; transport = Transport(session=session, timeout=120)
-        client = zeep.Client(wsdl=wsdl_url, transport=transport)
-        st.write("✅ Connected to Tebra API.")
-        return client
-    except Exception as e: st.error(f"❌ Failed to connect to Tebra API: {e}"); return None
-
-def build_request_header(credentials, client):
-    if not client: st.error("❌ Cannot build header without API client."); return None
-    try:
-        header_type = client.get_type('ns0:RequestHeader')
-        return header_type(CustomerKey=credentials['CustomerKey'], User=credentials['User'], Password=credentials['Password'])
-    except Exception as e: st.error(f"❌ Error building request header: {e}"); return None
+import json
+import pandas as pd
+from tebra_audit_engine import PROGRESS_PHASE_LABELS, CHARGE_FETCH_MODES, MATCH_MODES, DEFAULT_PREFETCH_WORKERS, MAX_PREFETCH_WORKERS
+from tebra_response_cache import DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, DEFAULT_MAX_SIZE_MB
+from tebra_audit_metrics import RunMetrics
+from tebra_request_control import DEFAULT_MAX_RETRIES
+from tebra_patient_directory import DEFAULT_DIRECTORY_PATH
+from tebra_audit_checkpoint import DEFAULT_CHECKPOINT_PATH, DEFAULT_CHECKPOINT_ROWS, DEFAULT_REUSE_MAX_AGE_HOURS
+from tebra_audit_jobs import AuditJobRunner, JobStore, DEFAULT_JOB_STORE_PATH, ACTIVE_JOB_STATUSES, JOB_STATUS_LABELS
+from tebra_audit_batch import load_practice_credentials, assign_practice, batch_file_frame, batch_practice_frame, CREDENTIAL_COLUMNS
 
-def get_tebra_patient_soap(client, header, patient_id):
-    soap_method_name = "GetPatient"; request_type_name = '{http://www.kareo.com/api/schemas/}GetPatientReq'; filter_type_name = '{http://www.kareo.com/api/schemas/}SinglePatientFilter'
-    try: patient_id_int = int(patient_id)
-    except (ValueError, TypeError): return None, f"Invalid Patient ID format: '{patient_id}'."
-    try:
-        SinglePatientFilter_Type = client.get_type(filter_type_name); GetPatientReq_Type = client.get_type(request_type_name)
-        filter_object = SinglePatientFilter_Type(PatientID=patient_id_int); patient_request_object = GetPatientReq_Type(RequestHeader=header, Filter=filter_object)
-        response = client.service.GetPatient(request=patient_request_object)
-        if hasattr(response, 'ErrorResponse') and response.ErrorResponse.IsError: error_msg = get_nested_attribute(response, 'ErrorResponse.ErrorMessage', 'Unknown API error'); return None, f"API Error ({soap_method_name}): {error_msg}"
-        if not hasattr(response, 'Patient') or not response.Patient: return None, f"Patient data object not found in response for ID {patient_id_int}."
-        return response, None
-    except zeep.exceptions.Fault as fault: return None, f"SOAP Fault ({soap_method_name} {patient_id_int}): {fault.message}"
-    except (TypeError, AttributeError, ValueError, zeep.exceptions.Error) as e: return None, f"Zeep/Request Error ({soap_method_name} {patient_id_int}): {type(e).__name__} - {e}"
-    except Exception as e: return None, f"Unexpected Error ({soap_method_name} {patient_id_int}): {type(e).__name__} - {e}"
+JOB_POLL_SECONDS = 2 # How often the job list refreshes while a job is queued or running
 
-def get_tebra_charges_soap(client, header, patient_name, dos_datetime):
-    soap_method_name = "GetCharges"; request_type_name = '{http://www.kareo.com/api/schemas/}GetChargesReq'; filter_type_name = '{http://www.kareo.com/api/schemas/}ChargeFilter'
-    try: dos_str = dos_datetime.strftime('%Y-%m-%d')
-    except (AttributeError) as e: return [], f"Invalid DOS input for GetCharges: '{dos_datetime}'. Error: {e}"
-    if not patient_name: return [], "Cannot fetch charges without a valid patient name."
-    try:
-        ChargeFilter_Type = client.get_type(filter_type_name); GetChargesReq_Type = client.get_type(request_type_name)
-        charge_filter_object = ChargeFilter_Type(PatientName=patient_name, FromServiceDate=dos_str, ToServiceDate=dos_str)
-        charge_request_object = GetChargesReq_Type(RequestHeader=header, Filter=charge_filter_object)
-        response = client.service.GetCharges(request=charge_request_object)
-        if hasattr(response, 'ErrorResponse') and response.ErrorResponse.IsError: error_msg = get_nested_attribute(response, 'ErrorResponse.ErrorMessage', 'Unknown API error'); return [], f"API Error ({soap_method_name}): {error_msg}"
-        charges_data_container = get_nested_attribute(response, 'Charges.ChargeData', default=[]);
-        if charges_data_container is None: charges_list = []
-        elif not isinstance(charges_data_container, list): charges_list = [charges_data_container]
-        else: charges_list = charges_data_container
-        return charges_list, None
-    except zeep.exceptions.Fault as fault: return [], f"SOAP Fault ({soap_method_name} '{patient_name}', {dos_str}): {fault.message}"
-    except (TypeError, AttributeError, ValueError, zeep.exceptions.Error) as e: return [], f"Zeep/Request Error ({soap_method_name} '{patient_name}', {dos_str}): {type(e).__name__} - {e}"
-    except Exception as e: return [], f"Unexpected Error ({soap_method_name} '{patient_name}', {dos_str}): {type(e).__name__} - {e}"
+@st.cache_resource
+def get_job_runner():
+    # One runner per server process, shared by every browser session; it also caches the zeep client for its jobs
+    return AuditJobRunner(JobStore(DEFAULT_JOB_STORE_PATH))
 
-def find_matching_charge(excel_row_data, tebra_charges_list):
-    excel_claim_id = None
-    try:
-        if isinstance(excel_row_data, pd.Series):
-            excel_cpt = normalize_code(excel_row_data.get('ProcedureCode')); excel_charge = round_half_up(excel_row_data.get('ServiceChargeAmount'), decimals=2); excel_claim_id = str(excel_row_data.get('claimID', 'UNKNOWN'))
-        else:
-             excel_cpt = normalize_code(excel_row_data.get('ProcedureCode')); excel_charge = round_half_up(excel_row_data.get('ServiceChargeAmount'), decimals=2); excel_claim_id = str(excel_row_data.get('claimID', 'UNKNOWN'))
-        potential_matches = []
-        for tebra_charge in tebra_charges_list:
-            tebra_cpt = normalize_code(get_nested_attribute(tebra_charge, 'ProcedureCode'))
-            if excel_cpt == tebra_cpt: potential_matches.append(tebra_charge)
-        if not potential_matches: return None, f"CPT Mismatch (Excel CPT: {excel_cpt} not found in Tebra charges for Claim ID {excel_claim_id})"
-        for tebra_charge in potential_matches:
-            tebra_charge_amt = round_half_up(get_nested_attribute(tebra_charge, 'TotalCharges'), decimals=2)
-            if excel_charge is not None and tebra_charge_amt is not None and excel_charge == tebra_charge_amt: return tebra_charge, None
-        first_potential_tebra_amt = round_half_up(get_nested_attribute(potential_matches[0], 'TotalCharges'), decimals=2) if potential_matches else 'N/A'
-        return None, f"Amount Mismatch (Excel: {excel_charge}, Tebra: {first_potential_tebra_amt} for Claim ID {excel_claim_id})"
-    except Exception as e:
-        claim_id_str = excel_claim_id if excel_claim_id is not None else 'UNKNOWN'
-        return None, f"Code error in find_matching_charge for Claim ID {claim_id_str}: {e}"
-# --- End of Part 6 Functions ---
+def format_job_time(timestamp): return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else ""
 
 # -----------------------------------------------------------------------------
 # Streamlit App Main Section
@@ -230,188 +41,164 @@ st.set_page_config(
 )
 
 st.title("🩺 Tebra Charge Audit Tool - By Panacea Smart Solutions")
-st.markdown("Upload your Excel audit file and enter Tebra credentials to run the audit.")
+st.markdown("Upload your Excel audit file and enter Tebra credentials to run the audit, or audit many practices' files at once in batch mode.")
 
 # --- Input Area ---
 with st.sidebar:
-    st.header("Tebra Credentials")
-    practice_name = st.text_input("Practice Name", key="practice_name")
-    customer_key = st.text_input("Customer Key", type="password", key="customer_key")
-    username = st.text_input("Username (email)", key="username")
-    password = st.text_input("Password", type="password", key="password")
-
-    st.header("Upload Audit File")
-    uploaded_file = st.file_uploader("Choose an Excel file (.xlsx)", type=["xlsx"])
-
+    audit_mode_labels = {"single": "Single file", "batch": "Batch (many practices)"}
+    audit_mode = st.radio("Audit mode", options=list(audit_mode_labels), format_func=audit_mode_labels.get, key="audit_mode", horizontal=True)
+    uploaded_file = batch_files = credentials_file = None; practice_name = customer_key = username = password = ""
+    if audit_mode == "single":
+        st.header("Tebra Credentials")
+        practice_name = st.text_input("Practice Name", key="practice_name")
+        customer_key = st.text_input("Customer Key", type="password", key="customer_key")
+        username = st.text_input("Username (email)", key="username")
+        password = st.text_input("Password", type="password", key="password")
+
+        st.header("Upload Audit File")
+        uploaded_file = st.file_uploader("Choose an Excel (.xlsx) or CSV file", type=["xlsx", "csv"])
+    else:
+        st.header("Batch Files")
+        batch_files = st.file_uploader("Choose the audit files (.xlsx or CSV)", type=["xlsx", "csv"], accept_multiple_files=True, key="batch_files")
+        credentials_file = st.file_uploader("Practice credentials (.csv, .xlsx or .json)", type=["csv", "xlsx", "json"], key="credentials_file",
+                                            help=f"One row per practice with {', '.join(CREDENTIAL_COLUMNS)} columns and an optional Files column of ';'-separated file name patterns. Without Files, a file belongs to the practice whose name appears in its file name.")
+
+    st.header("Audit Settings")
+    prefetch_workers = st.number_input("Concurrent Tebra requests", min_value=1, max_value=MAX_PREFETCH_WORKERS, value=DEFAULT_PREFETCH_WORKERS, step=1, key="prefetch_workers", help="Number of GetPatient/GetCharges requests sent to Tebra in parallel at the start of the audit.")
+    adaptive_concurrency = st.checkbox("Adapt concurrency to Tebra", value=True, key="adaptive_concurrency", help=f"Raises the number of parallel requests (up to {MAX_PREFETCH_WORKERS}) while Tebra answers quickly and backs off when responses slow down, fault or are throttled.")
+    max_retries = st.number_input("Retries per request", min_value=0, max_value=10, value=DEFAULT_MAX_RETRIES, step=1, key="max_retries", help="Transient failures (SOAP faults, timeouts, throttling) are retried with a randomized, growing delay before the row is reported as an error.")
+    charge_fetch_mode_labels = {"auto": "Automatic", "patient": "One request per patient (DOS span)", "practice": "Practice-wide date windows"}
+    charge_fetch_mode = st.selectbox("Charge lookup strategy", options=list(CHARGE_FETCH_MODES), format_func=charge_fetch_mode_labels.get, key="charge_fetch_mode", help="How Excel rows are grouped into GetCharges requests.")
+    match_mode_labels = {"join": "Set-based (all rows at once)", "row": "Row by row"}
+    match_mode = st.selectbox("Charge matching", options=list(MATCH_MODES), format_func=match_mode_labels.get, key="match_mode", help="Both produce the same results; set-based matching is faster on large files.")
+
+    st.header("Response Cache")
+    use_response_cache = st.checkbox("Reuse Tebra responses across runs", value=False, key="use_response_cache", help=f"Stores GetPatient/GetCharges responses in a local SQLite file ({DEFAULT_CACHE_PATH}) so re-audits skip repeated API calls. Leave it off when re-auditing after corrections in Tebra: cached responses do not show them until they expire.")
+    refresh_response_cache = st.checkbox("Refresh cached responses", value=False, key="refresh_response_cache", help="Bypass cached responses for this run and store fresh ones from Tebra.")
+    cache_ttl_hours = st.number_input("Cache lifetime (hours)", min_value=1, max_value=24 * 30, value=DEFAULT_TTL_HOURS, step=1, key="cache_ttl_hours")
+    cache_max_size_mb = st.number_input("Cache size limit (MB)", min_value=16, max_value=10240, value=DEFAULT_MAX_SIZE_MB, step=16, key="cache_max_size_mb")
+
+    st.header("Checkpoints")
+    resume_runs = st.checkbox("Checkpoint and resume interrupted runs", value=True, key="resume_runs", help=f"Saves results to {DEFAULT_CHECKPOINT_PATH} as the audit goes; running the same file again keeps the rows already matched and re-audits the rest.")
+    incremental_audit = st.checkbox("Only re-audit new or changed rows", value=False, key="incremental_audit", help="Keeps the earlier verdict of verified rows whose audited columns are unchanged since a previous run for this practice. Invalid rows are always re-audited, so corrections made in Tebra are picked up.")
+    reuse_max_age_hours = st.number_input("Reuse verified rows for (hours)", min_value=1, max_value=24 * 30, value=DEFAULT_REUSE_MAX_AGE_HOURS, step=1, key="reuse_max_age_hours", help="Verified rows audited longer ago than this are audited again.")
+    checkpoint_rows = st.number_input("Rows per checkpoint", min_value=50, max_value=100000, value=DEFAULT_CHECKPOINT_ROWS, step=50, key="checkpoint_rows")
+
+    st.header("Patient Directory")
+    patient_directory = st.checkbox("Prefetch the practice's patient directory", value=False, key="patient_directory", help="Loads all of the practice's patients in a few paged GetPatients requests instead of one GetPatient request per PatientID. Best for large files; IDs missing from the directory are still fetched one by one.")
+    persist_directory = st.checkbox("Keep the directory between runs", value=True, key="persist_directory", help=f"Stores the directory in {DEFAULT_DIRECTORY_PATH}; later runs only fetch patients added or changed since.")
+    refresh_directory = st.checkbox("Refresh the stored directory", value=False, key="refresh_directory", help="Fetch every patient again for this run.")
+
+job_runner = get_job_runner()
+session_job_ids = st.session_state.setdefault("audit_job_ids", []) # Only jobs submitted from this browser session are listed: their summaries and results hold patient data
 run_button = st.button("Run Audit")
 
-# --- Processing and Output Area ---
-if run_button and uploaded_file:
+# --- Job Submission ---
+# The WSDL location is server configuration ($TEBRA_WSDL_PATH, see DEFAULT_AUDIT_SETTINGS), never a browser input: it names a file the server opens
+settings = {"prefetch_workers": prefetch_workers, "adaptive_concurrency": adaptive_concurrency, "max_retries": max_retries, "charge_fetch_mode": charge_fetch_mode, "match_mode": match_mode,
+            "use_response_cache": use_response_cache, "refresh_response_cache": refresh_response_cache, "cache_ttl_hours": cache_ttl_hours, "cache_max_size_mb": cache_max_size_mb,
+            "resume_runs": resume_runs, "incremental_audit": incremental_audit, "reuse_max_age_hours": reuse_max_age_hours, "checkpoint_rows": checkpoint_rows,
+            "patient_directory": patient_directory, "persist_directory": persist_directory, "refresh_directory": refresh_directory}
+if audit_mode == "batch":
+    if run_button and batch_files and credentials_file:
+        try: practices = load_practice_credentials(credentials_file.getvalue(), credentials_file.name)
+        except Exception as e: st.error(f"❌ Error reading the credentials file: {e}")
+        else:
+            unassigned = [(uploaded.name, error) for uploaded in batch_files for _, error in [assign_practice(uploaded.name, practices)] if error]
+            for file_name, error in unassigned: st.warning(f"⚠️ {file_name} will be skipped: {error}")
+            job_id = job_runner.submit_batch([(uploaded.name, uploaded.getvalue()) for uploaded in batch_files], practices, settings)
+            session_job_ids.append(job_id); st.session_state["selected_job_id"] = job_id
+            st.success(f"🚀 Batch of {len(batch_files)} files for {len(practices)} practices submitted. Practices are audited in parallel in the background.")
+    else:
+        if not batch_files: st.info("Please upload the audit files of the batch using the sidebar.")
+        if not credentials_file: st.info("Please upload the practice credentials file in the sidebar.")
+        if batch_files and credentials_file and not run_button: st.info("Click 'Run Audit' to begin.")
+elif run_button and uploaded_file:
     if not all([practice_name, customer_key, username, password]): st.error("❌ Please enter all Tebra credentials.")
     else:
-        st.info("🚀 Starting Audit Process...")
-        with st.spinner('Connecting to Tebra API...'):
-            client = create_api_client()
-            if client: credentials = {"CustomerKey": customer_key, "User": username, "Password": password}; header = build_request_header(credentials, client)
-            else: header = None
-        if not client or not header: st.error("❌ Tebra connection failed."); st.stop()
-        st.success("✅ Connected to Tebra.")
-
-        try:
-            st.info(f"Reading Excel file: {uploaded_file.name}")
-            df = pd.read_excel(uploaded_file, dtype={'PatientID': str, 'claimID': str, 'EncounterID': str}, engine='openpyxl', keep_default_na=False) # Ensure IDs read as string
-            df = df.fillna('')
-            df.reset_index(inplace=True); df.rename(columns={'index': 'Original Excel Row Index'}, inplace=True)
-            st.success(f"✅ Read {len(df)} rows from Excel file.")
-        except Exception as e: st.error(f"❌ Error reading Excel file: {e}"); st.stop()
-
-        # Simplified column check
-        required_cols_list = ['PatientID', 'PatientName', 'DOB', 'DateOfService', 'RenderingProvider','ReferringProvider', 'PlaceOfServiceCode', 'ProcedureCode','ProcedureModifier1', 'ProcedureModifier2', 'ProcedureModifier3', 'ProcedureModifier4','ServiceUnitCount', 'EncounterDiagnosisID1', 'EncounterDiagnosisID2','EncounterDiagnosisID3', 'EncounterDiagnosisID4', 'ServiceChargeAmount','PriIns_CompanyName', 'PriIns_CompanyPlanName', 'EncounterID', 'claimID']
-        if not all(col in df.columns for col in required_cols_list):
-             st.error("❌ Error: One or more required columns are missing. Check file headers."); st.stop()
-        else: st.success("✅ Required Excel columns verified.")
-
-        tebra_patient_cache = {}; tebra_charges_cache = {}; audit_results_list = []
-        total_rows = len(df); progress_bar = st.progress(0); status_text = st.empty()
-
-        st.info("⏳ Running comparisons against Tebra data...")
-        start_time = time.time()
-
-        for index, row in df.iterrows():
-            excel_row_num_display = index + 2
-            percent_complete = (index + 1) / total_rows; progress_bar.progress(min(1.0, percent_complete)); status_text.text(f"Processing Excel row {excel_row_num_display}/{total_rows+1}...")
-            current_result_data = {"Excel Row": excel_row_num_display, "Status": "Error", "Reason": "Processing started", "Excel Data": row.to_dict()}
-            mismatch_reasons = []; excel_patient_id_str = None; excel_claim_id = None
-
-            # 1. Extract Data
-            try:
-                excel_patient_id_str = str(row.get('PatientID', '')).strip(); excel_claim_id = str(row.get('claimID', 'UNKNOWN'))
-                if not excel_patient_id_str: raise ValueError("Missing PatientID")
-                current_result_data["Excel PatientID"] = excel_patient_id_str; current_result_data["Excel claimID"] = excel_claim_id
-                excel_patient_name_raw = row.get('PatientName'); excel_dob_raw = row.get('DOB'); excel_dos_raw = row.get('DateOfService')
-                if pd.isna(excel_dos_raw): raise ValueError("Missing DateOfService")
-                try: excel_dos_dt = excel_dos_raw if isinstance(excel_dos_raw, datetime.datetime) else pd.to_datetime(excel_dos_raw).to_pydatetime()
-                except Exception as date_err: raise ValueError(f"Invalid DateOfService format '{excel_dos_raw}': {date_err}") from date_err
-                excel_dos_str = excel_dos_dt.strftime('%Y-%m-%d')
-                current_result_data["Excel DOS"] = excel_dos_str; current_result_data["Excel ProcCode"] = row.get('ProcedureCode')
-            except Exception as e: current_result_data["Reason"] = f"Error reading Excel data: {e}"; audit_results_list.append(current_result_data); continue
-
-            # 2. Get Patient
-            tebra_patient_response, api_error_pat = tebra_patient_cache.get(excel_patient_id_str, (None, None))
-            if tebra_patient_response is None and api_error_pat is None: tebra_patient_response, api_error_pat = get_tebra_patient_soap(client, header, excel_patient_id_str); tebra_patient_cache[excel_patient_id_str] = (tebra_patient_response, api_error_pat)
-
-            # 3. Process Patient
-            tebra_patient_name_for_filter = None
-            if api_error_pat: mismatch_reasons.append(f"Patient Fetch Error: {api_error_pat}"); current_result_data["Status"] = "Error"
-            elif not tebra_patient_response or not hasattr(tebra_patient_response, 'Patient') or not tebra_patient_response.Patient: mismatch_reasons.append(f"No valid Tebra patient data for ID {excel_patient_id_str}."); current_result_data["Status"] = "Error"
-            else:
-                try:
-                    tebra_patient_data = tebra_patient_response.Patient; tebra_patient_name_for_filter = get_nested_attribute(tebra_patient_data, 'PatientFullName'); tebra_first_name = get_nested_attribute(tebra_patient_data, 'FirstName'); tebra_last_name = get_nested_attribute(tebra_patient_data, 'LastName'); tebra_dob_str = get_nested_attribute(tebra_patient_data, 'DOB')
-                    if not tebra_patient_name_for_filter and tebra_first_name and tebra_last_name: tebra_patient_name_for_filter = f"{tebra_first_name} {tebra_last_name}"
-                    tebra_name_for_compare = tebra_patient_name_for_filter if tebra_patient_name_for_filter else "MISSING_NAME"
-                    excel_name_parts = [p.strip() for p in str(excel_patient_name_raw).split(',')] if excel_patient_name_raw else []; excel_name_normalized = f"{excel_name_parts[1]} {excel_name_parts[0]}" if len(excel_name_parts)==2 else excel_patient_name_raw
-                    if not compare_names(excel_name_normalized, tebra_name_for_compare): mismatch_reasons.append(format_mismatch_reason("Patient Name", excel_patient_name_raw, tebra_name_for_compare))
-                    if not compare_dob(excel_dob_raw, tebra_dob_str): mismatch_reasons.append(format_mismatch_reason("Patient DOB", excel_dob_raw, tebra_dob_str))
-                    if not mismatch_reasons: current_result_data["Status"] = "Pending"
-                except Exception as e: mismatch_reasons.append(f"Error processing Tebra patient data: {e}"); current_result_data["Status"] = "Error"
-
-            # 4. Get Charges
-            tebra_charges = []; api_error_chg = None
-            proceed_to_charge_check = (current_result_data["Status"] != "Error" and tebra_patient_name_for_filter)
-            if proceed_to_charge_check:
-                cache_key_chg = (tebra_patient_name_for_filter, excel_dos_str)
-                tebra_charges, api_error_chg = tebra_charges_cache.get(cache_key_chg, ([], None))
-                if not tebra_charges and api_error_chg is None: tebra_charges, api_error_chg = get_tebra_charges_soap(client, header, tebra_patient_name_for_filter, excel_dos_dt); tebra_charges_cache[cache_key_chg] = (tebra_charges, api_error_chg)
-
-            # 5. Process Charges & Compare
-            if proceed_to_charge_check:
-                if api_error_chg: mismatch_reasons.append(f"Charge Fetch Error: {api_error_chg}"); current_result_data["Status"] = "Error"
-                elif not tebra_charges: mismatch_reasons.append("No matching charge found in Tebra (None returned for name/DOS)"); current_result_data["Status"] = "Mismatch"
-                else:
-                    matching_tebra_charge, find_charge_reason = find_matching_charge(row, tebra_charges)
-                    if not matching_tebra_charge: mismatch_reasons.append(find_charge_reason); current_result_data["Status"] = "Mismatch"
-                    else:
-                        if current_result_data["Status"] == "Pending": current_result_data["Status"] = "Match";
-                        else: current_result_data["Status"] = "Mismatch"
-                        def check_field(excel_val, tebra_val, field_name, compare_func, identifier):
-                             if not compare_func(excel_val, tebra_val): mismatch_reasons.append(format_mismatch_reason(field_name, excel_val, tebra_val, identifier=identifier)); current_result_data["Status"] = "Mismatch"
-                        compare_normalized_str = lambda x, y: normalize_string(x) == normalize_string(y)
-                        compare_normalized_num_str = lambda x, y: normalize_code(str(x)) == normalize_code(str(y))
-                        check_field(row.get('claimID'), get_nested_attribute(matching_tebra_charge, 'ID'), "Claim ID", compare_normalized_num_str, identifier=excel_claim_id)
-                        check_field(row.get('EncounterID'), get_nested_attribute(matching_tebra_charge, 'EncounterID'), "Encounter ID", compare_normalized_num_str, identifier=excel_claim_id)
-                        check_field(row.get('RenderingProvider'), get_nested_attribute(matching_tebra_charge, 'RenderingProviderName'), "Rendering Provider", compare_providers, identifier=excel_claim_id)
-                        excel_ref_provider = row.get('ReferringProvider'); tebra_ref_provider = get_nested_attribute(matching_tebra_charge, 'ReferringProviderName')
-                        if excel_ref_provider and not pd.isna(excel_ref_provider): check_field(excel_ref_provider, tebra_ref_provider, "Referring Provider", compare_providers, identifier=excel_claim_id)
-                        elif tebra_ref_provider: mismatch_reasons.append(format_mismatch_reason("Referring Provider", excel_ref_provider, tebra_ref_provider, identifier=excel_claim_id)); current_result_data["Status"] = "Mismatch"
-                        check_field(row.get('ServiceLocationName'), get_nested_attribute(matching_tebra_charge, 'ServiceLocationName'), "Service Location", compare_normalized_str, identifier=excel_claim_id)
-                        if not compare_pos_codes(row.get('PlaceOfServiceCode'), get_nested_attribute(matching_tebra_charge, 'ServiceLocationPlaceOfServiceCode')): mismatch_reasons.append(format_mismatch_reason("PlaceOfService Code", row.get('PlaceOfServiceCode'), get_nested_attribute(matching_tebra_charge, 'ServiceLocationPlaceOfServiceCode'), identifier=excel_claim_id)); current_result_data["Status"] = "Mismatch"
-                        try:
-                             excel_units_str = str(row.get('ServiceUnitCount', '0')).strip(); excel_units = Decimal(excel_units_str) if excel_units_str else Decimal(0)
-                             tebra_units_str = str(get_nested_attribute(matching_tebra_charge, 'Units', '0')).strip(); tebra_units = Decimal(tebra_units_str) if tebra_units_str else Decimal(0)
-                             if excel_units != tebra_units: mismatch_reasons.append(format_mismatch_reason("Service Units", excel_units_str, tebra_units_str, identifier=excel_claim_id)); current_result_data["Status"] = "Mismatch"
-                        except (TypeError, ValueError, decimal.InvalidOperation) as unit_err: mismatch_reasons.append(f"Unit Comparison Error for Claim ID {excel_claim_id}: {unit_err}"); current_result_data["Status"] = "Mismatch"
-                        check_field(row.get('PriIns_CompanyName'), get_nested_attribute(matching_tebra_charge, 'PrimaryInsuranceCompanyName'), "Primary Ins Company", compare_normalized_str, identifier=excel_claim_id)
-                        # Positional Modifier Check
-                        for i in range(1, 5):
-                            excel_mod_raw = row.get(f'ProcedureModifier{i}'); tebra_mod_raw = get_nested_attribute(matching_tebra_charge, f'ProcedureModifier{i}'); excel_mod_norm = normalize_code(excel_mod_raw); tebra_mod_norm = normalize_code(tebra_mod_raw); is_excel_empty = not excel_mod_norm; is_tebra_empty = not tebra_mod_norm
-                            if is_excel_empty and is_tebra_empty: continue
-                            if is_excel_empty != is_tebra_empty or excel_mod_norm != tebra_mod_norm: mismatch_reasons.append(format_mismatch_reason(f"Modifier {i}", excel_mod_raw, tebra_mod_raw, identifier=excel_claim_id)); current_result_data["Status"] = "Mismatch"
-                        # Positional ICD Check
-                        for i in range(1, 5):
-                            excel_icd_raw = row.get(f'EncounterDiagnosisID{i}'); tebra_icd_raw = get_nested_attribute(matching_tebra_charge, f'EncounterDiagnosisID{i}'); excel_icd_norm = normalize_code(excel_icd_raw); tebra_icd_norm = normalize_code(tebra_icd_raw); is_excel_empty = not excel_icd_norm; is_tebra_empty = not tebra_icd_norm
-                            if is_excel_empty and is_tebra_empty: continue
-                            if is_excel_empty != is_tebra_empty or excel_icd_norm != tebra_icd_norm: mismatch_reasons.append(format_mismatch_reason(f"ICD {i}", excel_icd_raw, tebra_icd_raw, identifier=excel_claim_id)); current_result_data["Status"] = "Mismatch"
-
-            # --- 6. Finalize Reason ---
-            if current_result_data["Status"] == "Match": current_result_data["Reason"] = "Verified"
-            elif mismatch_reasons: current_result_data["Reason"] = "; ".join(mismatch_reasons)
-            elif current_result_data["Status"] == "Error" and current_result_data["Reason"] == "Processing started": current_result_data["Reason"] = "Unknown processing error occurred." # Update default reason if needed
-
-            audit_results_list.append(current_result_data)
-            # Don't print per-row results to UI
+        credentials = {"CustomerKey": customer_key, "User": username, "Password": password}
+        job_id = job_runner.submit(uploaded_file.getvalue(), uploaded_file.name, credentials, settings, practice_name=practice_name)
+        session_job_ids.append(job_id); st.session_state["selected_job_id"] = job_id
+        st.success(f"🚀 Audit of {uploaded_file.name} submitted. It runs in the background; you can keep using the app or submit more files.")
+else:
+    # Show instructions if button not pressed or file not uploaded
+    if not uploaded_file: st.info("Please upload an Excel file using the sidebar.")
+    if not all([practice_name, customer_key, username, password]): st.info("Please enter Tebra credentials in the sidebar.")
+    if uploaded_file and all([practice_name, customer_key, username, password]) and not run_button: st.info("Click 'Run Audit' to begin.")
 
-        # --- End of Loop ---
-        end_time = time.time()
-        status_text.text(f"Audit Completed in {end_time - start_time:.2f} seconds.")
-        progress_bar.progress(1.0) # Ensure bar is full
+# --- Job Progress (refreshed on its own while jobs are active) ---
+def show_jobs():
+    jobs = job_runner.store.list_jobs(session_job_ids)
+    if not jobs: return
+    st.subheader("Audit Jobs")
+    status_counts = job_runner.store.status_counts()
+    st.caption(f"{status_counts.get('running', 0)} running and {status_counts.get('queued', 0)} queued on this server (at most {job_runner.max_concurrent_jobs} at a time, {job_runner.max_jobs_per_practice} per practice).")
+    for job in jobs:
+        info_col, status_col, action_col = st.columns([5, 4, 1])
+        info_col.write(f"**{job['file_name']}** · {job['practice_name'] or ''} · submitted {format_job_time(job['created_at'])}")
+        if job["status"] == "running" and job["total"]: status_col.progress(min(1.0, job["done"] / job["total"]), text=f"{PROGRESS_PHASE_LABELS.get(job['phase'], job['phase'])}: {job['done']}/{job['total']}")
+        elif job["status"] == "failed": status_col.error(f"❌ {job['message']}")
+        elif job["status"] == "done": status_col.success(f"✅ {JOB_STATUS_LABELS['done']} in {job['summary']['elapsed_seconds']:.2f} seconds ({job['summary']['rows']} rows)")
+        else: status_col.write(JOB_STATUS_LABELS.get(job["status"], job["status"]) + (f" - {job['message']}" if job["message"] else ""))
+        if job["status"] in ACTIVE_JOB_STATUSES and action_col.button("Cancel", key=f"cancel_{job['job_id']}"): job_runner.cancel(job["job_id"])
+    active_job_ids = {job["job_id"] for job in jobs if job["status"] in ACTIVE_JOB_STATUSES}
+    if st.session_state.get("active_job_ids", set()) - active_job_ids: st.session_state["active_job_ids"] = active_job_ids; st.rerun() # A job finished: redraw the results below
+    st.session_state["active_job_ids"] = active_job_ids
+
+has_active_jobs = any(job["status"] in ACTIVE_JOB_STATUSES for job in job_runner.store.list_jobs(session_job_ids))
+st.fragment(run_every=JOB_POLL_SECONDS if has_active_jobs else None)(show_jobs)()
+
+# --- Results of a Finished Job ---
+finished_jobs = [job for job in job_runner.store.list_jobs(session_job_ids) if job["status"] == "done"]
+if finished_jobs:
+    finished_ids = [job["job_id"] for job in finished_jobs]; jobs_by_id = {job["job_id"]: job for job in finished_jobs}
+    selected_job_id = st.session_state.get("selected_job_id")
+    selected_job_id = st.selectbox("Show results of", options=finished_ids, index=finished_ids.index(selected_job_id) if selected_job_id in finished_ids else 0, key="results_job_id",
+                                   format_func=lambda job_id: f"{jobs_by_id[job_id]['file_name']} ({format_job_time(jobs_by_id[job_id]['finished_at'])})")
+    job_summary = jobs_by_id[selected_job_id]["summary"]
+
+    if job_summary.get("kind") == "batch":
+        st.write(f"Batch completed in {job_summary['elapsed_seconds']:.2f} seconds ({len(job_summary['files'])} files, {len(job_summary['practices'])} practices in {job_summary['processes']} processes).")
+        st.subheader("Practices"); st.dataframe(batch_practice_frame(job_summary), hide_index=True)
+        st.subheader("Files"); st.dataframe(batch_file_frame(job_summary), hide_index=True, use_container_width=True)
+        zip_bytes = job_runner.result_bytes(selected_job_id)
+        if zip_bytes is None: st.warning("The results of this batch are no longer available.")
+        else: st.download_button(label="📥 Download all results (.zip)", data=zip_bytes, file_name=f"Tebra_Batch_Results_{datetime.datetime.fromtimestamp(jobs_by_id[selected_job_id]['finished_at']).strftime('%Y%m%d_%H%M%S')}.zip", mime="application/zip")
+    else:
+        client_info = job_summary["client_info"]
+        if client_info: st.write(f"✅ Connected to Tebra API (client ready in {client_info['seconds']:.2f} s, WSDL from {client_info['source']}).")
+        for warning in job_summary["warnings"]: st.warning(f"⚠️ {warning}")
+        directory_info = job_summary.get("directory") # Not recorded by jobs from older versions
+        if directory_info: st.info(f"📇 Patient directory: {directory_info['patients']} patients " + (f"from the stored directory ({directory_info['updated_patients']} added or updated)" if directory_info["source"] == "stored" else "fetched") + f" in {directory_info['requests']} GetPatients requests.")
+        checkpoint_info = job_summary["checkpoint"]
+        if checkpoint_info and (checkpoint_info["resumed_rows"] or checkpoint_info["reused_rows"]): st.info(f"♻️ {checkpoint_info['resumed_rows']} rows resumed from an interrupted run, {checkpoint_info['reused_rows']} unchanged rows reused from earlier runs, {checkpoint_info['audited_rows']} rows audited now.")
+        st.write(f"Audit Completed in {job_summary['elapsed_seconds']:.2f} seconds ({job_summary['patients']} patients, {job_summary['charge_requests']} batched GetCharges requests).")
+        cache_stats = job_summary["cache_stats"]
+        if cache_stats: st.info(f"🗄️ Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['writes']} stored ({cache_stats['entries']} entries, {cache_stats['size_bytes'] / (1024 * 1024):.1f} MB on disk).")
+        control_stats = job_summary.get("request_control") # Not recorded by jobs from older versions
+        if control_stats and control_stats["breaker_rejections"]: st.warning(f"⚠️ Tebra stopped responding during the audit; requests were paused {control_stats['breaker_trips']} times and {control_stats['breaker_rejections']} requests are reported as errors (running the file again re-audits them).")
+        if control_stats and control_stats["retries"]: st.info(f"🔁 {control_stats['retries']} Tebra requests were retried after transient failures; parallel requests ranged from {control_stats['lowest_limit']:g} to {control_stats['peak_limit']:g}.")
 
         # --- 7. Post-Processing & Display ---
-        if not audit_results_list: st.warning("No results were generated.")
+        if not job_summary["rows"]: st.warning("No results were generated.")
         else:
-            df_detailed_results = pd.DataFrame(audit_results_list); df_output = df.copy()
-            status_map = {"Match": "Verified", "Mismatch": "Invalid", "Error": "Invalid", "Pending": "Invalid"}
-            # Use original index if available for alignment, otherwise assume order is preserved
-            df_output['Audit Results'] = df_detailed_results['Status'].map(status_map).fillna("Invalid").values
-            df_output['Reason for Invalid'] = df_detailed_results.apply(lambda x: x['Reason'] if x['Status'] != "Match" else "", axis=1).values
-
             st.subheader("Audit Summary")
-            summary_df = df_output["Audit Results"].value_counts().reset_index(); summary_df.columns = ['Audit Results', 'Count']
-            st.dataframe(summary_df, hide_index=True)
+            st.dataframe(pd.DataFrame(job_summary["statuses"], columns=['Audit Results', 'Count']), hide_index=True)
 
             st.subheader("Invalid Records Summary")
-            invalid_df = df_output[df_output["Audit Results"] == "Invalid"].copy()
-            if not invalid_df.empty:
-                 display_cols_summary = ['Excel Row', 'Audit Results', 'PatientID', 'DateOfService', 'ProcedureCode', 'Reason for Invalid']
-                 # Add Excel Row number using index + 2 from original df if 'Original Excel Row Index' exists
-                 if 'Original Excel Row Index' in invalid_df.columns: invalid_df.insert(0, 'Excel Row', invalid_df['Original Excel Row Index'] + 2)
-                 else: invalid_df.insert(0, 'Excel Row', invalid_df.index + 2) # Fallback to current index
-                 # Ensure all columns exist before trying to display
-                 display_cols_summary = [col for col in display_cols_summary if col in invalid_df.columns]
-                 st.dataframe(invalid_df[display_cols_summary], hide_index=True, use_container_width=True) # Use container width for better display
+            if job_summary["invalid_rows"]: st.dataframe(pd.DataFrame(job_summary["invalid_rows"]), hide_index=True, use_container_width=True) # Use container width for better display
             else: st.success("✅ No invalid records found!")
 
             st.subheader("Download Full Results")
-            @st.cache_data
-            def to_excel(df_to_convert):
-                output = io.BytesIO();
-                with pd.ExcelWriter(output, engine='openpyxl') as writer: df_to_convert.to_excel(writer, index=False, sheet_name='Audit Results');
-                return output.getvalue()
-            excel_bytes = to_excel(df_output)
-            timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-            st.download_button(label="📥 Download Results as Excel", data=excel_bytes, file_name=f"Tebra_Audit_Results_{timestamp}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-
-else:
-    # Show instructions if button not pressed or file not uploaded
-    if not uploaded_file: st.info("Please upload an Excel file using the sidebar.")
-    if not all([practice_name, customer_key, username, password]): st.info("Please enter Tebra credentials in the sidebar.")
-    if uploaded_file and all([practice_name, customer_key, username, password]) and not run_button: st.info("Click 'Run Audit' to begin.")
+            excel_bytes = job_runner.result_bytes(selected_job_id)
+            if excel_bytes is None: st.warning("The results file of this job is no longer available.")
+            else:
+                timestamp = datetime.datetime.fromtimestamp(jobs_by_id[selected_job_id]['finished_at']).strftime('%Y%m%d_%H%M%S')
+                st.download_button(label="📥 Download Results as Excel", data=excel_bytes, file_name=f"Tebra_Audit_Results_{timestamp}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+        with st.expander("Performance"):
+            metrics_snapshot = job_summary["metrics"]; metrics_view = RunMetrics() # The frame helpers only read the stored snapshot
+            st.markdown("**Time per phase**"); st.dataframe(metrics_view.phase_frame(metrics_snapshot), hide_index=True)
+            st.markdown("**Tebra SOAP requests**"); st.dataframe(metrics_view.call_frame(metrics_snapshot), hide_index=True, use_container_width=True)
+            st.markdown("**Cache lookups**"); st.dataframe(metrics_view.cache_frame(metrics_snapshot), hide_index=True)
+            st.download_button(label="📥 Download metrics as JSON", data=json.dumps(metrics_snapshot, indent=2), file_name=f"Tebra_Audit_Metrics_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json", mime="application/json")
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Batch audits of many files for many practices. Files are assigned to practices from a credentials mapping
+(Practice, CustomerKey, User, Password and optional Files patterns); each practice's files are audited in their own
+process with one Tebra client and request header, so the batch takes about as long as its slowest practice.
+Writes one results workbook per file plus a combined Batch_Summary.xlsx.
+
+Example:
+    python tebra_audit_batch.py --credentials practices.csv -o month_end/ uploads/*.xlsx
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import queue
+import fnmatch
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+
+from tebra_audit_engine import ProgressThrottle, PROGRESS_PHASE_LABELS, STATUS_MAP, create_api_client, build_request_header
+from tebra_audit_jobs import execute_audit, AuditJobError, AuditJobCancelled, DEFAULT_AUDIT_SETTINGS
+from tebra_audit_cli import add_audit_arguments, build_settings
+
+DEFAULT_BATCH_PROCESSES = int(os.environ.get("TEBRA_AUDIT_BATCH_PROCESSES", "8")) # Practices audited at once; the audit mostly waits on Tebra, so this may exceed the CPU count
+CREDENTIAL_COLUMNS = ['Practice', 'CustomerKey', 'User', 'Password'] # Required columns of the credentials mapping; an optional 'Files' column holds ';'-separated file name patterns
+BATCH_SUMMARY_FILE = "Batch_Summary.xlsx"
+BATCH_PROGRESS_INTERVAL = 1.0 # Minimum seconds between two progress messages of one file
+RESULT_COLUMNS = list(dict.fromkeys(STATUS_MAP.values()))
+
+def load_practice_credentials(source, filename=None):
+    """
+    Reads the credentials mapping from a .csv, .xlsx or .json file (path, bytes or file object).
+    Returns {practice: {"CustomerKey", "User", "Password", "Files": [patterns]}}; raises ValueError if it is incomplete.
+    """
+    source_name = str(filename or getattr(source, 'name', None) or source).lower()
+    if isinstance(source, bytes): source = io.BytesIO(source)
+    if source_name.endswith('.json'):
+        if hasattr(source, 'read'): raw = json.load(source)
+        else:
+            with open(source, encoding='utf-8') as f: raw = json.load(f)
+        records = [{"Practice": practice, **values} for practice, values in raw.items()] if isinstance(raw, dict) else list(raw)
+    else:
+        frame = pd.read_csv(source, dtype=str, keep_default_na=False) if source_name.endswith('.csv') else pd.read_excel(source, dtype=str).fillna('')
+        records = frame.to_dict(orient="records")
+    practices = {}
+    for number, record in enumerate(records, start=1):
+        missing = [column for column in CREDENTIAL_COLUMNS if not str(record.get(column) or '').strip()]
+        if missing: raise ValueError(f"Credentials entry {number} is missing {', '.join(missing)}.")
+        practice = str(record['Practice']).strip()
+        if practice in practices: raise ValueError(f"Practice '{practice}' is listed more than once in the credentials mapping.")
+        files = record.get('Files') or []
+        patterns = [pattern.strip() for pattern in (files.split(';') if isinstance(files, str) else files) if str(pattern).strip()]
+        practices[practice] = {"CustomerKey": str(record['CustomerKey']).strip(), "User": str(record['User']).strip(), "Password": str(record['Password']), "Files": patterns}
+    if not practices: raise ValueError("The credentials mapping lists no practices.")
+    return practices
+
+def _name_key(value): return re.sub(r'[^a-z0-9]+', '', str(value).lower())
+
+def assign_practice(file_name, practices):
+    """The practice a file belongs to: the one whose Files patterns match it, else the one whose name appears in the file name. Returns (practice, error)."""
+    base_name = os.path.basename(file_name)
+    matches = [practice for practice, entry in practices.items() if any(fnmatch.fnmatch(base_name.lower(), pattern.lower()) for pattern in entry["Files"])]
+    if not matches: matches = [practice for practice, entry in practices.items() if not entry["Files"] and _name_key(practice) and _name_key(practice) in _name_key(base_name)]
+    if len(matches) == 1: return matches[0], None
+    if not matches: return None, "No practice in the credentials mapping matches this file."
+    return None, f"File matches several practices ({', '.join(matches)}); add a Files pattern to the credentials mapping."
+
+def _safe_name(value): return re.sub(r'[^A-Za-z0-9._-]+', '_', str(value)).strip('_') or 'file'
+
+def audit_practice_files(practice, credentials, files, settings, progress_queue=None, cancel_event=None):
+    """
+    Process-pool task: audits one practice's files [(file_name, source, output_path)] one after another with a single
+    client and request header. Never raises for a single file; returns {"practice", "seconds", "files": [file entries]}.
+    Once cancel_event (a manager Event) is set, the current file stops at its next progress report and the rest are skipped.
+    """
+    start = time.perf_counter(); settings = {**DEFAULT_AUDIT_SETTINGS, **(settings or {})}; entries = []; client = header = None
+    try: client = create_api_client(settings["wsdl_url"], wsdl_path=settings["wsdl_path"] or None, cache_dir=settings["wsdl_cache_dir"]); header = build_request_header(credentials, client); connect_error = None
+    except Exception as e: connect_error = f"Failed to connect to Tebra API: {e}"
+    for file_name, source, output_path in files:
+        file_start = time.perf_counter(); entry = {"practice": practice, "file_name": file_name, "status": "failed", "message": connect_error, "results_file": None, "rows": 0, "statuses": {}}
+        send_progress = ProgressThrottle(lambda phase, done, total: progress_queue.put((practice, file_name, phase, done, total)), min_interval=BATCH_PROGRESS_INTERVAL) if progress_queue is not None else None
+        def report_progress(phase, done, total):
+            if cancel_event is not None and cancel_event.is_set(): raise AuditJobCancelled()
+            if send_progress is not None: send_progress(phase, done, total)
+        if cancel_event is not None and cancel_event.is_set(): entry.update(status="cancelled", message="Batch cancelled before this file started.")
+        elif connect_error is None:
+            try:
+                summary = execute_audit(source, file_name, credentials, settings, output_path=output_path, client=client, header=header, progress_callback=report_progress)
+                entry.update(status="done", message=None, results_file=output_path, rows=summary["rows"], statuses={item["Audit Results"]: item["Count"] for item in summary["statuses"]},
+                             patients=summary["patients"], charge_requests=summary["charge_requests"], soap_calls=sum(call["count"] for call in summary["metrics"]["soap_calls"].values()))
+            except AuditJobCancelled: entry.update(status="cancelled", message="Batch cancelled; rows already matched are resumed when the file is run again.")
+            except AuditJobError as e: entry["message"] = str(e)
+            except Exception as e: entry["message"] = f"Unexpected error: {type(e).__name__} - {e}"
+        entry["seconds"] = time.perf_counter() - file_start; entries.append(entry)
+        if progress_queue is not None: progress_queue.put((practice, file_name, "files", 1, 1))
+    return {"practice": practice, "seconds": time.perf_counter() - start, "files": entries}
+
+def _drain(progress_queue, progress_callback):
+    while True:
+        try: message = progress_queue.get_nowait()
+        except queue.Empty: return
+        if progress_callback: progress_callback(*message)
+
+def run_batch_audit(files, practices, output_dir, settings=None, max_processes=DEFAULT_BATCH_PROCESSES, progress_callback=None, cancel_event=None):
+    """
+    Audits files [(file_name, source)] (source: path or bytes) for the practices of a credentials mapping. Practices run in
+    parallel in up to max_processes worker processes, and each practice's files run one after another.
+    progress_callback(practice, file_name, phase, done, total) receives the worker's progress, and phase "files" once per finished file.
+    Setting cancel_event (a threading.Event) stops the workers cooperatively. Writes each file's results workbook under
+    output_dir/<practice>/ and the combined summary to output_dir/Batch_Summary.xlsx.
+    Returns the batch summary: {"kind": "batch", "files", "practices", "rows", "elapsed_seconds", "processes", "summary_path"}.
+    """
+    start = time.perf_counter(); os.makedirs(output_dir, exist_ok=True)
+    tasks = {}; skipped = []; used_paths = set()
+    for file_name, source in files:
+        practice, error = assign_practice(file_name, practices)
+        if error:
+            skipped.append({"practice": None, "file_name": file_name, "status": "skipped", "message": error, "results_file": None, "rows": 0, "statuses": {}, "seconds": 0.0})
+            if progress_callback: progress_callback(None, file_name, "files", 1, 1)
+            continue
+        output_path = os.path.join(output_dir, _safe_name(practice), f"{_safe_name(os.path.splitext(os.path.basename(file_name))[0])}_Results.xlsx")
+        stem, extension = os.path.splitext(output_path); copy_number = 2
+        while output_path in used_paths: output_path = f"{stem}_{copy_number}{extension}"; copy_number += 1
+        used_paths.add(output_path); os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        tasks.setdefault(practice, []).append((file_name, source, output_path))
+
+    practice_results = []; processes = max(1, min(int(max_processes), len(tasks))) if tasks else 0
+    if tasks:
+        # spawn, not fork: the caller may be a multi-threaded server (Streamlit, the job runner)
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool, (context.Manager() if progress_callback or cancel_event else contextlib.nullcontext()) as manager:
+            progress_queue = manager.Queue() if progress_callback else None; worker_cancel_event = manager.Event() if cancel_event else None
+            future_to_practice = {pool.submit(audit_practice_files, practice, {key: practices[practice][key] for key in CREDENTIAL_COLUMNS[1:]}, practice_files, settings, progress_queue, worker_cancel_event): practice for practice, practice_files in tasks.items()}
+            pending = set(future_to_practice)
+            while pending:
+                finished, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                if cancel_event is not None and cancel_event.is_set() and not worker_cancel_event.is_set(): worker_cancel_event.set()
+                if progress_queue is not None: _drain(progress_queue, progress_callback)
+                for future in finished:
+                    practice = future_to_practice[future]
+                    try: practice_results.append(future.result())
+                    except Exception as e: # The worker process died; every file of the practice is reported as failed
+                        practice_results.append({"practice": practice, "seconds": time.perf_counter() - start, "files": [{"practice": practice, "file_name": file_name, "status": "failed", "message": f"Worker process failed: {type(e).__name__} - {e}", "results_file": None, "rows": 0, "statuses": {}, "seconds": 0.0} for file_name, _, _ in tasks[practice]]})
+            if progress_queue is not None: _drain(progress_queue, progress_callback)
+
+    file_entries = [entry for result in practice_results for entry in result["files"]] + skipped
+    order = {file_name: position for position, (file_name, _) in enumerate(files)}; file_entries.sort(key=lambda entry: order.get(entry["file_name"], 0))
+    for entry in file_entries:
+        if entry["results_file"]: entry["results_file"] = os.path.relpath(entry["results_file"], output_dir)
+    practice_rows = [{"practice": result["practice"], "files": len(result["files"]), "failed_files": sum(entry["status"] != "done" for entry in result["files"]), "rows": sum(entry["rows"] for entry in result["files"]),
+                      **{status: sum(entry["statuses"].get(status, 0) for entry in result["files"]) for status in RESULT_COLUMNS}, "seconds": result["seconds"]} for result in sorted(practice_results, key=lambda result: result["practice"])]
+    batch = {"kind": "batch", "files": file_entries, "practices": practice_rows, "rows": sum(entry["rows"] for entry in file_entries), "elapsed_seconds": time.perf_counter() - start, "processes": processes, "summary_path": os.path.join(output_dir, BATCH_SUMMARY_FILE)}
+    write_batch_summary(batch, batch["summary_path"])
+    return batch
+
+def batch_file_frame(batch):
+    return pd.DataFrame([{"Practice": entry["practice"] or "", "File": entry["file_name"], "Status": entry["status"], "Rows": entry["rows"], **{status: entry["statuses"].get(status, 0) for status in RESULT_COLUMNS},
+                          "Seconds": round(entry["seconds"], 2), "Results File": entry["results_file"] or "", "Message": entry["message"] or ""} for entry in batch["files"]],
+                        columns=["Practice", "File", "Status", "Rows", *RESULT_COLUMNS, "Seconds", "Results File", "Message"])
+
+def batch_practice_frame(batch):
+    return pd.DataFrame([{"Practice": row["practice"], "Files": row["files"], "Failed Files": row["failed_files"], "Rows": row["rows"], **{status: row[status] for status in RESULT_COLUMNS}, "Seconds": round(row["seconds"], 2)} for row in batch["practices"]],
+                        columns=["Practice", "Files", "Failed Files", "Rows", *RESULT_COLUMNS, "Seconds"])
+
+def write_batch_summary(batch, path):
+    with pd.ExcelWriter(path, engine="xlsxwriter") as writer:
+        batch_file_frame(batch).to_excel(writer, sheet_name="Files", index=False); batch_practice_frame(batch).to_excel(writer, sheet_name="Practices", index=False)
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Audit many Excel/CSV charge files for many practices against Tebra (Kareo) SOAP data.")
+    parser.add_argument("input_files", nargs="+", help="Audit files (.xlsx or .csv).")
+    parser.add_argument("--credentials", required=True, help="Credentials mapping (.csv, .xlsx or .json) with Practice, CustomerKey, User, Password and optional Files columns.")
+    parser.add_argument("-o", "--output-dir", help="Directory for the result workbooks and Batch_Summary.xlsx. Default: Tebra_Batch_<timestamp> in the current directory.")
+    parser.add_argument("--processes", type=int, default=DEFAULT_BATCH_PROCESSES, help="Practices audited in parallel.")
+    add_audit_arguments(parser) # The single-file CLI's options; --workers, the caches and the stores apply to each practice's process
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only print the final summary.")
+    return parser
+
+def print_progress(practice, file_name, phase, done, total):
+    if phase == "files": print(f"[{practice or 'no practice'}] {file_name}: {'finished' if practice else 'skipped'}", file=sys.stderr, flush=True)
+    else: print(f"[{practice}] {file_name}: {PROGRESS_PHASE_LABELS.get(phase, phase)} {done}/{total}", file=sys.stderr, flush=True)
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    try: practices = load_practice_credentials(args.credentials)
+    except (OSError, ValueError) as e: print(f"Error reading credentials mapping: {e}", file=sys.stderr); return 2
+    output_dir = args.output_dir or f"Tebra_Batch_{time.strftime('%Y%m%d_%H%M%S')}"
+    batch = run_batch_audit([(os.path.basename(path), path) for path in args.input_files], practices, output_dir, settings=build_settings(args), max_processes=args.processes, progress_callback=None if args.quiet else print_progress)
+    print(f"Audited {len(batch['files'])} files for {len(batch['practices'])} practices in {batch['elapsed_seconds']:.2f} seconds ({batch['processes']} processes).")
+    for _, row in batch_practice_frame(batch).iterrows(): print(f"  {row['Practice']}: {row['Files']} files, {row['Rows']} rows, " + ", ".join(f"{status} {row[status]}" for status in RESULT_COLUMNS) + f" ({row['Seconds']:.2f} s)")
+    for entry in batch["files"]:
+        if entry["status"] != "done": print(f"  {entry['file_name']}: {entry['status']} - {entry['message']}")
+    print(f"Summary written to {batch['summary_path']}")
+    return 0 if all(entry["status"] == "done" for entry in batch["files"]) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpointed, resumable and incremental audits. Results are written to a local SQLite file as the run goes, keyed by
+a hash of each row's audited columns, so an interrupted run resumes from the last checkpoint and a re-uploaded file
+can re-audit only the rows that are new or changed since the previous run for the same practice.
+"""
+
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+
+from tebra_audit_engine import REQUIRED_COLUMNS
+
+DEFAULT_CHECKPOINT_PATH = os.environ.get("TEBRA_AUDIT_CHECKPOINT_PATH", os.path.join(".tebra_cache", "checkpoints.sqlite3"))
+DEFAULT_CHECKPOINT_ROWS = 1000 # Rows audited (and SOAP-fetched) between two checkpoint writes
+STALE_RUN_DAYS = 7 # Unfinished runs older than this are purged
+HASHED_COLUMNS = REQUIRED_COLUMNS + ['ServiceLocationName'] # Every column the audit compares
+REUSABLE_STATUSES = ("Match",) # Mismatch rows may have been corrected in Tebra since and Error rows hit fetch failures, so both are always re-audited, on resume too
+DEFAULT_REUSE_MAX_AGE_HOURS = 72 # Verdicts older than this are re-audited, so later changes in Tebra are picked up
+
+def row_content_hashes(df):
+    """One hex digest per row over HASHED_COLUMNS (missing columns count as empty), in DataFrame order."""
+    columns = [df[column].astype(str).to_numpy(dtype=object) if column in df.columns else [''] * len(df) for column in HASHED_COLUMNS]
+    return [hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=16).hexdigest() for values in zip(*columns)]
+
+def file_fingerprint(row_hashes):
+    """Identifies a file's audited content (row order included); a resumed run must have the same fingerprint."""
+    digest = hashlib.sha256()
+    for row_hash in row_hashes: digest.update(row_hash.encode('ascii'))
+    return digest.hexdigest()
+
+def practice_key_hash(customer_key): return hashlib.sha256(str(customer_key or '').encode('utf-8')).hexdigest() # The customer key is only stored hashed
+
+class CheckpointStore:
+    """
+    SQLite store with one row per checkpointed result of an unfinished run (runs/run_results) and the latest
+    reusable verdict per (practice, row hash) (row_verdicts). Safe to share between threads.
+    """
+    def __init__(self, path=DEFAULT_CHECKPOINT_PATH):
+        self.path = path; self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY AUTOINCREMENT, practice_hash TEXT NOT NULL, fingerprint TEXT NOT NULL, total_rows INTEGER NOT NULL, status TEXT NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_lookup ON runs (practice_hash, fingerprint, status)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS run_results (run_id INTEGER NOT NULL, position INTEGER NOT NULL, row_hash TEXT NOT NULL, result BLOB NOT NULL, saved_at REAL, PRIMARY KEY (run_id, position))")
+        if "saved_at" not in {row[1] for row in self._conn.execute("PRAGMA table_info(run_results)")}: self._conn.execute("ALTER TABLE run_results ADD COLUMN saved_at REAL") # Checkpoints written before results recorded their age are never resumed
+        self._conn.execute("CREATE TABLE IF NOT EXISTS row_verdicts (practice_hash TEXT NOT NULL, row_hash TEXT NOT NULL, result BLOB NOT NULL, audited_at REAL NOT NULL, PRIMARY KEY (practice_hash, row_hash))")
+        self._conn.commit()
+        self.purge_stale_runs()
+
+    def find_unfinished_run(self, practice_hash, fingerprint, max_age_hours=None):
+        """
+        Returns (run_id, {position: result}) of the latest unfinished run of this file, or (None, {}). Like
+        load_verdicts, only reusable results checkpointed within max_age_hours (None: any age) are returned.
+        """
+        min_saved_at = time.time() - float(max_age_hours) * 3600 if max_age_hours is not None else 0.0
+        with self._lock:
+            row = self._conn.execute("SELECT run_id FROM runs WHERE practice_hash = ? AND fingerprint = ? AND status = 'running' ORDER BY updated_at DESC LIMIT 1", (practice_hash, fingerprint)).fetchone()
+            if row is None: return None, {}
+            results = {position: result for position, blob in self._conn.execute("SELECT position, result FROM run_results WHERE run_id = ? AND saved_at >= ?", (row[0], min_saved_at)) for result in [pickle.loads(blob)] if result.get("Status") in REUSABLE_STATUSES}
+        return row[0], results
+
+    def start_run(self, practice_hash, fingerprint, total_rows):
+        now = time.time()
+        with self._lock:
+            run_id = self._conn.execute("INSERT INTO runs (practice_hash, fingerprint, total_rows, status, created_at, updated_at) VALUES (?, ?, ?, 'running', ?, ?)", (practice_hash, fingerprint, total_rows, now, now)).lastrowid
+            self._conn.commit()
+        return run_id
+
+    def load_verdicts(self, practice_hash, row_hashes, max_age_hours=None):
+        """Earlier reusable results for the given row hashes, audited within max_age_hours (None: any age): {row_hash: result}."""
+        min_audited_at = time.time() - float(max_age_hours) * 3600 if max_age_hours is not None else 0.0; wanted = list(dict.fromkeys(row_hashes)); verdicts = {}
+        with self._lock:
+            for start in range(0, len(wanted), 500): # Stay below SQLite's bound-parameter limit
+                chunk = wanted[start:start + 500]
+                query = f"SELECT row_hash, result FROM row_verdicts WHERE practice_hash = ? AND audited_at >= ? AND row_hash IN ({','.join('?' * len(chunk))})"
+                verdicts.update((row_hash, result) for row_hash, blob in self._conn.execute(query, (practice_hash, min_audited_at, *chunk)) for result in [pickle.loads(blob)] if result.get("Status") in REUSABLE_STATUSES) # Stores written by older versions also hold Mismatch verdicts
+        return verdicts
+
+    def save_results(self, run_id, practice_hash, entries):
+        """Checkpoints [(position, row_hash, result)] of a run and records the reusable ones as the rows' latest verdicts."""
+        now = time.time(); run_rows = []; verdict_rows = []
+        for position, row_hash, result in entries:
+            blob = sqlite3.Binary(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)); run_rows.append((run_id, position, row_hash, blob, now))
+            if result.get("Status") in REUSABLE_STATUSES: verdict_rows.append((practice_hash, row_hash, blob, now))
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO run_results (run_id, position, row_hash, result, saved_at) VALUES (?, ?, ?, ?, ?)", run_rows)
+            self._conn.executemany("INSERT OR REPLACE INTO row_verdicts (practice_hash, row_hash, result, audited_at) VALUES (?, ?, ?, ?)", verdict_rows)
+            self._conn.execute("UPDATE runs SET updated_at = ? WHERE run_id = ?", (now, run_id)); self._conn.commit()
+
+    def finish_run(self, run_id):
+        # The per-run results are only needed to resume; the verdicts stay for incremental runs
+        with self._lock:
+            self._conn.execute("DELETE FROM run_results WHERE run_id = ?", (run_id,)); self._conn.execute("UPDATE runs SET status = 'complete', updated_at = ? WHERE run_id = ?", (time.time(), run_id)); self._conn.commit()
+
+    def purge_stale_runs(self, max_age_days=STALE_RUN_DAYS):
+        cutoff = time.time() - max_age_days * 86400
+        with self._lock:
+            stale_ids = [(run_id,) for run_id, in self._conn.execute("SELECT run_id FROM runs WHERE updated_at < ?", (cutoff,))]
+            self._conn.executemany("DELETE FROM run_results WHERE run_id = ?", stale_ids); self._conn.executemany("DELETE FROM runs WHERE run_id = ?", stale_ids); self._conn.commit()
+        return len(stale_ids)
+
+    def clear(self, customer_key=None):
+        """Removes every checkpoint and verdict, or only those of one customer key."""
+        with self._lock:
+            if customer_key is None: self._conn.execute("DELETE FROM run_results"); self._conn.execute("DELETE FROM runs"); self._conn.execute("DELETE FROM row_verdicts")
+            else:
+                practice_hash = practice_key_hash(customer_key)
+                self._conn.execute("DELETE FROM run_results WHERE run_id IN (SELECT run_id FROM runs WHERE practice_hash = ?)", (practice_hash,))
+                self._conn.execute("DELETE FROM runs WHERE practice_hash = ?", (practice_hash,)); self._conn.execute("DELETE FROM row_verdicts WHERE practice_hash = ?", (practice_hash,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock: self._conn.close()
+
+class CheckpointedAudit:
+    """
+    Runs an AuditRun over the rows of df that still need auditing, in chunks of checkpoint_rows, checkpointing each
+    chunk's results. Rows an interrupted run of the same file already matched are resumed (resume=True), and with
+    incremental=True rows whose content hash has a Match verdict from an earlier run of the same practice are not
+    re-audited; both only within reuse_max_age_hours. Mismatch and Error rows are always audited again. run(df)
+    returns one result per row in file order, like AuditRun.run.
+    """
+    def __init__(self, audit_run, store, customer_key, resume=True, incremental=False, checkpoint_rows=DEFAULT_CHECKPOINT_ROWS, reuse_max_age_hours=DEFAULT_REUSE_MAX_AGE_HOURS):
+        self.audit_run = audit_run; self.store = store; self.practice_hash = practice_key_hash(customer_key)
+        self.resume = resume; self.incremental = incremental; self.checkpoint_rows = max(1, int(checkpoint_rows)); self.reuse_max_age_hours = reuse_max_age_hours
+        self.resumed_rows = 0; self.reused_rows = 0; self.audited_rows = 0; self.run_id = None
+
+    def run(self, df):
+        row_hashes = row_content_hashes(df); fingerprint = file_fingerprint(row_hashes); total_rows = len(df)
+        results = [None] * total_rows
+        run_id, checkpointed = self.store.find_unfinished_run(self.practice_hash, fingerprint, self.reuse_max_age_hours) if self.resume else (None, {})
+        for position, result in checkpointed.items():
+            if 0 <= position < total_rows: results[position] = result; self.resumed_rows += 1
+        if self.incremental:
+            verdicts = self.store.load_verdicts(self.practice_hash, [row_hashes[position] for position in range(total_rows) if results[position] is None], self.reuse_max_age_hours)
+            for position in range(total_rows):
+                if results[position] is None and row_hashes[position] in verdicts: results[position] = dict(verdicts[row_hashes[position]]); self.reused_rows += 1
+        for position, index in enumerate(df.index):
+            if results[position] is not None: results[position]["Excel Row"] = index + 2
+        self.run_id = run_id if run_id is not None else self.store.start_run(self.practice_hash, fingerprint, total_rows)
+        pending_positions = [position for position in range(total_rows) if results[position] is None]
+        for start in range(0, len(pending_positions), self.checkpoint_rows):
+            chunk_positions = pending_positions[start:start + self.checkpoint_rows]
+            chunk_results = self.audit_run.run(df.iloc[chunk_positions])
+            for position, result in zip(chunk_positions, chunk_results): results[position] = result
+            self.store.save_results(self.run_id, self.practice_hash, [(position, row_hashes[position], result) for position, result in zip(chunk_positions, chunk_results)])
+            self.audited_rows += len(chunk_positions); self.audit_run.report_progress("checkpoint", total_rows - len(pending_positions) + self.audited_rows, total_rows)
+        self.store.finish_run(self.run_id)
+        return results
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Command line entry point for Tebra Audit: runs the same audit as the Streamlit app without a browser session.
+
+Example:
+    TEBRA_CUSTOMER_KEY=... TEBRA_USER=... TEBRA_PASSWORD=... python tebra_audit_cli.py audit.xlsx -o results.xlsx
+"""
+
+import os
+import sys
+import json
+import argparse
+import logging
+import datetime
+
+from tebra_audit_engine import ProgressThrottle, PROGRESS_PHASE_LABELS, CHARGE_FETCH_MODES, MATCH_MODES, DEFAULT_PREFETCH_WORKERS, MAX_PREFETCH_WORKERS, DEFAULT_WSDL_URL, DEFAULT_WSDL_PATH, DEFAULT_WSDL_CACHE_DIR
+from tebra_response_cache import DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, DEFAULT_MAX_SIZE_MB
+from tebra_audit_metrics import RunMetrics
+from tebra_audit_checkpoint import DEFAULT_CHECKPOINT_PATH, DEFAULT_CHECKPOINT_ROWS, DEFAULT_REUSE_MAX_AGE_HOURS
+from tebra_request_control import DEFAULT_MAX_RETRIES
+from tebra_patient_directory import DEFAULT_DIRECTORY_PATH, DIRECTORY_MAX_AGE_HOURS
+from tebra_audit_jobs import execute_audit, AuditJobError
+
+def add_audit_arguments(parser):
+    """Adds the options that map to audit settings (build_settings); shared with the batch CLI so both accept the same ones."""
+    parser.add_argument("--wsdl-url", default=DEFAULT_WSDL_URL, help="WSDL location for the Tebra SOAP API.")
+    parser.add_argument("--wsdl-file", default=DEFAULT_WSDL_PATH, help="Local WSDL file to load instead of the URL, so startup needs no network (default: $TEBRA_WSDL_PATH).")
+    parser.add_argument("--wsdl-cache-dir", default=DEFAULT_WSDL_CACHE_DIR, help="Directory for the WSDL snapshot and zeep's schema cache.")
+    parser.add_argument("--no-wsdl-cache", action="store_true", help="Download and parse the WSDL from --wsdl-url on every start.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_PREFETCH_WORKERS, help=f"Concurrent Tebra requests to start with; adapts between 1 and {MAX_PREFETCH_WORKERS} unless --fixed-concurrency.")
+    parser.add_argument("--fixed-concurrency", action="store_true", help="Keep --workers requests in flight instead of adapting to Tebra's latency and faults.")
+    parser.add_argument("--retries", type=int, default=DEFAULT_MAX_RETRIES, help="Retries of a request after a transient failure (SOAP fault, timeout, throttling).")
+    parser.add_argument("--charge-mode", choices=CHARGE_FETCH_MODES, default="auto", help="How rows are grouped into GetCharges requests.")
+    parser.add_argument("--match-mode", choices=MATCH_MODES, default="join", help="Compare all rows as one set-based join or row by row (same results).")
+    parser.add_argument("--cache", action="store_true", help="Reuse GetPatient/GetCharges responses stored by earlier runs (corrections made in Tebra since are not seen until the cached responses expire).")
+    parser.add_argument("--no-cache", action="store_true", help=argparse.SUPPRESS) # The cache is off by default now; kept so existing scripts still run
+    parser.add_argument("--refresh-cache", action="store_true", help="Ignore cached responses and store fresh ones (implies --cache).")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH, help="SQLite file for the response cache.")
+    parser.add_argument("--cache-ttl-hours", type=float, default=DEFAULT_TTL_HOURS, help="Lifetime of cached responses.")
+    parser.add_argument("--cache-max-size-mb", type=float, default=DEFAULT_MAX_SIZE_MB, help="Size limit of the response cache.")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not checkpoint results or resume an interrupted run of the same file.")
+    parser.add_argument("--incremental", action="store_true", help="Only re-audit rows that are new or changed since an earlier run for the same customer key (rows verified within --reuse-max-age-hours keep their verdict).")
+    parser.add_argument("--reuse-max-age-hours", type=float, default=DEFAULT_REUSE_MAX_AGE_HOURS, help="Age after which a Match verdict is no longer resumed, or reused by --incremental.")
+    parser.add_argument("--checkpoint-path", default=DEFAULT_CHECKPOINT_PATH, help="SQLite file for checkpoints and earlier verdicts.")
+    parser.add_argument("--checkpoint-rows", type=int, default=DEFAULT_CHECKPOINT_ROWS, help="Rows audited between two checkpoints.")
+    parser.add_argument("--patient-directory", action="store_true", help="Read patients from the practice's patient directory (paged GetPatients) instead of one GetPatient call per PatientID.")
+    parser.add_argument("--directory-path", default=DEFAULT_DIRECTORY_PATH, help="SQLite file the patient directory is kept in between runs.")
+    parser.add_argument("--no-directory-store", action="store_true", help="Fetch the patient directory for this run only.")
+    parser.add_argument("--refresh-directory", action="store_true", help="Fetch the whole patient directory again instead of only the patients modified since the last run.")
+    parser.add_argument("--directory-max-age-hours", type=float, default=DIRECTORY_MAX_AGE_HOURS, help="Age after which the stored directory is fetched again in full.")
+    return parser
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Audit an Excel/CSV charge file against Tebra (Kareo) SOAP data.")
+    parser.add_argument("input_file", help="Audit file (.xlsx or .csv) with the required columns.")
+    parser.add_argument("-o", "--output", help="Results file (.xlsx or .csv). Default: Tebra_Audit_Results_<timestamp>.xlsx next to the input.")
+    parser.add_argument("--customer-key", default=os.environ.get("TEBRA_CUSTOMER_KEY"), help="Tebra customer key (default: $TEBRA_CUSTOMER_KEY).")
+    parser.add_argument("--user", default=os.environ.get("TEBRA_USER"), help="Tebra username/email (default: $TEBRA_USER).")
+    parser.add_argument("--password", default=os.environ.get("TEBRA_PASSWORD"), help="Tebra password (default: $TEBRA_PASSWORD).")
+    add_audit_arguments(parser)
+    parser.add_argument("--metrics-json", help="Also write phase timings, SOAP call stats and cache hit rates to this JSON file.")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only print errors and the final summary.")
+    return parser
+
+def print_progress(phase, done, total):
+    print(f"\r{PROGRESS_PHASE_LABELS.get(phase, phase)}: {done}/{total}", end="\n" if done >= total else "", file=sys.stderr, flush=True)
+
+def build_settings(args):
+    """Audit settings (see tebra_audit_jobs.DEFAULT_AUDIT_SETTINGS) from the options of add_audit_arguments."""
+    return {"prefetch_workers": args.workers, "adaptive_concurrency": not args.fixed_concurrency, "max_retries": args.retries, "charge_fetch_mode": args.charge_mode, "match_mode": args.match_mode,
+            "wsdl_url": args.wsdl_url, "wsdl_path": args.wsdl_file, "wsdl_cache_dir": None if args.no_wsdl_cache else args.wsdl_cache_dir,
+            "use_response_cache": (args.cache or args.refresh_cache) and not args.no_cache, "refresh_response_cache": args.refresh_cache, "cache_path": args.cache_path, "cache_ttl_hours": args.cache_ttl_hours, "cache_max_size_mb": args.cache_max_size_mb,
+            "resume_runs": not args.no_checkpoint, "incremental_audit": args.incremental, "checkpoint_path": args.checkpoint_path, "checkpoint_rows": args.checkpoint_rows, "reuse_max_age_hours": args.reuse_max_age_hours,
+            "patient_directory": args.patient_directory, "persist_directory": not args.no_directory_store, "refresh_directory": args.refresh_directory, "directory_path": args.directory_path, "directory_max_age_hours": args.directory_max_age_hours}
+
+def print_summary(summary, output_path):
+    client_info = summary["client_info"]; cache_stats = summary["cache_stats"]; directory_info = summary["directory"]; control_stats = summary["request_control"]; checkpoint_info = summary["checkpoint"]
+    for warning in summary["warnings"]: print(f"Warning: {warning}", file=sys.stderr)
+    if client_info: print(f"Tebra client ready in {client_info['seconds']:.2f} seconds (WSDL from {client_info['source']}).")
+    print(f"Audited {summary['rows']} rows in {summary['elapsed_seconds']:.2f} seconds ({summary['patients']} patients, {summary['charge_requests']} batched GetCharges requests).")
+    for status in summary["statuses"]: print(f"  {status['Audit Results']}: {status['Count']}")
+    if cache_stats: print(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['writes']} stored.")
+    if directory_info: print(f"Patient directory: {directory_info['patients']} patients ({'stored, ' + str(directory_info['updated_patients']) + ' updated' if directory_info['source'] == 'stored' else 'fetched'}) in {directory_info['requests']} GetPatients requests.")
+    print(f"Tebra requests: {control_stats['retries']} retries, concurrency limit {control_stats['lowest_limit']:g}-{control_stats['peak_limit']:g} (ended at {control_stats['limit']:g}), circuit breaker opened {control_stats['breaker_trips']} times.")
+    if checkpoint_info: print(f"Checkpoints: {checkpoint_info['resumed_rows']} rows resumed, {checkpoint_info['reused_rows']} unchanged rows reused, {checkpoint_info['audited_rows']} rows audited.")
+    print("Time per phase:")
+    for _, phase_row in RunMetrics().phase_frame(summary["metrics"]).iterrows(): print(f"  {phase_row['Phase']}: {phase_row['Seconds']:.2f} s")
+    print(f"Results written to {output_path}")
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not all([args.customer_key, args.user, args.password]): print("Missing Tebra credentials (use --customer-key/--user/--password or the TEBRA_* environment variables).", file=sys.stderr); return 2
+    output_path = args.output or os.path.join(os.path.dirname(os.path.abspath(args.input_file)), f"Tebra_Audit_Results_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
+    # The same audit as a background job of the app: tebra_audit_jobs.execute_audit sets up the caches, directory and checkpoints
+    try: summary = execute_audit(args.input_file, os.path.basename(args.input_file), {"CustomerKey": args.customer_key, "User": args.user, "Password": args.password}, build_settings(args), output_path=output_path,
+                                 progress_callback=None if args.quiet else ProgressThrottle(print_progress, min_interval=1.0))
+    except AuditJobError as e: print(f"Error: {e}", file=sys.stderr); return 1
+    if args.metrics_json:
+        with open(args.metrics_json, "w", encoding="utf-8") as f: json.dump(summary["metrics"], f, indent=2)
+    print_summary(summary, output_path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1162 @@
+# -*- coding: utf-8 -*-
+"""
+Headless Tebra Audit engine: comparison utilities, Tebra SOAP access and the per-row audit pipeline.
+Used by the Streamlit app (tebra_audit_app.py) and the command line (tebra_audit_cli.py).
+"""
+
+# -----------------------------------------------------------------------------
+# PART 1: Dependencies
+# -----------------------------------------------------------------------------
+import pandas as pd
+import numpy as np
+import zeep
+import zeep.helpers
+from zeep.cache import SqliteCache
+from requests import Session
+from zeep.transports import Transport
+from requests.adapters import HTTPAdapter
+from openpyxl import load_workbook
+from pandas.io.parsers import TextParser
+import xlsxwriter
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import datetime # Import the module
+import os
+import time
+import hashlib
+import re
+import io
+import logging
+import decimal
+import functools
+import contextlib
+import threading
+import weakref
+from decimal import Decimal, ROUND_HALF_UP
+from tebra_audit_metrics import RunMetrics
+from tebra_request_control import RequestController, CircuitOpenError, is_throttled_response, DEFAULT_MAX_RETRIES
+
+logger = logging.getLogger("tebra_audit")
+
+# -----------------------------------------------------------------------------
+# PART 5: Utility Functions
+# -----------------------------------------------------------------------------
+# (These functions remain the same as the final working version in Colab,
+#  except for the corrected normalize_dob)
+
+# Precompiled once; the normalizers run for every compared value
+_STRING_PUNCT_RE = re.compile(r'[.,()-]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_NON_ALNUM_RE = re.compile(r'[^a-zA-Z0-9]')
+_NAME_SUFFIX_RE = re.compile(r'[,.\s]*(md|do|rn|np|pa|pcp|facp|dpm|lcsw|lpcc|rnfa|fnp|aprn)[\s.]*$', flags=re.IGNORECASE | re.DOTALL)
+_NAME_PUNCT_RE = re.compile(r'(?<![-’\'])[,."](?![-’\'])')
+
+def normalize_string(text, remove_spaces=False):
+  if isinstance(text, str): text = text.lower().strip(); text = _STRING_PUNCT_RE.sub('', text);
+  if remove_spaces: text = _WHITESPACE_RE.sub('', text)
+  else: text = ' '.join(text.split())
+  return text; return text
+def normalize_code(code):
+  if isinstance(code, str): return _NON_ALNUM_RE.sub('', code).upper()
+  elif isinstance(code, (int, float)): return str(int(code))
+  return code
+def normalize_name(name):
+    if isinstance(name, str): name = _NAME_SUFFIX_RE.sub('', name.strip()); name = name.lower(); name = _NAME_PUNCT_RE.sub('', name); name = ' '.join(name.split()); return name
+    return name
+def compare_names(excel_name, tebra_name): return compare_normalized_names(normalize_name(excel_name), normalize_name(tebra_name))
+def compare_normalized_names(norm_excel, norm_tebra):
+    if not norm_excel or not norm_tebra: return not norm_excel and not norm_tebra
+    parts_excel = norm_excel.split(); parts_tebra = norm_tebra.split();
+    if not parts_excel or not parts_tebra: return False
+    first_name_match = (parts_excel[0] == parts_tebra[0]); last_name_match = (parts_excel[-1] == parts_tebra[-1])
+    return first_name_match and last_name_match
+
+# *** CORRECTED normalize_dob function ***
+def normalize_dob(date_input):
+    """
+    Attempts to parse a date string or datetime object into YYYY-MM-DD format.
+    Handles MM/DD/YYYY and YYYY-MM-DD string inputs.
+    """
+    if date_input is None:
+        return None
+
+    date_str = None
+    # Check if input is datetime.datetime object
+    if isinstance(date_input, datetime.datetime):
+        try:
+            return date_input.strftime('%Y-%m-%d')
+        except ValueError:
+             # st.warning(f"Could not format datetime object {date_input}.") # Optional UI warning
+             return None
+    # Check if input is already a string
+    elif isinstance(date_input, str):
+        date_str = date_input.strip()
+    # Try converting other types to string
+    else:
+        try:
+            date_str = str(date_input).strip()
+        except Exception:
+            # st.warning(f"Could not convert date input '{date_input}' to string.") # Optional UI warning
+            return None
+
+    # *** Check if date_str became empty AFTER potential conversion/stripping ***
+    if not date_str:
+        return None
+
+    # At this point, date_str should be a non-empty string
+    # Clean up potential time part
+    try:
+        date_part = date_str.split()[0]
+    except IndexError:
+        # st.warning(f"Could not extract date part from '{date_str}'.") # Optional UI warning
+        return None
+    except AttributeError: # Should not happen if not date_str check above worked
+        return None
+
+    # Try parsing known formats
+    try:
+        dt = datetime.datetime.strptime(date_part, '%m/%d/%Y')
+        return dt.strftime('%Y-%m-%d')
+    except ValueError:
+        try:
+            dt = datetime.datetime.strptime(date_part, '%Y-%m-%d')
+            return dt.strftime('%Y-%m-%d')
+        except ValueError:
+            # st.warning(f"Could not parse date string '{date_part}' using known formats.") # Optional UI warning
+            return None
+# *** End of corrected normalize_dob ***
+
+def compare_dob(excel_dob_input, tebra_dob_str): return compare_normalized_dobs(normalize_dob(excel_dob_input), normalize_dob(tebra_dob_str))
+def compare_normalized_dobs(norm_excel, norm_tebra):
+    if not norm_excel or not norm_tebra: return False if norm_excel or norm_tebra else True
+    return norm_excel == norm_tebra
+def get_nested_attribute(obj, attribute_path, default=None):
+    current = obj;
+    try:
+        for attr in attribute_path.split('.'):
+            if current is None: return default
+            current = getattr(current, attr, None)
+        return current if current is not None else default
+    except AttributeError: return default
+def round_half_up(n, decimals=2):
+    if n is None: return None
+    try: number = Decimal(str(n))
+    except (decimal.InvalidOperation, ValueError, TypeError): return None
+    quantizer = Decimal('1e-' + str(decimals)); return number.quantize(quantizer, rounding=ROUND_HALF_UP)
+def compare_providers(excel_provider, tebra_provider): return compare_names(excel_provider, tebra_provider)
+def compare_pos_codes(excel_pos, tebra_pos): return compare_normalized_pos_codes(normalize_string(excel_pos, remove_spaces=True), normalize_string(str(tebra_pos), remove_spaces=True))
+def compare_normalized_pos_codes(norm_excel, norm_tebra):
+    if not norm_excel or not norm_tebra: return not norm_excel and not norm_tebra
+    if norm_excel == 'office' and norm_tebra == '11': return True
+    if ('telehealth' in norm_excel and 'home' in norm_excel) and norm_tebra == '10': return True
+    if norm_excel == norm_tebra: return True; return False
+def compare_ins_plans(excel_plan, tebra_plan): # Assuming this custom logic is desired now
+    norm_excel = normalize_string(excel_plan, remove_spaces=True); norm_tebra = normalize_string(tebra_plan, remove_spaces=True)
+    if not norm_excel or not norm_tebra: return not norm_excel and not norm_tebra
+    excel_is_bcbs = norm_excel == 'bcbs'; tebra_is_bluecross = 'bluecross' in norm_tebra or 'bcbs' in norm_tebra
+    if excel_is_bcbs and tebra_is_bluecross: return True
+    if tebra_is_bluecross and ('bluecross' in norm_excel or 'bcbs' in norm_excel): return True
+    if norm_excel == norm_tebra: return True; return False
+def format_mismatch_reason(field, excel_val, tebra_val, identifier=None):
+  excel_str = str(excel_val) if excel_val is not None else 'NULL'; tebra_str = str(tebra_val) if tebra_val is not None else 'NULL'
+  reason = f"{field} Mismatch (Excel: '{excel_str}', Tebra: '{tebra_str}')"
+  if identifier: reason += f" for Claim ID {identifier}"
+  return reason
+# --- End of Part 5 Functions ---
+
+# -----------------------------------------------------------------------------
+# PART 5b: Bulk / Memoized Normalization
+# -----------------------------------------------------------------------------
+# Excel values are normalized once per DataFrame (once per distinct value, since providers, payers, POS and
+# modifiers repeat thousands of times); Tebra values go through bounded memoization of the same functions.
+
+TEBRA_NORMALIZE_CACHE_SIZE = 65536
+
+class NormalizationError:
+    """Stands in for a value whose normalization raised; the comparison step re-raises it where the row is compared."""
+    __slots__ = ("error",)
+    def __init__(self, error): self.error = error
+
+def prepared_value(norm, key):
+    value = norm[key]
+    if isinstance(value, NormalizationError): raise value.error
+    return value
+
+def _memoize(func):
+    # typed=True keeps 1, 1.0 and '1' apart, since the normalizers treat them differently
+    cached_func = functools.lru_cache(maxsize=TEBRA_NORMALIZE_CACHE_SIZE, typed=True)(func)
+    @functools.wraps(func)
+    def wrapper(value):
+        try: return cached_func(value)
+        except TypeError: return func(value) # Unhashable input
+    wrapper.cache_info = cached_func.cache_info; wrapper.cache_clear = cached_func.cache_clear
+    return wrapper
+
+def _normalize_pos_value(value): return normalize_string(value, remove_spaces=True)
+def _round_amount(value): return round_half_up(value, decimals=2)
+
+memo_normalize_code = _memoize(normalize_code)
+memo_normalize_string = _memoize(normalize_string)
+memo_normalize_pos = _memoize(_normalize_pos_value)
+memo_normalize_name = _memoize(normalize_name)
+memo_normalize_dob = _memoize(normalize_dob)
+memo_round_amount = _memoize(_round_amount)
+
+def _normalize_code_vec(values): return values.str.replace(_NON_ALNUM_RE, '', regex=True).str.upper()
+def _normalize_string_vec(values): return values.str.lower().str.strip().str.replace(_STRING_PUNCT_RE, '', regex=True).str.split().str.join(' ')
+def _normalize_pos_vec(values): return values.str.lower().str.strip().str.replace(_STRING_PUNCT_RE, '', regex=True).str.replace(_WHITESPACE_RE, '', regex=True)
+def _normalize_name_vec(values): return values.str.strip().str.replace(_NAME_SUFFIX_RE, '', regex=True).str.lower().str.replace(_NAME_PUNCT_RE, '', regex=True).str.split().str.join(' ')
+def _strip_vec(values): return values.str.strip()
+def _normalize_dob_vec(values):
+    date_part = values.str.strip().str.split(n=1).str[0]
+    parsed = pd.to_datetime(date_part, format='%m/%d/%Y', errors='coerce').fillna(pd.to_datetime(date_part, format='%Y-%m-%d', errors='coerce'))
+    normalized = parsed.dt.strftime('%Y-%m-%d').astype(object).where(parsed.notna(), None)
+    # Anything pandas could not parse (e.g. years outside its Timestamp range) goes through the scalar parser
+    unparsed = normalized.isna() & date_part.notna()
+    if unparsed.any(): normalized[unparsed] = values[unparsed].map(normalize_dob)
+    return normalized
+
+def _map_unique(series, func, vector_func=None):
+    """
+    Applies func once per distinct value of series and broadcasts the results back to every row.
+    All-string columns are normalized with vector_func (pandas .str ops) over the distinct values. Mixed columns use
+    func, keyed by (type, value) so that 1 and '1' stay distinct. Values func raises on become NormalizationError.
+    """
+    values = series.to_numpy(dtype=object)
+    if vector_func is not None and len(values) and pd.api.types.infer_dtype(values, skipna=False) == 'string':
+        codes, uniques = pd.factorize(values)
+        normalized = vector_func(pd.Series(uniques, dtype=object)).to_numpy(dtype=object)
+        return normalized[codes]
+    results = {}; output = []
+    for value in values:
+        try: key = (type(value), value); output.append(results[key]); continue
+        except KeyError: pass
+        except TypeError: key = None # Unhashable; normalize without caching
+        try: normalized = func(value)
+        except Exception as e: normalized = NormalizationError(e)
+        if key is not None: results[key] = normalized
+        output.append(normalized)
+    return output
+
+def parse_excel_dos(excel_dos_raw):
+    """Returns (dos_datetime, 'YYYY-MM-DD') for an Excel DateOfService value; raises ValueError for missing/invalid dates."""
+    if pd.isna(excel_dos_raw): raise ValueError("Missing DateOfService")
+    try: excel_dos_dt = excel_dos_raw if isinstance(excel_dos_raw, datetime.datetime) else pd.to_datetime(excel_dos_raw).to_pydatetime()
+    except Exception as date_err: raise ValueError(f"Invalid DateOfService format '{excel_dos_raw}': {date_err}") from date_err
+    return excel_dos_dt, excel_dos_dt.strftime('%Y-%m-%d')
+
+def excel_patient_name_key(excel_patient_name_raw):
+    # Excel names are 'Last, First'; compare_names expects 'First Last'
+    excel_name_parts = [p.strip() for p in str(excel_patient_name_raw).split(',')] if excel_patient_name_raw else []; excel_name_normalized = f"{excel_name_parts[1]} {excel_name_parts[0]}" if len(excel_name_parts)==2 else excel_patient_name_raw
+    return normalize_name(excel_name_normalized)
+
+def parse_excel_units(excel_units_raw):
+    excel_units_str = str(excel_units_raw).strip(); return excel_units_str, (Decimal(excel_units_str) if excel_units_str else Decimal(0))
+
+def prepare_audit_frame(df):
+    """
+    Builds the normalized Excel-side values the comparison phase reads, one column per compared field, aligned with df.
+    Computed once for the whole DataFrame; the per-row steps only look these values up.
+    """
+    def column(name, default=None):
+        return df[name] if name in df.columns else pd.Series([default] * len(df), index=df.index, dtype=object)
+    prepared = {
+        "patient_id": _map_unique(column('PatientID', ''), lambda v: str(v).strip(), _strip_vec),
+        "claim_id": _map_unique(column('claimID', 'UNKNOWN'), str),
+        "dos": _map_unique(column('DateOfService'), parse_excel_dos),
+        "patient_name": _map_unique(column('PatientName'), excel_patient_name_key),
+        "dob": _map_unique(column('DOB'), normalize_dob, _normalize_dob_vec),
+        "cpt": _map_unique(column('ProcedureCode'), normalize_code, _normalize_code_vec),
+        "amount": _map_unique(column('ServiceChargeAmount'), _round_amount),
+        "claim_code": _map_unique(column('claimID'), lambda v: normalize_code(str(v))),
+        "encounter_code": _map_unique(column('EncounterID'), lambda v: normalize_code(str(v))),
+        "rendering_provider": _map_unique(column('RenderingProvider'), normalize_name, _normalize_name_vec),
+        "referring_provider": _map_unique(column('ReferringProvider'), normalize_name, _normalize_name_vec),
+        "referring_present": _map_unique(column('ReferringProvider'), lambda v: bool(v) and not pd.isna(v)), # Referring is only name-compared when given in Excel
+        "service_location": _map_unique(column('ServiceLocationName'), normalize_string, _normalize_string_vec),
+        "pos": _map_unique(column('PlaceOfServiceCode'), _normalize_pos_value, _normalize_pos_vec),
+        "units": _map_unique(column('ServiceUnitCount', '0'), parse_excel_units),
+        "primary_ins": _map_unique(column('PriIns_CompanyName'), normalize_string, _normalize_string_vec),
+    }
+    for i in range(1, 5):
+        prepared[f"modifier{i}"] = _map_unique(column(f'ProcedureModifier{i}'), normalize_code, _normalize_code_vec)
+        prepared[f"icd{i}"] = _map_unique(column(f'EncounterDiagnosisID{i}'), normalize_code, _normalize_code_vec)
+    return pd.DataFrame(prepared, index=df.index, dtype=object)
+
+def prepared_records(prepared):
+    """One dict per row of a prepare_audit_frame result (faster than DataFrame.to_dict('records') for object columns)."""
+    columns = list(prepared.columns)
+    return [dict(zip(columns, values)) for values in zip(*(prepared[column].to_numpy(dtype=object) for column in columns))]
+# --- End of Part 5b ---
+
+# -----------------------------------------------------------------------------
+# PART 2 & 6 Functions: Tebra SOAP access
+# -----------------------------------------------------------------------------
+
+DEFAULT_PREFETCH_WORKERS = 8
+MAX_PREFETCH_WORKERS = 32 # Ceiling of the adaptive concurrency limit; also sizes the HTTP keep-alive pool so every in-flight call reuses a connection
+SOAP_CONNECT_TIMEOUT = 10 # Seconds to open a connection to Tebra
+SOAP_READ_TIMEOUT = 120 # Seconds to wait for a SOAP response (a timed-out call is retried, see tebra_request_control)
+CHARGE_FETCH_MODES = ("auto", "patient", "practice")
+MAX_CHARGE_WINDOW_DAYS = 31 # Longest service-date span requested in one GetCharges call
+AUTO_PRACTICE_WIDE_MIN_RATIO = 20 # 'auto' switches to practice-wide windows when they need 20x fewer calls
+CHARGE_PAGE_LIMIT = 1000 # GetCharges returns at most this many charges, so a response this large is treated as truncated and its window is split
+
+DEFAULT_WSDL_URL = "https://webservice.kareo.com/services/soap/2.1/KareoServices.svc?singleWsdl"
+DEFAULT_WSDL_PATH = os.environ.get("TEBRA_WSDL_PATH") or None # Local WSDL file; when set, startup needs no network
+DEFAULT_WSDL_CACHE_DIR = os.environ.get("TEBRA_AUDIT_WSDL_CACHE_DIR", os.path.join(".tebra_cache", "wsdl"))
+WSDL_REFRESH_HOURS = 24 # Snapshot age after which the remote WSDL is re-downloaded and compared by checksum
+
+# --- Compact Tebra records ---
+# Responses are converted straight into these __slots__ records holding only the fields the audit reads, so the
+# caches don't retain full zeep object trees and the comparisons use plain attribute access (missing fields are None).
+
+TEBRA_NS = '{http://www.kareo.com/api/schemas/}'
+
+class _TebraRecord:
+    __slots__ = ()
+    @classmethod
+    def from_soap(cls, soap_object):
+        """Builds a record from a zeep object (or any object with the same attributes, e.g. legacy cached responses)."""
+        if isinstance(soap_object, cls): return soap_object
+        record = cls.__new__(cls)
+        for field in cls.__slots__: setattr(record, field, getattr(soap_object, field, None))
+        return record
+    def __reduce__(self): return (_restore_record, (type(self), tuple(getattr(self, field) for field in self.__slots__)))
+    def __repr__(self): return f"{type(self).__name__}({', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)})"
+
+def _restore_record(cls, values):
+    record = cls.__new__(cls)
+    for field, value in zip(cls.__slots__, values): setattr(record, field, value)
+    return record
+
+class TebraPatient(_TebraRecord):
+    __slots__ = ('ID', 'PatientFullName', 'FirstName', 'LastName', 'DOB')
+
+class TebraCharge(_TebraRecord):
+    __slots__ = ('ID', 'EncounterID', 'PatientID', 'PatientName', 'ServiceStartDate', 'ProcedureCode', 'TotalCharges', 'Units', 'RenderingProviderName', 'ReferringProviderName',
+                 'ServiceLocationName', 'ServiceLocationPlaceOfServiceCode', 'PrimaryInsuranceCompanyName', 'ProcedureModifier1', 'ProcedureModifier2', 'ProcedureModifier3', 'ProcedureModifier4',
+                 'EncounterDiagnosisID1', 'EncounterDiagnosisID2', 'EncounterDiagnosisID3', 'EncounterDiagnosisID4')
+
+def to_patient_record(value):
+    # GetPatient responses (live or cached before records existed) carry the patient under .Patient
+    if value is None or isinstance(value, TebraPatient): return value
+    patient = getattr(value, 'Patient', value)
+    return TebraPatient.from_soap(patient) if patient else None
+
+def to_charge_records(charges): return [TebraCharge.from_soap(charge) for charge in charges or []]
+
+_request_types_by_client = weakref.WeakKeyDictionary(); _request_types_lock = threading.Lock()
+
+def get_request_types(client):
+    """zeep request/filter types, resolved once per client instead of on every call."""
+    with _request_types_lock:
+        request_types = _request_types_by_client.get(client)
+        if request_types is None:
+            request_types = {name: client.get_type(f'{TEBRA_NS}{name}') for name in ('RequestHeader', 'GetPatientReq', 'SinglePatientFilter', 'GetChargesReq', 'ChargeFilter')}
+            _request_types_by_client[client] = request_types
+    return request_types
+
+def _file_sha256(path):
+    with open(path, 'rb') as f: return hashlib.sha256(f.read()).hexdigest()
+
+def resolve_wsdl_location(wsdl_url=DEFAULT_WSDL_URL, wsdl_path=None, cache_dir=DEFAULT_WSDL_CACHE_DIR, refresh_hours=WSDL_REFRESH_HOURS, session=None):
+    """
+    Picks the WSDL zeep should parse. Returns (location, source).
+    wsdl_path wins when given. Otherwise the remote WSDL is kept as an on-disk snapshot in cache_dir: a snapshot younger
+    than refresh_hours is used without touching the network; an older one is re-downloaded and only replaced when its
+    SHA-256 changed. If the download fails, an existing snapshot is used anyway, so a slow or unreachable endpoint
+    does not block startup. Without cache_dir the URL is returned unchanged.
+    """
+    if wsdl_path:
+        if not os.path.isfile(wsdl_path): raise FileNotFoundError(f"WSDL file not found: {wsdl_path}")
+        return wsdl_path, "local file"
+    if not cache_dir: return wsdl_url, "remote"
+    os.makedirs(cache_dir, exist_ok=True)
+    snapshot_path = os.path.join(cache_dir, f"{hashlib.sha256(wsdl_url.encode('utf-8')).hexdigest()[:16]}.wsdl"); checksum_path = snapshot_path + ".sha256"
+    has_snapshot = os.path.isfile(snapshot_path)
+    if has_snapshot and time.time() - os.path.getmtime(snapshot_path) < float(refresh_hours) * 3600: return snapshot_path, "snapshot"
+    try:
+        response = (session or Session()).get(wsdl_url, timeout=120); response.raise_for_status(); content = response.content
+    except Exception as e:
+        if not has_snapshot: raise
+        logger.warning("WSDL refresh failed, using the existing snapshot: %s", e); return snapshot_path, "snapshot (refresh failed)"
+    checksum = hashlib.sha256(content).hexdigest()
+    try: stored_checksum = open(checksum_path, encoding='utf-8').read().strip() if has_snapshot and os.path.isfile(checksum_path) else None
+    except OSError: stored_checksum = None
+    if has_snapshot and checksum == stored_checksum and checksum == _file_sha256(snapshot_path):
+        os.utime(snapshot_path); return snapshot_path, "snapshot (checksum unchanged)"
+    temp_path = f"{snapshot_path}.{os.getpid()}.tmp" # Written aside and renamed so a concurrent reader never sees a partial file
+    with open(temp_path, 'wb') as f: f.write(content)
+    os.replace(temp_path, snapshot_path)
+    with open(checksum_path, 'w', encoding='utf-8') as f: f.write(checksum)
+    logger.info("WSDL snapshot %s (%s).", "updated" if has_snapshot else "downloaded", checksum[:12])
+    return snapshot_path, "downloaded" if not has_snapshot else "updated"
+
+def create_api_client(wsdl_url=DEFAULT_WSDL_URL, wsdl_path=DEFAULT_WSDL_PATH, cache_dir=DEFAULT_WSDL_CACHE_DIR, refresh_hours=WSDL_REFRESH_HOURS):
+    """
+    Loads the Kareo WSDL (local file, on-disk snapshot or URL, see resolve_wsdl_location) and returns a zeep client.
+    Schema documents the WSDL imports are cached by zeep's SqliteCache in cache_dir. client.tebra_wsdl_info records
+    the WSDL source and the seconds until the client was ready. Raises if the WSDL cannot be loaded or parsed.
+    """
+    logger.info("Connecting to Tebra SOAP API...")
+    start_time = time.perf_counter()
+    session = Session()
+    # Keep-alive pool as large as the highest concurrency limit; pool_block caps open connections there when several runs share the client. Retries happen in RequestController, not urllib3
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_PREFETCH_WORKERS, pool_block=True, max_retries=0); session.mount('https://', adapter); session.mount('http://', adapter)
+    if cache_dir: os.makedirs(cache_dir, exist_ok=True)
+    wsdl_location, wsdl_source = resolve_wsdl_location(wsdl_url, wsdl_path=wsdl_path, cache_dir=cache_dir, refresh_hours=refresh_hours, session=session)
+    schema_cache = SqliteCache(path=os.path.join(cache_dir, "zeep_documents.sqlite3"), timeout=int(float(refresh_hours) * 3600)) if cache_dir else None
+    transport = Transport(session=session, timeout=SOAP_READ_TIMEOUT, operation_timeout=(SOAP_CONNECT_TIMEOUT, SOAP_READ_TIMEOUT), cache=schema_cache)
+    client = zeep.Client(wsdl=wsdl_location, transport=transport)
+    client.tebra_wsdl_info = {"source": wsdl_source, "location": wsdl_location, "seconds": time.perf_counter() - start_time}
+    logger.info("Tebra client ready in %.2f seconds (WSDL from %s).", client.tebra_wsdl_info["seconds"], wsdl_source)
+    return client
+
+def build_request_header(credentials, client):
+    """Builds the RequestHeader sent with every call. Raises ValueError without a client."""
+    if not client: raise ValueError("Cannot build header without API client.")
+    header_type = get_request_types(client)['RequestHeader']
+    return header_type(CustomerKey=credentials['CustomerKey'], User=credentials['User'], Password=credentials['Password'])
+
+def get_tebra_patient_soap(client, header, patient_id, metrics=None, request_controller=None):
+    """
+    Returns (TebraPatient, None) or (None, error message). Each request sent is recorded in metrics (a RunMetrics), if given.
+    With a request_controller (RequestController) the call waits for a concurrency slot and transient failures are retried.
+    """
+    soap_method_name = "GetPatient"
+    try: patient_id_int = int(patient_id)
+    except (ValueError, TypeError): return None, f"Invalid Patient ID format: '{patient_id}'."
+    call_start = time.perf_counter(); error_type = None
+    try:
+        request_types = get_request_types(client); SinglePatientFilter_Type = request_types['SinglePatientFilter']; GetPatientReq_Type = request_types['GetPatientReq']
+        filter_object = SinglePatientFilter_Type(PatientID=patient_id_int); patient_request_object = GetPatientReq_Type(RequestHeader=header, Filter=filter_object)
+        send = lambda: client.service.GetPatient(request=patient_request_object)
+        response = request_controller.call(soap_method_name, send, is_throttled_response) if request_controller is not None else send()
+        if hasattr(response, 'ErrorResponse') and response.ErrorResponse.IsError: error_type = "API Error"; error_msg = get_nested_attribute(response, 'ErrorResponse.ErrorMessage', 'Unknown API error'); return None, f"API Error ({soap_method_name}): {error_msg}"
+        if not hasattr(response, 'Patient') or not response.Patient: error_type = "Patient not found"; return None, f"Patient data object not found in response for ID {patient_id_int}."
+        return TebraPatient.from_soap(response.Patient), None
+    except zeep.exceptions.Fault as fault: error_type = "SOAP Fault"; return None, f"SOAP Fault ({soap_method_name} {patient_id_int}): {fault.message}"
+    except CircuitOpenError as e: error_type = "Circuit open"; return None, f"Tebra API unavailable ({soap_method_name} {patient_id_int}): {e}"
+    except (TypeError, AttributeError, ValueError, zeep.exceptions.Error) as e: error_type = type(e).__name__; return None, f"Zeep/Request Error ({soap_method_name} {patient_id_int}): {type(e).__name__} - {e}"
+    except Exception as e: error_type = type(e).__name__; return None, f"Unexpected Error ({soap_method_name} {patient_id_int}): {type(e).__name__} - {e}"
+    finally:
+        if metrics is not None: metrics.record_call(soap_method_name, time.perf_counter() - call_start, error_type)
+
+def get_tebra_patient_cached(client, header, patient_id, response_cache=None, metrics=None, request_controller=None):
+    """get_tebra_patient_soap backed by the persistent response cache; only successful responses are stored."""
+    if response_cache is None: return get_tebra_patient_soap(client, header, patient_id, metrics=metrics, request_controller=request_controller)
+    customer_key = get_nested_attribute(header, 'CustomerKey', ''); filter_params = {"PatientID": str(patient_id).strip()}
+    hit, cached_patient = response_cache.get(customer_key, "GetPatient", filter_params); hit = hit and to_patient_record(cached_patient) is not None
+    if metrics is not None: metrics.count_cache("response_cache:GetPatient", hit)
+    if hit: return to_patient_record(cached_patient), None
+    patient, api_error = get_tebra_patient_soap(client, header, patient_id, metrics=metrics, request_controller=request_controller)
+    if api_error is None and patient is not None: response_cache.put(customer_key, "GetPatient", filter_params, patient)
+    return patient, api_error
+
+def prefetch_tebra_patients(client, header, patient_ids, patient_cache, max_workers=DEFAULT_PREFETCH_WORKERS, progress_callback=None, response_cache=None, metrics=None, request_controller=None):
+    """
+    Resolves every unique PatientID not yet in patient_cache through a bounded thread pool (with a request_controller,
+    sized to its highest limit and throttled by it).
+    Results are stored exactly as get_tebra_patient_soap returns them: (TebraPatient, error) tuples.
+    Returns the number of IDs resolved (from Tebra or the persistent response cache).
+    """
+    pending_ids = [pid for pid in dict.fromkeys(patient_ids) if pid and pid not in patient_cache]
+    if not pending_ids: return 0
+    max_workers = max(1, min(request_controller.pool_size() if request_controller is not None else int(max_workers), MAX_PREFETCH_WORKERS, len(pending_ids)))
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tebra-prefetch")
+    try:
+        future_to_id = {executor.submit(get_tebra_patient_cached, client, header, pid, response_cache, metrics, request_controller): pid for pid in pending_ids}
+        for done_count, future in enumerate(as_completed(future_to_id), start=1):
+            pid = future_to_id[future]
+            try: patient_cache[pid] = future.result()
+            except Exception as e: patient_cache[pid] = (None, f"Unexpected Error (GetPatient {pid}): {type(e).__name__} - {e}")
+            if progress_callback: progress_callback(done_count, len(pending_ids))
+    finally: executor.shutdown(wait=True, cancel_futures=True) # If the progress callback aborts the run (job cancelled), queued requests are dropped
+    return len(pending_ids)
+
+def get_tebra_charges_soap(client, header, patient_name, dos_datetime, response_cache=None, metrics=None, request_controller=None):
+    try: dos_str = dos_datetime.strftime('%Y-%m-%d')
+    except (AttributeError) as e: return [], f"Invalid DOS input for GetCharges: '{dos_datetime}'. Error: {e}"
+    if not patient_name: return [], "Cannot fetch charges without a valid patient name."
+    return get_tebra_charges_window_cached(client, header, dos_str, dos_str, patient_name=patient_name, response_cache=response_cache, metrics=metrics, request_controller=request_controller)
+
+def get_tebra_charges_window_soap(client, header, from_date_str, to_date_str, patient_name=None, metrics=None, request_controller=None):
+    """Fetches every charge with a service date in [from_date_str, to_date_str] as TebraCharge records; practice-wide when patient_name is None. request_controller as in get_tebra_patient_soap."""
+    soap_method_name = "GetCharges"
+    target_label = f"'{patient_name}'" if patient_name else "practice-wide"; window_label = from_date_str if from_date_str == to_date_str else f"{from_date_str} to {to_date_str}"
+    call_start = time.perf_counter(); error_type = None
+    try:
+        request_types = get_request_types(client); ChargeFilter_Type = request_types['ChargeFilter']; GetChargesReq_Type = request_types['GetChargesReq']
+        filter_kwargs = {"FromServiceDate": from_date_str, "ToServiceDate": to_date_str}
+        if patient_name: filter_kwargs["PatientName"] = patient_name
+        charge_filter_object = ChargeFilter_Type(**filter_kwargs)
+        charge_request_object = GetChargesReq_Type(RequestHeader=header, Filter=charge_filter_object)
+        send = lambda: client.service.GetCharges(request=charge_request_object)
+        response = request_controller.call(soap_method_name, send, is_throttled_response) if request_controller is not None else send()
+        if hasattr(response, 'ErrorResponse') and response.ErrorResponse.IsError: error_type = "API Error"; error_msg = get_nested_attribute(response, 'ErrorResponse.ErrorMessage', 'Unknown API error'); return [], f"API Error ({soap_method_name}): {error_msg}"
+        charges_data_container = get_nested_attribute(response, 'Charges.ChargeData', default=[]);
+        if charges_data_container is None: charges_list = []
+        elif not isinstance(charges_data_container, list): charges_list = [charges_data_container]
+        else: charges_list = charges_data_container
+        if metrics is not None: metrics.increment("charges_returned", len(charges_list))
+        return to_charge_records(charges_list), None
+    except zeep.exceptions.Fault as fault: error_type = "SOAP Fault"; return [], f"SOAP Fault ({soap_method_name} {target_label}, {window_label}): {fault.message}"
+    except CircuitOpenError as e: error_type = "Circuit open"; return [], f"Tebra API unavailable ({soap_method_name} {target_label}, {window_label}): {e}"
+    except (TypeError, AttributeError, ValueError, zeep.exceptions.Error) as e: error_type = type(e).__name__; return [], f"Zeep/Request Error ({soap_method_name} {target_label}, {window_label}): {type(e).__name__} - {e}"
+    except Exception as e: error_type = type(e).__name__; return [], f"Unexpected Error ({soap_method_name} {target_label}, {window_label}): {type(e).__name__} - {e}"
+    finally:
+        if metrics is not None: metrics.record_call(soap_method_name, time.perf_counter() - call_start, error_type)
+
+def get_tebra_charges_window_cached(client, header, from_date_str, to_date_str, patient_name=None, response_cache=None, metrics=None, request_controller=None):
+    """get_tebra_charges_window_soap backed by the persistent response cache; empty charge lists are valid hits."""
+    if response_cache is None: return get_tebra_charges_window_soap(client, header, from_date_str, to_date_str, patient_name=patient_name, metrics=metrics, request_controller=request_controller)
+    customer_key = get_nested_attribute(header, 'CustomerKey', ''); filter_params = {"PatientName": patient_name, "FromServiceDate": from_date_str, "ToServiceDate": to_date_str}
+    hit, cached_charges = response_cache.get(customer_key, "GetCharges", filter_params)
+    if metrics is not None: metrics.count_cache("response_cache:GetCharges", hit)
+    if hit: return to_charge_records(cached_charges), None
+    charges_list, api_error = get_tebra_charges_window_soap(client, header, from_date_str, to_date_str, patient_name=patient_name, metrics=metrics, request_controller=request_controller)
+    if api_error is None: response_cache.put(customer_key, "GetCharges", filter_params, charges_list)
+    return charges_list, api_error
+
+def get_tebra_patient_filter_name(tebra_patient):
+    """Name used both for the GetCharges PatientName filter and for the patient name comparison."""
+    patient_name = tebra_patient.PatientFullName; first_name = tebra_patient.FirstName; last_name = tebra_patient.LastName
+    if not patient_name and first_name and last_name: patient_name = f"{first_name} {last_name}"
+    return patient_name
+
+def normalize_service_date(value):
+    """Normalizes a Tebra charge service date (datetime, date or 'YYYY-MM-DDTHH:MM:SS' / 'MM/DD/YYYY' string) to YYYY-MM-DD."""
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime): return value.strftime('%Y-%m-%d')
+    if isinstance(value, str): value = value.replace('T', ' ')
+    return normalize_dob(value)
+
+def split_date_windows(date_strs, max_window_days=MAX_CHARGE_WINDOW_DAYS):
+    """Groups YYYY-MM-DD strings into consecutive windows spanning at most max_window_days. Returns [(from, to, [dates])]."""
+    windows = []
+    for date_str in sorted(set(date_strs)):
+        date_value = datetime.date.fromisoformat(date_str)
+        if windows and (date_value - windows[-1][0]).days < max_window_days: windows[-1][1].append(date_str)
+        else: windows.append((date_value, [date_str]))
+    return [(dates[0], dates[-1], dates) for _, dates in windows]
+
+def plan_charge_requests(charge_keys, mode="auto", max_window_days=MAX_CHARGE_WINDOW_DAYS):
+    """
+    Groups (patient_name, dos_str) keys into GetCharges requests.
+    'patient' sends one request per patient over its DOS span, 'practice' one request per date window with no
+    PatientName filter, 'auto' picks practice-wide windows only when they need far fewer calls.
+    Returns a list of (patient_name or None, from_date_str, to_date_str, [charge_keys covered]).
+    """
+    if mode not in CHARGE_FETCH_MODES: raise ValueError(f"Unknown charge fetch mode '{mode}'.")
+    dates_by_patient = {}
+    for patient_name, dos_str in dict.fromkeys(charge_keys): dates_by_patient.setdefault(patient_name, []).append(dos_str)
+    patient_plan = [(patient_name, from_str, to_str, [(patient_name, d) for d in dates]) for patient_name, patient_dates in dates_by_patient.items() for from_str, to_str, dates in split_date_windows(patient_dates, max_window_days)]
+    if mode == "patient" or not patient_plan: return patient_plan
+    names_by_date = {}
+    for patient_name, dos_str in dict.fromkeys(charge_keys): names_by_date.setdefault(dos_str, []).append(patient_name)
+    practice_plan = [(None, from_str, to_str, [(n, d) for d in dates for n in names_by_date[d]]) for from_str, to_str, dates in split_date_windows(names_by_date, max_window_days)]
+    if mode == "practice" or len(patient_plan) >= AUTO_PRACTICE_WIDE_MIN_RATIO * len(practice_plan): return practice_plan
+    return patient_plan
+
+def split_charge_request(batch):
+    """
+    Replaces a GetCharges request (patient_name, from, to, keys) whose response may be truncated with smaller ones:
+    two halves by service date, each narrowed to the dates of its keys, or one request per patient for a single-day
+    practice-wide request. Returns [] when a single-day, single-patient request cannot be split further.
+    """
+    patient_name, from_str, to_str, batch_keys = batch
+    if from_str == to_str: return [] if patient_name is not None else [(name, from_str, to_str, [(name, from_str)]) for name in dict.fromkeys(name for name, _ in batch_keys)]
+    from_date = datetime.date.fromisoformat(from_str); middle_str = (from_date + (datetime.date.fromisoformat(to_str) - from_date) // 2).isoformat(); halves = []
+    for half_keys in ([key for key in batch_keys if key[1] <= middle_str], [key for key in batch_keys if key[1] > middle_str]):
+        if half_keys: half_dates = sorted({dos_str for _, dos_str in half_keys}); halves.append((patient_name, half_dates[0], half_dates[-1], half_keys))
+    return halves
+
+def _resolve_charge_patient_name(tebra_charge, patient_names_by_id, requested_names):
+    # Practice-wide results carry every patient's charges; map them back to the name used as cache key
+    charge_patient_id = tebra_charge.PatientID
+    if charge_patient_id is not None and patient_names_by_id:
+        patient_name = patient_names_by_id.get(str(charge_patient_id).strip())
+        if patient_name: return patient_name
+    charge_patient_name = tebra_charge.PatientName
+    return charge_patient_name if charge_patient_name in requested_names else None
+
+def fetch_tebra_charges_batched(client, header, charge_keys, charges_cache, mode="auto", patient_names_by_id=None, max_workers=DEFAULT_PREFETCH_WORKERS, progress_callback=None, response_cache=None, metrics=None, request_controller=None,
+                                page_limit=CHARGE_PAGE_LIMIT):
+    """
+    Fetches charges for many (patient_name, dos_str) keys with as few GetCharges calls as possible and splits the
+    results into charges_cache[(patient_name, dos_str)] = (charges, error). Keys with no charges are cached as ([], None)
+    so they are not re-fetched. Keys of a patient with a charge in the batch without a parseable service date are left
+    out of the cache, so the caller falls back to a single-day request for that patient's dates only. A response with
+    page_limit charges may be truncated, so its request is split (split_charge_request) and sent again; keys of a
+    request that cannot be split further get an error rather than a possibly incomplete charge list. Returns the
+    number of requests sent.
+    """
+    pending_keys = [key for key in dict.fromkeys(charge_keys) if key not in charges_cache]
+    plan = plan_charge_requests(pending_keys, mode=mode)
+    if not plan: return 0
+    requested_names = {patient_name for patient_name, _ in pending_keys}; requests_sent = 0; total = len(plan)
+    def run_batch(batch):
+        patient_name, from_str, to_str, _ = batch
+        return get_tebra_charges_window_cached(client, header, from_str, to_str, patient_name=patient_name, response_cache=response_cache, metrics=metrics, request_controller=request_controller)
+    max_workers = max(1, min(request_controller.pool_size() if request_controller is not None else int(max_workers), MAX_PREFETCH_WORKERS, len(plan)))
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tebra-charges")
+    try:
+        pending = {executor.submit(run_batch, batch): batch for batch in plan}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = pending.pop(future); batch_patient_name, batch_from, _, batch_keys = batch; requests_sent += 1
+                try: charges_list, api_error = future.result()
+                except Exception as e: charges_list, api_error = [], f"Unexpected Error (GetCharges): {type(e).__name__} - {e}"
+                if not api_error and len(charges_list) >= page_limit:
+                    smaller_batches = split_charge_request(batch)
+                    if metrics is not None: metrics.increment("charge_requests_split")
+                    if smaller_batches:
+                        total += len(smaller_batches)
+                        for smaller_batch in smaller_batches: pending[executor.submit(run_batch, smaller_batch)] = smaller_batch
+                        if progress_callback: progress_callback(requests_sent, total)
+                        continue
+                    api_error = f"GetCharges returned {len(charges_list)} charges for '{batch_patient_name}' on {batch_from} alone; the response may be truncated."
+                if api_error:
+                    for key in batch_keys: charges_cache[key] = ([], api_error)
+                else:
+                    charges_index = {key: [] for key in batch_keys}; undated_owner_names = set()
+                    for tebra_charge in charges_list:
+                        owner_name = batch_patient_name if batch_patient_name is not None else _resolve_charge_patient_name(tebra_charge, patient_names_by_id, requested_names)
+                        service_date_str = normalize_service_date(tebra_charge.ServiceStartDate)
+                        if not service_date_str: undated_owner_names.add(owner_name); continue
+                        if (owner_name, service_date_str) in charges_index: charges_index[(owner_name, service_date_str)].append(tebra_charge)
+                    charges_cache.update({key: (charges, None) for key, charges in charges_index.items() if key[0] not in undated_owner_names})
+                if progress_callback: progress_callback(requests_sent, total)
+    finally: executor.shutdown(wait=True, cancel_futures=True)
+    return requests_sent
+
+def find_matching_charge(excel_row_data, tebra_charges_list, excel_norm=None):
+    """excel_norm: the row's prepare_audit_frame values; when given, the Excel CPT/amount are not re-normalized."""
+    excel_claim_id = None
+    try:
+        if excel_norm is not None:
+            excel_cpt = prepared_value(excel_norm, 'cpt'); excel_charge = prepared_value(excel_norm, 'amount'); excel_claim_id = prepared_value(excel_norm, 'claim_id')
+        elif isinstance(excel_row_data, pd.Series):
+            excel_cpt = normalize_code(excel_row_data.get('ProcedureCode')); excel_charge = round_half_up(excel_row_data.get('ServiceChargeAmount'), decimals=2); excel_claim_id = str(excel_row_data.get('claimID', 'UNKNOWN'))
+        else:
+             excel_cpt = normalize_code(excel_row_data.get('ProcedureCode')); excel_charge = round_half_up(excel_row_data.get('ServiceChargeAmount'), decimals=2); excel_claim_id = str(excel_row_data.get('claimID', 'UNKNOWN'))
+        potential_matches = []
+        for tebra_charge in tebra_charges_list:
+            tebra_cpt = memo_normalize_code(tebra_charge.ProcedureCode)
+            if excel_cpt == tebra_cpt: potential_matches.append(tebra_charge)
+        if not potential_matches: return None, f"CPT Mismatch (Excel CPT: {excel_cpt} not found in Tebra charges for Claim ID {excel_claim_id})"
+        for tebra_charge in potential_matches:
+            tebra_charge_amt = memo_round_amount(tebra_charge.TotalCharges)
+            if excel_charge is not None and tebra_charge_amt is not None and excel_charge == tebra_charge_amt: return tebra_charge, None
+        first_potential_tebra_amt = memo_round_amount(potential_matches[0].TotalCharges) if potential_matches else 'N/A'
+        return None, f"Amount Mismatch (Excel: {excel_charge}, Tebra: {first_potential_tebra_amt} for Claim ID {excel_claim_id})"
+    except Exception as e:
+        claim_id_str = excel_claim_id if excel_claim_id is not None else 'UNKNOWN'
+        return None, f"Code error in find_matching_charge for Claim ID {claim_id_str}: {e}"
+# --- End of Part 6 Functions ---
+
+# -----------------------------------------------------------------------------
+# PART 7: Audit Pipeline (per-row extract, patient check, charge fetch and compare)
+# -----------------------------------------------------------------------------
+
+REQUIRED_COLUMNS = ['PatientID', 'PatientName', 'DOB', 'DateOfService', 'RenderingProvider','ReferringProvider', 'PlaceOfServiceCode', 'ProcedureCode','ProcedureModifier1', 'ProcedureModifier2', 'ProcedureModifier3', 'ProcedureModifier4','ServiceUnitCount', 'EncounterDiagnosisID1', 'EncounterDiagnosisID2','EncounterDiagnosisID3', 'EncounterDiagnosisID4', 'ServiceChargeAmount','PriIns_CompanyName', 'PriIns_CompanyPlanName', 'EncounterID', 'claimID']
+ID_COLUMN_DTYPES = {'PatientID': str, 'claimID': str, 'EncounterID': str} # Ensure IDs read as string
+STATUS_MAP = {"Match": "Verified", "Mismatch": "Invalid", "Error": "Invalid", "Pending": "Invalid"}
+EXCEL_READ_CHUNK_ROWS = 5000 # Rows of an .xlsx file converted to DataFrame columns at a time
+PROGRESS_PHASE_LABELS = {"directory": "Fetching patient directory", "patients": "Fetching patients", "patient_checks": "Checking patient data", "charges": "Fetching charge batches", "comparisons": "Comparing charges", "checkpoint": "Rows audited and checkpointed", "files": "Files audited"}
+
+def _convert_excel_cell(cell):
+    # Same conversions as pd.read_excel's openpyxl reader: empty cells become '', error cells NaN, integral numbers int
+    value = cell.value
+    if value is None: return ""
+    if cell.data_type == 'e': return np.nan
+    if cell.data_type == 'n':
+        int_value = int(value)
+        return int_value if int_value == value else float(value)
+    return value
+
+def _iter_excel_rows(source):
+    """Yields the first sheet's rows (trailing empty cells trimmed) from an openpyxl read-only workbook."""
+    workbook = load_workbook(source, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[0]; sheet.reset_dimensions()
+        for row in sheet.rows:
+            values = [_convert_excel_cell(cell) for cell in row]
+            while values and values[-1] == "": values.pop()
+            yield values
+    finally: workbook.close()
+
+def _is_parsed_line(values): return len(values) > 1 or (len(values) == 1 and (not isinstance(values[0], str) or values[0].strip())) # TextParser drops the other lines as blank
+
+def _excel_chunk_frame(header, rows):
+    """Parses one chunk like pd.read_excel parses the whole sheet. Returns (frame, {column: raw cell values}) for the columns it converted."""
+    width = max([len(header)] + [len(row) for row in rows]); pad = lambda values: values + [""] * (width - len(values))
+    rows = [padded for padded in map(pad, rows) if _is_parsed_line(padded)]
+    frame = TextParser([pad(header)] + rows, header=0, dtype=ID_COLUMN_DTYPES, keep_default_na=False).read()
+    raw_values = {column: [row[i] for row in rows] for i, column in enumerate(frame.columns) if frame[column].dtype.kind != 'O'}
+    return frame, raw_values
+
+def _concat_excel_chunks(chunks):
+    # Type inference ran per chunk; a column inferred differently across chunks (e.g. numbers in one, text in another)
+    # would have stayed as the original cell values when parsed as a whole, so those chunks get their raw values back
+    frames = [frame for frame, _ in chunks]
+    if len(frames) == 1: return frames[0]
+    for column in dict.fromkeys(column for frame in frames for column in frame.columns):
+        kinds = {{'i': 'n', 'u': 'n', 'f': 'n'}.get(frame[column].dtype.kind, frame[column].dtype.kind) if column in frame.columns else 'O' for frame in frames}
+        if len(kinds) == 1: continue
+        string_dtypes = {frame[column].dtype for frame in frames if column in frame.columns and isinstance(frame[column].dtype, pd.StringDtype)}
+        if len(string_dtypes) == 1 and all(column in frame.columns and (frame[column].dtype in string_dtypes or frame[column].isna().all()) for frame in frames):
+            string_dtype, = string_dtypes # Chunks holding only error cells (NaN) next to text chunks: pandas >= 3 infers its str dtype for the whole column
+            for frame in frames: frame[column] = frame[column].astype(string_dtype)
+            continue
+        for frame, raw_values in chunks:
+            if column not in frame.columns: frame[column] = ""
+            elif column in raw_values: frame[column] = pd.Series(raw_values[column], index=frame.index, dtype=object)
+    widest_columns = max((frame.columns for frame in frames), key=len) # Columns are named by position, so the widest chunk has them all in sheet order
+    return pd.concat(frames, ignore_index=True)[list(widest_columns)]
+
+def read_excel_streaming(source, chunk_rows=EXCEL_READ_CHUNK_ROWS):
+    """
+    Reads the first sheet of an .xlsx file like pd.read_excel(dtype=ID_COLUMN_DTYPES, keep_default_na=False), but
+    converts chunk_rows rows at a time into typed columns instead of first holding every cell as a Python list.
+    """
+    rows = _iter_excel_rows(source); header = next(rows, None)
+    if header is None: return pd.DataFrame()
+    chunks = []; pending = []; blank_rows = []
+    for row in rows:
+        if not row: blank_rows.append(row); continue # Held back so trailing empty rows are dropped, as pandas does
+        pending.extend(blank_rows); blank_rows = []; pending.append(row)
+        if len(pending) >= chunk_rows: chunks.append(_excel_chunk_frame(header, pending)); pending = []
+    if pending or not chunks: chunks.append(_excel_chunk_frame(header, pending))
+    return _concat_excel_chunks(chunks)
+
+def read_audit_file(source, filename=None):
+    """Reads an .xlsx or .csv audit file (path or file-like object) and adds the 'Original Excel Row Index' column."""
+    source_name = str(filename or getattr(source, 'name', None) or source).lower()
+    if source_name.endswith('.csv'): df = pd.read_csv(source, dtype=ID_COLUMN_DTYPES, keep_default_na=False) # The C parser already tokenizes in low_memory chunks
+    else: df = read_excel_streaming(source)
+    for column in df.columns:
+        if df[column].hasnans: df[column] = df[column].fillna('') # Only columns with NaN (error cells) are rewritten
+    df.insert(0, 'Original Excel Row Index', np.arange(len(df)))
+    return df
+
+def missing_required_columns(df): return [col for col in REQUIRED_COLUMNS if col not in df.columns]
+
+class ExcelRowValues:
+    """Raw Excel values of df by (position, column). A column is turned into Python objects only when first read, and rows are never copied."""
+    def __init__(self, df): self._df = df; self._columns = {}
+    def value(self, position, column, default=None):
+        values = self._columns.get(column)
+        if values is None:
+            if column not in self._df.columns: return default
+            values = self._columns[column] = self._df[column].to_numpy(dtype=object)
+        return values[position]
+    def row(self, position): return ExcelRowView(self, position)
+
+class ExcelRowView:
+    """Stands in for the row Series in the per-row steps: row.get(column, default)."""
+    __slots__ = ('_values', '_position')
+    def __init__(self, values, position): self._values = values; self._position = position
+    def get(self, column, default=None): return self._values.value(self._position, column, default)
+
+def extract_row_state(index, row, norm):
+    """
+    Step 1: pulls the identifiers and DOS out of an Excel row. norm is the row's prepare_audit_frame values.
+    The returned state dict is carried through the later steps.
+    """
+    excel_row_num_display = index + 2
+    current_result_data = {"Excel Row": excel_row_num_display, "Status": "Error", "Reason": "Processing started"}
+    state = {"row": row, "norm": norm, "result": current_result_data, "reasons": [], "claim_id": None, "patient_id": None, "patient_name": None, "dos_dt": None, "dos_str": None, "proceed": False, "extract_failed": False}
+    try:
+        excel_patient_id_str = prepared_value(norm, 'patient_id'); state["claim_id"] = excel_claim_id = prepared_value(norm, 'claim_id')
+        if not excel_patient_id_str: raise ValueError("Missing PatientID")
+        current_result_data["Excel PatientID"] = excel_patient_id_str; current_result_data["Excel claimID"] = excel_claim_id
+        excel_dos_dt, excel_dos_str = prepared_value(norm, 'dos')
+        current_result_data["Excel DOS"] = excel_dos_str; current_result_data["Excel ProcCode"] = row.get('ProcedureCode')
+        state.update(patient_id=excel_patient_id_str, dos_dt=excel_dos_dt, dos_str=excel_dos_str)
+    except Exception as e: current_result_data["Reason"] = f"Error reading Excel data: {e}"; state["extract_failed"] = True
+    return state
+
+def check_patient_row(state, tebra_patient, api_error_pat):
+    """Step 3: compares the Excel patient name and DOB with the Tebra patient and decides whether charges are checked."""
+    row = state["row"]; norm = state["norm"]; current_result_data = state["result"]; mismatch_reasons = state["reasons"]
+    excel_patient_name_raw = row.get('PatientName'); excel_dob_raw = row.get('DOB')
+    tebra_patient_name_for_filter = None
+    if api_error_pat: mismatch_reasons.append(f"Patient Fetch Error: {api_error_pat}"); current_result_data["Status"] = "Error"
+    elif not tebra_patient: mismatch_reasons.append(f"No valid Tebra patient data for ID {state['patient_id']}."); current_result_data["Status"] = "Error"
+    else:
+        try:
+            tebra_patient_name_for_filter = get_tebra_patient_filter_name(tebra_patient); tebra_dob_str = tebra_patient.DOB
+            tebra_name_for_compare = tebra_patient_name_for_filter if tebra_patient_name_for_filter else "MISSING_NAME"
+            if not compare_normalized_names(prepared_value(norm, 'patient_name'), memo_normalize_name(tebra_name_for_compare)): mismatch_reasons.append(format_mismatch_reason("Patient Name", excel_patient_name_raw, tebra_name_for_compare))
+            if not compare_normalized_dobs(prepared_value(norm, 'dob'), memo_normalize_dob(tebra_dob_str)): mismatch_reasons.append(format_mismatch_reason("Patient DOB", excel_dob_raw, tebra_dob_str))
+            if not mismatch_reasons: current_result_data["Status"] = "Pending"
+        except Exception as e: mismatch_reasons.append(f"Error processing Tebra patient data: {e}"); current_result_data["Status"] = "Error"
+    state["patient_name"] = tebra_patient_name_for_filter
+    state["proceed"] = bool(current_result_data["Status"] != "Error" and tebra_patient_name_for_filter)
+    return state
+
+def add_directory_hint(state, patient_directory):
+    """For a row whose patient check failed (e.g. a mistyped PatientID), adds the Tebra PatientIDs the directory has with the row's name and DOB."""
+    try: hint = patient_directory.hint(prepared_value(state["norm"], 'patient_name'), prepared_value(state["norm"], 'dob'), excluded_id=state["patient_id"])
+    except Exception: return state # Unparseable Excel name/DOB: already reported by the patient check
+    if hint: state["reasons"].append(hint)
+    return state
+
+def compare_charge_row(state, tebra_charges, api_error_chg):
+    """Steps 5-6: matches the Excel row to a Tebra charge, compares every charge field and finalizes Status/Reason."""
+    row = state["row"]; norm = state["norm"]; current_result_data = state["result"]; mismatch_reasons = state["reasons"]; excel_claim_id = state["claim_id"]
+    if state["proceed"]:
+        if api_error_chg: mismatch_reasons.append(f"Charge Fetch Error: {api_error_chg}"); current_result_data["Status"] = "Error"
+        elif not tebra_charges: mismatch_reasons.append("No matching charge found in Tebra (None returned for name/DOS)"); current_result_data["Status"] = "Mismatch"
+        else:
+            matching_tebra_charge, find_charge_reason = find_matching_charge(row, tebra_charges, excel_norm=norm)
+            if not matching_tebra_charge: mismatch_reasons.append(find_charge_reason); current_result_data["Status"] = "Mismatch"
+            else:
+                if current_result_data["Status"] == "Pending": current_result_data["Status"] = "Match";
+                else: current_result_data["Status"] = "Mismatch"
+                # Excel-side values come pre-normalized from norm (see prepare_audit_frame); Tebra-side values are memoized
+                def check_field(excel_val, tebra_val, field_name, norm_key, tebra_normalizer, compare_func, identifier):
+                     if not compare_func(prepared_value(norm, norm_key), tebra_normalizer(tebra_val)): mismatch_reasons.append(format_mismatch_reason(field_name, excel_val, tebra_val, identifier=identifier)); current_result_data["Status"] = "Mismatch"
+                equals = lambda x, y: x == y
+                normalize_num_str = lambda y: memo_normalize_code(str(y))
+                check_field(row.get('claimID'), matching_tebra_charge.ID, "Claim ID", 'claim_code', normalize_num_str, equals, identifier=excel_claim_id)
+                check_field(row.get('EncounterID'), matching_tebra_charge.EncounterID, "Encounter ID", 'encounter_code', normalize_num_str, equals, identifier=excel_claim_id)
+                check_field(row.get('RenderingProvider'), matching_tebra_charge.RenderingProviderName, "Rendering Provider", 'rendering_provider', memo_normalize_name, compare_normalized_names, identifier=excel_claim_id)
+                excel_ref_provider = row.get('ReferringProvider'); tebra_ref_provider = matching_tebra_charge.ReferringProviderName
+                if excel_ref_provider and not pd.isna(excel_ref_provider): check_field(excel_ref_provider, tebra_ref_provider, "Referring Provider", 'referring_provider', memo_normalize_name, compare_normalized_names, identifier=excel_claim_id)
+                elif tebra_ref_provider: mismatch_reasons.append(format_mismatch_reason("Referring Provider", excel_ref_provider, tebra_ref_provider, identifier=excel_claim_id)); current_result_data["Status"] = "Mismatch"
+                check_field(row.get('ServiceLocationName'), matching_tebra_charge.ServiceLocationName, "Service Location", 'service_location', memo_normalize_string, equals, identifier=excel_claim_id)
+                if not compare_normalized_pos_codes(prepared_value(norm, 'pos'), memo_normalize_pos(str(matching_tebra_charge.ServiceLocationPlaceOfServiceCode))): mismatch_reasons.append(format_mismatch_reason("PlaceOfService Code", row.get('PlaceOfServiceCode'), matching_tebra_charge.ServiceLocationPlaceOfServiceCode, identifier=excel_claim_id)); current_result_data["Status"] = "Mismatch"
+                try:
+                     excel_units_str, excel_units = prepared_value(norm, 'units')
+                     tebra_units_str = str('0' if matching_tebra_charge.Units is None else matching_tebra_charge.Units).strip(); tebra_units = Decimal(tebra_units_str) if tebra_units_str else Decimal(0)
+                     if excel_units != tebra_units: mismatch_reasons.append(format_mismatch_reason("Service Units", excel_units_str, tebra_units_str, identifier=excel_claim_id)); current_result_data["Status"] = "Mismatch"
+                except (TypeError, ValueError, decimal.InvalidOperation) as unit_err: mismatch_reasons.append(f"Unit Comparison Error for Claim ID {excel_claim_id}: {unit_err}"); current_result_data["Status"] = "Mismatch"
+                check_field(row.get('PriIns_CompanyName'), matching_tebra_charge.PrimaryInsuranceCompanyName, "Primary Ins Company", 'primary_ins', memo_normalize_string, equals, identifier=excel_claim_id)
+                # Positional Modifier Check
+                for i in range(1, 5):
+                    excel_mod_raw = row.get(f'ProcedureModifier{i}'); tebra_mod_raw = getattr(matching_tebra_charge, f'ProcedureModifier{i}'); excel_mod_norm = prepared_value(norm, f'modifier{i}'); tebra_mod_norm = memo_normalize_code(tebra_mod_raw); is_excel_empty = not excel_mod_norm; is_tebra_empty = not tebra_mod_norm
+                    if is_excel_empty and is_tebra_empty: continue
+                    if is_excel_empty != is_tebra_empty or excel_mod_norm != tebra_mod_norm: mismatch_reasons.append(format_mismatch_reason(f"Modifier {i}", excel_mod_raw, tebra_mod_raw, identifier=excel_claim_id)); current_result_data["Status"] = "Mismatch"
+                # Positional ICD Check
+                for i in range(1, 5):
+                    excel_icd_raw = row.get(f'EncounterDiagnosisID{i}'); tebra_icd_raw = getattr(matching_tebra_charge, f'EncounterDiagnosisID{i}'); excel_icd_norm = prepared_value(norm, f'icd{i}'); tebra_icd_norm = memo_normalize_code(tebra_icd_raw); is_excel_empty = not excel_icd_norm; is_tebra_empty = not tebra_icd_norm
+                    if is_excel_empty and is_tebra_empty: continue
+                    if is_excel_empty != is_tebra_empty or excel_icd_norm != tebra_icd_norm: mismatch_reasons.append(format_mismatch_reason(f"ICD {i}", excel_icd_raw, tebra_icd_raw, identifier=excel_claim_id)); current_result_data["Status"] = "Mismatch"
+    return finalize_row_result(state)
+
+def finalize_row_result(state):
+    """Step 6: turns the collected mismatch reasons into the final Reason string."""
+    current_result_data = state["result"]; mismatch_reasons = state["reasons"]
+    if current_result_data["Status"] == "Match": current_result_data["Reason"] = "Verified"
+    elif mismatch_reasons: current_result_data["Reason"] = "; ".join(mismatch_reasons)
+    elif current_result_data["Status"] == "Error" and current_result_data["Reason"] == "Processing started": current_result_data["Reason"] = "Unknown processing error occurred." # Update default reason if needed
+    return current_result_data
+
+# --- Set-based matching (match_mode="join") ---
+# Same Status/Reason output as compare_charge_row, but the charges of all rows are flattened into one DataFrame,
+# joined to the Excel rows on (patient, DOS, CPT) and compared as column operations. Rows whose values don't fit
+# the column path (normalization errors, non-string names/codes, unparseable units) go through compare_charge_row.
+
+MATCH_MODES = ("join", "row")
+_STR_TYPES = {str, type(None)}
+_CODE_COLUMNS = [f'{kind}{i}' for kind in ('modifier', 'icd') for i in range(1, 5)]
+# Value types the column path handles; anything else sends the row through compare_charge_row
+_JOINED_EXCEL_TYPES = {'claim_id': {str}, 'cpt': _STR_TYPES, 'amount': {Decimal, type(None)}, 'claim_code': _STR_TYPES, 'encounter_code': _STR_TYPES, 'rendering_provider': _STR_TYPES, 'referring_provider': _STR_TYPES,
+                       'referring_present': {bool}, 'service_location': _STR_TYPES, 'pos': _STR_TYPES, 'units': {tuple}, 'primary_ins': _STR_TYPES, **{column: _STR_TYPES for column in _CODE_COLUMNS}}
+_JOINED_TEBRA_TYPES = {'claim_code': _STR_TYPES, 'encounter_code': _STR_TYPES, 'rendering_provider': _STR_TYPES, 'referring_provider': _STR_TYPES, 'service_location': _STR_TYPES, 'pos': _STR_TYPES,
+                       'units': {tuple}, 'primary_ins': _STR_TYPES, **{column: _STR_TYPES for column in _CODE_COLUMNS}}
+_JOINED_CANDIDATE_TYPES = {'cpt': _STR_TYPES, 'amount': {Decimal, type(None)}} # Checked on every charge of a key, as find_matching_charge normalizes them all
+
+def _value_codes(values, codes):
+    # Integer codes with Python == semantics (what find_matching_charge compares with); None never matches
+    return np.array([-1 if value is None else codes.setdefault(value, len(codes)) for value in values], dtype=np.int64)
+
+def _unexpected_type_mask(values, allowed_types):
+    """True where a value's type is not in allowed_types (NormalizationError, ints in string columns, ...); type-set check first since these are rare."""
+    if set(map(type, values)) <= allowed_types: return np.zeros(len(values), dtype=bool)
+    return np.fromiter((type(value) not in allowed_types for value in values), dtype=bool, count=len(values))
+
+def _is_empty(values):
+    values = pd.Series(values, dtype=object)
+    return (values.isna() | (values == '')).to_numpy(dtype=bool)
+
+def _pairwise_match(compare_func, excel_values, tebra_values, skip):
+    """
+    Applies a scalar compare_normalized_* function once per distinct (excel, tebra) pair; audit files repeat a small set of
+    providers/POS values. Rows flagged in skip (fallback or unmatched rows) are reported as matches without being compared.
+    """
+    outcomes = {}; matches = np.ones(len(excel_values), dtype=bool)
+    for i in np.flatnonzero(~skip):
+        pair = (excel_values[i], tebra_values[i]); outcome = outcomes.get(pair)
+        if outcome is None: outcome = outcomes[pair] = bool(compare_func(*pair))
+        matches[i] = outcome
+    return matches
+
+def _codes_match(excel_codes, tebra_codes):
+    # Positional modifier/ICD rule: both empty is a match, otherwise both present and equal
+    excel_empty = _is_empty(excel_codes); tebra_empty = _is_empty(tebra_codes)
+    return (excel_empty & tebra_empty) | (~excel_empty & ~tebra_empty & (np.asarray(excel_codes, dtype=object) == np.asarray(tebra_codes, dtype=object)))
+
+def _parse_tebra_units(value):
+    tebra_units_str = str('0' if value is None else value).strip(); return tebra_units_str, (Decimal(tebra_units_str) if tebra_units_str else Decimal(0))
+
+def _normalize_each(func, values):
+    """[func(value) ...] with exceptions captured as NormalizationError, so one odd charge only affects the rows that match it."""
+    normalized = []
+    for value in values:
+        try: normalized.append(func(value))
+        except Exception as e: normalized.append(NormalizationError(e))
+    return normalized
+
+def flatten_charges(charge_lists):
+    """
+    One row per fetched charge, for charge_lists = [charges of key 0, charges of key 1, ...]: the key code, the position
+    in its list (the row loop's tie-break order), the TebraCharge record and the memoized normalized values compared per field.
+    """
+    records = [(key_code, position, charge) for key_code, charges in enumerate(charge_lists) for position, charge in enumerate(charges)]
+    charges = pd.DataFrame(records, columns=['key', 'position', 'charge']) if records else pd.DataFrame({'key': pd.Series(dtype=np.int64), 'position': pd.Series(dtype=np.int64), 'charge': pd.Series(dtype=object)})
+    charge_objects = charges['charge'].tolist(); raw = lambda attribute: [getattr(charge, attribute) for charge in charge_objects]
+    normalize_num_str = lambda value: memo_normalize_code(str(value)); normalize_pos_str = lambda value: memo_normalize_pos(str(value))
+    normalized = {
+        'cpt': _normalize_each(memo_normalize_code, raw('ProcedureCode')),
+        'amount': _normalize_each(memo_round_amount, raw('TotalCharges')),
+        'claim_code': _normalize_each(normalize_num_str, raw('ID')),
+        'encounter_code': _normalize_each(normalize_num_str, raw('EncounterID')),
+        'rendering_provider': _normalize_each(memo_normalize_name, raw('RenderingProviderName')),
+        'referring_raw': raw('ReferringProviderName'),
+        'service_location': _normalize_each(memo_normalize_string, raw('ServiceLocationName')),
+        'pos': _normalize_each(normalize_pos_str, raw('ServiceLocationPlaceOfServiceCode')),
+        'units': _normalize_each(_parse_tebra_units, raw('Units')),
+        'primary_ins': _normalize_each(memo_normalize_string, raw('PrimaryInsuranceCompanyName')),
+    }
+    normalized['referring_provider'] = _normalize_each(memo_normalize_name, normalized['referring_raw'])
+    for i in range(1, 5):
+        normalized[f'modifier{i}'] = _normalize_each(memo_normalize_code, raw(f'ProcedureModifier{i}'))
+        normalized[f'icd{i}'] = _normalize_each(memo_normalize_code, raw(f'EncounterDiagnosisID{i}'))
+    for column, values in normalized.items(): charges[column] = pd.Series(values, index=charges.index, dtype=object)
+    return charges
+
+def compare_charges_joined(states, prepared, tebra_charges_cache):
+    """
+    Set-based equivalent of compare_charge_row over many rows. states and prepared (prepare_audit_frame output) are
+    aligned by position; charges for every proceeding row must already be in tebra_charges_cache.
+    Returns the finalized result dicts in the order of states.
+    """
+    results = [None] * len(states); joinable = []
+    for position, state in enumerate(states):
+        if not state["proceed"]: results[position] = finalize_row_result(state); continue
+        tebra_charges, api_error_chg = tebra_charges_cache[(state["patient_name"], state["dos_str"])]
+        if api_error_chg or not tebra_charges: results[position] = compare_charge_row(state, tebra_charges, api_error_chg)
+        else: joinable.append(position)
+    if not joinable: return results
+
+    excel = prepared.iloc[joinable].reset_index(drop=True); excel_cols = {column: excel[column].to_numpy(dtype=object) for column in excel.columns}
+    fallback = np.zeros(len(joinable), dtype=bool)
+    for column, allowed_types in _JOINED_EXCEL_TYPES.items(): fallback |= _unexpected_type_mask(excel_cols[column], allowed_types)
+
+    key_codes = {}
+    excel_keys = np.array([key_codes.setdefault((states[position]["patient_name"], states[position]["dos_str"]), len(key_codes)) for position in joinable], dtype=np.int64)
+    charges = flatten_charges([tebra_charges_cache[key][0] for key in key_codes])
+    for column, allowed_types in _JOINED_CANDIDATE_TYPES.items(): fallback |= np.isin(excel_keys, charges['key'].to_numpy(dtype=np.int64)[_unexpected_type_mask(charges[column].to_numpy(dtype=object), allowed_types)])
+    cpt_codes = {}; amount_codes = {}
+    excel_side = pd.DataFrame({'row': np.arange(len(joinable)), 'key': excel_keys, 'cpt_code': _value_codes(excel['cpt'], cpt_codes), 'amount_code': _value_codes(excel['amount'], amount_codes)})
+    tebra_side = pd.DataFrame({'key': charges['key'].to_numpy(dtype=np.int64), 'position': charges['position'].to_numpy(dtype=np.int64), 'charge_index': np.arange(len(charges)), 'cpt_code': _value_codes(charges['cpt'], cpt_codes), 'tebra_amount_code': _value_codes(charges['amount'], amount_codes)})
+    # CPT None == None matches in the row loop, so give None CPTs a shared code instead of -1
+    excel_side.loc[excel_side['cpt_code'] < 0, 'cpt_code'] = -2; tebra_side.loc[tebra_side['cpt_code'] < 0, 'cpt_code'] = -2
+
+    # Duplicates resolve exactly like the row loop: the earliest charge in the key's list wins
+    candidates = excel_side.merge(tebra_side, on=['key', 'cpt_code'], how='inner').sort_values(['row', 'position'], kind='stable')
+    first_candidate = candidates.drop_duplicates('row').set_index('row')['charge_index']
+    amount_hits = candidates[(candidates['amount_code'] >= 0) & (candidates['amount_code'] == candidates['tebra_amount_code'])].drop_duplicates('row').set_index('row')['charge_index']
+    matched_charge = np.full(len(joinable), -1, dtype=np.int64); matched_charge[amount_hits.index.to_numpy()] = amount_hits.to_numpy()
+    first_charge = np.full(len(joinable), -1, dtype=np.int64); first_charge[first_candidate.index.to_numpy()] = first_candidate.to_numpy()
+
+    matched = matched_charge >= 0
+    tebra = charges.iloc[np.where(matched, matched_charge, 0)].reset_index(drop=True) if len(charges) else charges
+    tebra_cols = {column: tebra[column].to_numpy(dtype=object) for column in tebra.columns}; charge_amounts = charges['amount'].to_numpy(dtype=object)
+    if len(charges):
+        for column, allowed_types in _JOINED_TEBRA_TYPES.items(): fallback |= matched & _unexpected_type_mask(tebra[column].to_numpy(dtype=object), allowed_types)
+
+    # Field checks as column operations over the matched rows; each yields a mismatch mask in the row loop's check order
+    checks = []
+    if matched.any():
+        excel_ref_present = excel_cols['referring_present'].astype(bool); skip = fallback | ~matched
+        tebra_ref_present = np.fromiter((bool(value) for value in tebra['referring_raw']), dtype=bool, count=len(tebra))
+        excel_units = [value[1] if isinstance(value, tuple) else None for value in excel_cols['units']]; tebra_units = [value[1] if isinstance(value, tuple) else None for value in tebra_cols['units']]
+        checks = [
+            ("Claim ID", ~(excel['claim_code'].to_numpy(dtype=object) == tebra['claim_code'].to_numpy(dtype=object)), 'claimID', 'ID'),
+            ("Encounter ID", ~(excel['encounter_code'].to_numpy(dtype=object) == tebra['encounter_code'].to_numpy(dtype=object)), 'EncounterID', 'EncounterID'),
+            ("Rendering Provider", ~_pairwise_match(compare_normalized_names, excel_cols['rendering_provider'], tebra_cols['rendering_provider'], skip), 'RenderingProvider', 'RenderingProviderName'),
+            ("Referring Provider", np.where(excel_ref_present, ~_pairwise_match(compare_normalized_names, excel_cols['referring_provider'], tebra_cols['referring_provider'], skip), tebra_ref_present), 'ReferringProvider', 'ReferringProviderName'),
+            ("Service Location", ~(excel['service_location'].to_numpy(dtype=object) == tebra['service_location'].to_numpy(dtype=object)), 'ServiceLocationName', 'ServiceLocationName'),
+            ("PlaceOfService Code", ~_pairwise_match(compare_normalized_pos_codes, excel_cols['pos'], tebra_cols['pos'], skip), 'PlaceOfServiceCode', 'ServiceLocationPlaceOfServiceCode'),
+            ("Service Units", np.asarray(excel_units, dtype=object) != np.asarray(tebra_units, dtype=object), None, None),
+            ("Primary Ins Company", ~(excel['primary_ins'].to_numpy(dtype=object) == tebra['primary_ins'].to_numpy(dtype=object)), 'PriIns_CompanyName', 'PrimaryInsuranceCompanyName'),
+        ]
+        checks += [(f"Modifier {i}", ~_codes_match(excel[f'modifier{i}'], tebra[f'modifier{i}']), f'ProcedureModifier{i}', f'ProcedureModifier{i}') for i in range(1, 5)]
+        checks += [(f"ICD {i}", ~_codes_match(excel[f'icd{i}'], tebra[f'icd{i}']), f'EncounterDiagnosisID{i}', f'EncounterDiagnosisID{i}') for i in range(1, 5)]
+
+    reasons_by_row = [[] for _ in joinable]
+    for field_name, mismatch_mask, excel_column, tebra_path in checks:
+        for j in np.flatnonzero(mismatch_mask & matched & ~fallback):
+            state = states[joinable[j]]; tebra_charge = tebra_cols['charge'][j]
+            if excel_column is None: excel_val = excel_cols['units'][j][0]; tebra_val = tebra_cols['units'][j][0] # Units report the stripped strings
+            else: excel_val = state["row"].get(excel_column); tebra_val = getattr(tebra_charge, tebra_path)
+            reasons_by_row[j].append(format_mismatch_reason(field_name, excel_val, tebra_val, identifier=state["claim_id"]))
+
+    for j, position in enumerate(joinable):
+        state = states[position]
+        if fallback[j]: results[position] = compare_charge_row(state, *tebra_charges_cache[(state["patient_name"], state["dos_str"])]); continue
+        current_result_data = state["result"]; mismatch_reasons = state["reasons"]; excel_claim_id = excel_cols['claim_id'][j]
+        if not matched[j]:
+            if first_charge[j] < 0: mismatch_reasons.append(f"CPT Mismatch (Excel CPT: {excel_cols['cpt'][j]} not found in Tebra charges for Claim ID {excel_claim_id})")
+            else: mismatch_reasons.append(f"Amount Mismatch (Excel: {excel_cols['amount'][j]}, Tebra: {charge_amounts[first_charge[j]]} for Claim ID {excel_claim_id})")
+            current_result_data["Status"] = "Mismatch"
+        else:
+            current_result_data["Status"] = "Match" if current_result_data["Status"] == "Pending" else "Mismatch"
+            if reasons_by_row[j]: mismatch_reasons.extend(reasons_by_row[j]); current_result_data["Status"] = "Mismatch"
+        results[position] = finalize_row_result(state)
+    return results
+
+class ProgressThrottle:
+    """Wraps a progress_callback(phase, done, total) so it fires at most every min_interval seconds, plus on phase changes and completion."""
+    def __init__(self, callback, min_interval=0.25):
+        self.callback = callback; self.min_interval = min_interval; self._last_phase = None; self._last_sent = 0.0
+    def __call__(self, phase, done, total):
+        now = time.monotonic()
+        if phase != self._last_phase or done >= total or now - self._last_sent >= self.min_interval:
+            self._last_phase = phase; self._last_sent = now; self.callback(phase, done, total)
+
+class AuditRun:
+    """
+    One audit of a DataFrame against Tebra. iter_results() streams one result dict per Excel row, in file order:
+    patients are prefetched concurrently, patient data is checked per row, charges are fetched in batches and
+    each row is then compared and yielded (row by row, or all at once with match_mode="join"). progress_callback(phase, done, total) reports each phase (see PROGRESS_PHASE_LABELS).
+    Phase timings, SOAP calls and cache lookups are recorded in self.metrics (a RunMetrics; pass one in to also time file reading/export).
+    Every SOAP call goes through self.request_controller: prefetch_workers is the starting concurrency, which adapts up to MAX_PREFETCH_WORKERS
+    with adaptive_concurrency (otherwise it stays fixed); transient failures are retried up to max_retries times.
+    With a patient_directory (tebra_patient_directory.PatientDirectory) patients are read from it and only the IDs it lacks
+    are fetched with GetPatient; rows whose patient check fails name the Tebra patients with the row's name and DOB.
+    """
+    def __init__(self, client, header, prefetch_workers=DEFAULT_PREFETCH_WORKERS, charge_fetch_mode="auto", match_mode="join", response_cache=None, progress_callback=None, metrics=None,
+                 adaptive_concurrency=True, max_retries=DEFAULT_MAX_RETRIES, patient_directory=None):
+        if match_mode not in MATCH_MODES: raise ValueError(f"Unknown match mode '{match_mode}'.")
+        self.client = client; self.header = header; self.prefetch_workers = prefetch_workers; self.charge_fetch_mode = charge_fetch_mode; self.match_mode = match_mode
+        self.response_cache = response_cache; self.progress_callback = progress_callback; self.metrics = metrics if metrics is not None else RunMetrics()
+        self.request_controller = RequestController(prefetch_workers, max_limit=MAX_PREFETCH_WORKERS, adaptive=adaptive_concurrency, max_retries=max_retries, metrics=self.metrics) # Shared by every phase and checkpoint chunk
+        self.patient_directory = patient_directory; self.tebra_patient_cache = {}; self.tebra_charges_cache = {}
+        self.charge_requests_sent = 0; self.rows_processed = 0; self.start_time = None; self.end_time = None
+
+    def report_progress(self, phase, done, total):
+        """Passes (phase, done, total) to the progress callback; also used by callers that run phases around the audit (checkpoints, patient directory)."""
+        if self.progress_callback and total: self.progress_callback(phase, done, total)
+
+    def _get_patient(self, patient_id):
+        # 2. Get Patient (normally prefetched; fetched here only if the prefetch skipped it)
+        tebra_patient, api_error_pat = self.tebra_patient_cache.get(patient_id, (None, None))
+        self.metrics.count_cache("run_cache:patients", tebra_patient is not None or api_error_pat is not None)
+        if tebra_patient is None and api_error_pat is None: tebra_patient, api_error_pat = get_tebra_patient_cached(self.client, self.header, patient_id, self.response_cache, self.metrics, self.request_controller); self.tebra_patient_cache[patient_id] = (tebra_patient, api_error_pat)
+        return tebra_patient, api_error_pat
+
+    def _get_charges(self, state):
+        # 4. Get Charges (from the batched index; single-day request only for keys the batch could not resolve)
+        cache_key_chg = (state["patient_name"], state["dos_str"]); cached = cache_key_chg in self.tebra_charges_cache
+        self.metrics.count_cache("run_cache:charges", cached)
+        if not cached:
+            with self.metrics.phase("charges"): self.tebra_charges_cache[cache_key_chg] = get_tebra_charges_soap(self.client, self.header, state["patient_name"], state["dos_dt"], response_cache=self.response_cache, metrics=self.metrics, request_controller=self.request_controller)
+            self.metrics.increment("charge_fallback_requests")
+        return self.tebra_charges_cache[cache_key_chg]
+
+    def iter_results(self, df):
+        # Calling this again (e.g. per checkpoint chunk) reuses the patient/charge caches; timings and counts accumulate
+        self.start_time = self.start_time or time.time(); total_rows = len(df); metrics = self.metrics
+        metrics.increment("rows", total_rows)
+
+        unique_patient_ids = [pid for pid in df['PatientID'].astype(str).str.strip().unique() if pid]
+        metrics.increment("unique_patient_ids", len(unique_patient_ids))
+        if self.patient_directory is not None: metrics.increment("directory_patients_used", self.patient_directory.seed(self.tebra_patient_cache, unique_patient_ids, metrics))
+        with metrics.phase("patients"): prefetch_tebra_patients(self.client, self.header, unique_patient_ids, self.tebra_patient_cache, max_workers=self.prefetch_workers, progress_callback=lambda done, total: self.report_progress("patients", done, total), response_cache=self.response_cache, metrics=metrics, request_controller=self.request_controller)
+
+        # Normalize the Excel side once for the whole file; the row steps below only read these values
+        with metrics.phase("prepare"): prepared = prepare_audit_frame(df); norm_records = prepared_records(prepared)
+        row_states = []; excel_values = ExcelRowValues(df)
+        with metrics.phase("patient_checks"):
+            for position, index in enumerate(df.index, start=1):
+                state = extract_row_state(index, excel_values.row(position - 1), norm_records[position - 1]); norm_records[position - 1] = None
+                if not state["extract_failed"]:
+                    check_patient_row(state, *self._get_patient(state["patient_id"]))
+                    if self.patient_directory is not None and not state["proceed"]: add_directory_hint(state, self.patient_directory)
+                row_states.append(state); self.report_progress("patient_checks", position, total_rows)
+
+        # Batch GetCharges per patient DOS span (or practice-wide window) and split results by (patient name, DOS)
+        charge_keys = [(state["patient_name"], state["dos_str"]) for state in row_states if state["proceed"]]
+        patient_names_by_id = {pid: get_tebra_patient_filter_name(patient) for pid, (patient, _) in self.tebra_patient_cache.items() if patient is not None}
+        with metrics.phase("charges"): batch_requests = fetch_tebra_charges_batched(self.client, self.header, charge_keys, self.tebra_charges_cache, mode=self.charge_fetch_mode, patient_names_by_id=patient_names_by_id, max_workers=self.prefetch_workers, progress_callback=lambda done, total: self.report_progress("charges", done, total), response_cache=self.response_cache, metrics=metrics, request_controller=self.request_controller)
+        self.charge_requests_sent += batch_requests; metrics.increment("charge_batch_requests", batch_requests)
+
+        if self.match_mode == "join":
+            for state in row_states:
+                if state["proceed"]: self._get_charges(state)
+            with metrics.phase("comparisons"): joined_results = compare_charges_joined(row_states, prepared, self.tebra_charges_cache); row_states = None
+            for position, result in enumerate(joined_results):
+                joined_results[position] = None; self.rows_processed += 1; self.report_progress("comparisons", position + 1, total_rows)
+                yield result
+            self.end_time = time.time(); return
+
+        comparison_seconds = 0.0 # Summed per row so time spent by the consumer between yields is not counted
+        for position in range(total_rows):
+            state = row_states[position]; row_states[position] = None # Release each row once it has been yielded
+            tebra_charges, api_error_chg = self._get_charges(state) if state["proceed"] else ([], None)
+            compare_start = time.perf_counter(); result = compare_charge_row(state, tebra_charges, api_error_chg); comparison_seconds += time.perf_counter() - compare_start
+            self.rows_processed += 1; self.report_progress("comparisons", position + 1, total_rows)
+            yield result
+        metrics.add_phase_time("comparisons", comparison_seconds)
+        self.end_time = time.time()
+
+    def run(self, df): return list(self.iter_results(df))
+
+    @property
+    def elapsed_seconds(self): return ((self.end_time or time.time()) - self.start_time) if self.start_time else 0.0
+
+def build_output_frame(df, audit_results_list):
+    """Adds the 'Audit Results' and 'Reason for Invalid' columns to a shallow copy of the input DataFrame (results are in row order)."""
+    df_output = df.copy(deep=False) # New columns only; the input columns are shared, not copied
+    df_output['Audit Results'] = [STATUS_MAP.get(result['Status'], "Invalid") for result in audit_results_list]
+    df_output['Reason for Invalid'] = [result['Reason'] if result['Status'] != "Match" else "" for result in audit_results_list]
+    return df_output
+
+def summarize_output(df_output):
+    summary_df = df_output["Audit Results"].value_counts().reset_index(); summary_df.columns = ['Audit Results', 'Count']
+    return summary_df
+
+def _excel_output_value(value):
+    # xlsxwriter cannot store NaN/NaT; pandas' to_excel leaves those cells empty too
+    if value is None or value is pd.NaT or (isinstance(value, float) and value != value): return None
+    return value
+
+def write_results_workbook(df_output, target, metrics=None):
+    """
+    Streams the results into an .xlsx file (path or binary file object) with xlsxwriter's constant_memory mode, one
+    row at a time. With metrics (a RunMetrics), the results sheet is timed as the "export" phase and a 'Performance' sheet is added.
+    """
+    workbook = xlsxwriter.Workbook(target, {'constant_memory': True, 'strings_to_formulas': False, 'strings_to_urls': False, 'default_date_format': 'yyyy-mm-dd hh:mm:ss', 'remove_timezone': True})
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}) # pandas' to_excel header style
+    def write_sheet(sheet_name, frame):
+        worksheet = workbook.add_worksheet(sheet_name); worksheet.write_row(0, 0, [str(column) for column in frame.columns], header_format)
+        for row_number, values in enumerate(frame.itertuples(index=False, name=None), start=1): worksheet.write_row(row_number, 0, [_excel_output_value(value) for value in values])
+    with metrics.phase("export") if metrics is not None else contextlib.nullcontext(): write_sheet('Audit Results', df_output)
+    if metrics is not None: write_sheet('Performance', metrics.to_frame())
+    workbook.close()
+
+def results_to_excel_bytes(df_output, metrics=None):
+    output = io.BytesIO(); write_results_workbook(df_output, output, metrics=metrics)
+    return output.getvalue()
+
+def write_results_file(df_output, path, metrics=None):
+    """Writes the results to .csv or .xlsx depending on the file extension (the 'Performance' sheet only goes into .xlsx)."""
+    if str(path).lower().endswith('.csv'):
+        with metrics.phase("export") if metrics is not None else contextlib.nullcontext(): df_output.to_csv(path, index=False)
+    else: write_results_workbook(df_output, path, metrics=metrics)
+# --- End of Part 7 ---
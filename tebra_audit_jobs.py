@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Background audit jobs. An audit is submitted to an AuditJobRunner, which runs it on one of its worker threads
+(outside the Streamlit script run) and records status, progress and the finished summary in a local SQLite job
+store; the results workbook is written next to it. Jobs are looked up by their (random) id only: the app lists the jobs its session submitted.
+"""
+
+import io
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import sqlite3
+import zipfile
+import threading
+import collections
+
+import numpy as np
+
+from tebra_audit_engine import (AuditRun, ProgressThrottle, DEFAULT_PREFETCH_WORKERS, DEFAULT_WSDL_URL, DEFAULT_WSDL_PATH, DEFAULT_WSDL_CACHE_DIR, create_api_client, build_request_header, read_audit_file, missing_required_columns,
+                                build_output_frame, summarize_output, write_results_file)
+from tebra_response_cache import ResponseCache, DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, DEFAULT_MAX_SIZE_MB
+from tebra_audit_metrics import RunMetrics
+from tebra_request_control import DEFAULT_MAX_RETRIES
+from tebra_patient_directory import PatientDirectoryStore, PatientDirectoryError, load_patient_directory, DEFAULT_DIRECTORY_PATH, DIRECTORY_MAX_AGE_HOURS
+from tebra_audit_checkpoint import CheckpointStore, CheckpointedAudit, DEFAULT_CHECKPOINT_PATH, DEFAULT_CHECKPOINT_ROWS, DEFAULT_REUSE_MAX_AGE_HOURS, practice_key_hash
+
+DEFAULT_JOB_STORE_PATH = os.environ.get("TEBRA_AUDIT_JOB_STORE_PATH", os.path.join(".tebra_cache", "jobs.sqlite3"))
+DEFAULT_JOB_RESULTS_DIR = os.environ.get("TEBRA_AUDIT_JOB_RESULTS_DIR", os.path.join(".tebra_cache", "job_results"))
+DEFAULT_MAX_CONCURRENT_JOBS = int(os.environ.get("TEBRA_AUDIT_MAX_JOBS", "2")) # Audits running at once on this server; each also runs its own Tebra request pool
+DEFAULT_MAX_JOBS_PER_PRACTICE = int(os.environ.get("TEBRA_AUDIT_MAX_JOBS_PER_PRACTICE", "1")) # Further jobs of a busy practice wait, so one practice cannot hold every slot
+JOB_RETENTION_HOURS = 24 # Finished jobs and their result files are purged after this
+CLIENT_TTL_SECONDS = 3600 # Same lifetime as the app's cached client
+JOB_PROGRESS_INTERVAL = 0.5 # Minimum seconds between two progress writes of one job
+ACTIVE_JOB_STATUSES = ("queued", "running")
+JOB_STATUS_LABELS = {"queued": "Queued", "running": "Running", "done": "Finished", "failed": "Failed", "cancelled": "Cancelled"}
+INVALID_DISPLAY_COLUMNS = ['Excel Row', 'Audit Results', 'PatientID', 'DateOfService', 'ProcedureCode', 'Reason for Invalid']
+DEFAULT_AUDIT_SETTINGS = {"prefetch_workers": DEFAULT_PREFETCH_WORKERS, "charge_fetch_mode": "auto", "match_mode": "join", "wsdl_url": DEFAULT_WSDL_URL, "wsdl_path": DEFAULT_WSDL_PATH, "wsdl_cache_dir": DEFAULT_WSDL_CACHE_DIR, "adaptive_concurrency": True, "max_retries": DEFAULT_MAX_RETRIES,
+                          "use_response_cache": False, "refresh_response_cache": False, "cache_path": DEFAULT_CACHE_PATH, "cache_ttl_hours": DEFAULT_TTL_HOURS, "cache_max_size_mb": DEFAULT_MAX_SIZE_MB,
+                          "resume_runs": True, "incremental_audit": False, "checkpoint_path": DEFAULT_CHECKPOINT_PATH, "checkpoint_rows": DEFAULT_CHECKPOINT_ROWS, "reuse_max_age_hours": DEFAULT_REUSE_MAX_AGE_HOURS,
+                          "patient_directory": False, "persist_directory": True, "refresh_directory": False, "directory_path": DEFAULT_DIRECTORY_PATH, "directory_max_age_hours": DIRECTORY_MAX_AGE_HOURS}
+
+class AuditJobError(Exception):
+    """An audit that cannot run (unreadable file, missing columns, no Tebra connection); the message is shown to the user."""
+
+class AuditJobCancelled(Exception):
+    """Raised from the progress callback of a job whose cancellation was requested."""
+
+def _process_alive(pid):
+    """Whether a process with this pid runs on this host (a reused pid reads as alive, which only delays marking its jobs failed)."""
+    if pid == os.getpid(): return True
+    if os.name == "nt": # os.kill(pid, 0) would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32; handle = kernel32.OpenProcess(0x1000, False, int(pid)) # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle: return False
+        exit_code = ctypes.c_ulong(); kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)); kernel32.CloseHandle(handle)
+        return exit_code.value == 259 # STILL_ACTIVE
+    try: os.kill(pid, 0)
+    except PermissionError: return True
+    except OSError: return False
+    return True
+
+def _json_default(value): return value.item() if isinstance(value, np.generic) else str(value) # numpy scalars to Python numbers, dates and the rest to text
+
+def invalid_rows_frame(df_output):
+    """The 'Invalid Records Summary' table: invalid rows with their Excel row number and the columns needed to find them."""
+    invalid_df = df_output[df_output["Audit Results"] == "Invalid"].copy()
+    if 'Original Excel Row Index' in invalid_df.columns: invalid_df.insert(0, 'Excel Row', invalid_df['Original Excel Row Index'] + 2)
+    else: invalid_df.insert(0, 'Excel Row', invalid_df.index + 2)
+    return invalid_df[[col for col in INVALID_DISPLAY_COLUMNS if col in invalid_df.columns]]
+
+def execute_audit(source, file_name, credentials, settings=None, output_path=None, client=None, header=None, progress_callback=None):
+    """
+    Runs one complete audit of an audit file (bytes, path or file object): connects (unless a client and header are given), reads
+    and checks the file, audits it with the response cache and checkpoints from settings (see DEFAULT_AUDIT_SETTINGS)
+    and writes the results workbook to output_path. Returns a JSON-serializable summary of the run.
+    Raises AuditJobError with a user-facing message when the audit cannot run.
+    """
+    settings = {**DEFAULT_AUDIT_SETTINGS, **(settings or {})}; run_metrics = RunMetrics(); warnings = []
+    if client is None:
+        try: client = create_api_client(settings["wsdl_url"], wsdl_path=settings["wsdl_path"] or None, cache_dir=settings["wsdl_cache_dir"])
+        except Exception as e: raise AuditJobError(f"Failed to connect to Tebra API: {e}") from e
+    if header is None:
+        try: header = build_request_header(credentials, client)
+        except Exception as e: raise AuditJobError(f"Error building request header: {e}") from e
+
+    try:
+        with run_metrics.phase("read_file"): df = read_audit_file(io.BytesIO(source) if isinstance(source, bytes) else source, file_name)
+    except Exception as e: raise AuditJobError(f"Error reading Excel file: {e}") from e
+    missing_cols = missing_required_columns(df)
+    if missing_cols: raise AuditJobError(f"Required columns are missing: {', '.join(missing_cols)}. Check file headers.")
+
+    response_cache = None
+    if settings["use_response_cache"]:
+        try: response_cache = ResponseCache(settings["cache_path"], ttl_hours=settings["cache_ttl_hours"], max_size_mb=settings["cache_max_size_mb"], refresh=settings["refresh_response_cache"])
+        except (sqlite3.Error, OSError) as e: warnings.append(f"Response cache unavailable, continued without it: {e}")
+    audit_run = AuditRun(client, header, prefetch_workers=settings["prefetch_workers"], charge_fetch_mode=settings["charge_fetch_mode"], match_mode=settings["match_mode"], response_cache=response_cache, progress_callback=progress_callback, metrics=run_metrics,
+                         adaptive_concurrency=settings["adaptive_concurrency"], max_retries=settings["max_retries"])
+    directory_info = None
+    if settings["patient_directory"]:
+        directory_store = None
+        try:
+            if settings["persist_directory"]: directory_store = PatientDirectoryStore(settings["directory_path"])
+        except (sqlite3.Error, OSError) as e: warnings.append(f"Stored patient directory unavailable, fetched it without storing: {e}")
+        try:
+            with run_metrics.phase("directory"):
+                audit_run.patient_directory, directory_info = load_patient_directory(client, header, credentials["CustomerKey"], store=directory_store, max_age_hours=settings["directory_max_age_hours"], refresh=settings["refresh_directory"],
+                                                                                     progress_callback=lambda done, total: audit_run.report_progress("directory", done, total), metrics=run_metrics, request_controller=audit_run.request_controller)
+            warnings.extend(f"Patient directory may be incomplete (missing patients are fetched with GetPatient): {error}" for error in directory_info["errors"])
+        except (PatientDirectoryError, sqlite3.Error, OSError) as e: warnings.append(f"Patient directory unavailable, continued with GetPatient: {e}")
+        finally:
+            if directory_store: directory_store.close()
+    checkpoint_store = checkpointed_audit = None; cache_stats = None
+    if settings["resume_runs"] or settings["incremental_audit"]:
+        try: checkpoint_store = CheckpointStore(settings["checkpoint_path"]); checkpointed_audit = CheckpointedAudit(audit_run, checkpoint_store, credentials["CustomerKey"], resume=settings["resume_runs"], incremental=settings["incremental_audit"], checkpoint_rows=settings["checkpoint_rows"], reuse_max_age_hours=settings["reuse_max_age_hours"])
+        except (sqlite3.Error, OSError) as e: warnings.append(f"Checkpoints unavailable, continued without them: {e}")
+    try: audit_results_list = checkpointed_audit.run(df) if checkpointed_audit else audit_run.run(df)
+    finally:
+        if response_cache: response_cache.evict_to_size(); cache_stats = response_cache.stats(); response_cache.close()
+        if checkpoint_store: checkpoint_store.close()
+
+    df_output = build_output_frame(df, audit_results_list)
+    if output_path: write_results_file(df_output, output_path, metrics=run_metrics)
+    summary = {"file_name": file_name, "rows": len(df_output), "elapsed_seconds": audit_run.elapsed_seconds, "patients": len(audit_run.tebra_patient_cache), "charge_requests": audit_run.charge_requests_sent,
+               "client_info": dict(getattr(client, "tebra_wsdl_info", None) or {}), "cache_stats": cache_stats, "warnings": warnings,
+               "request_control": audit_run.request_controller.stats(), "directory": directory_info,
+               "checkpoint": {"resumed_rows": checkpointed_audit.resumed_rows, "reused_rows": checkpointed_audit.reused_rows, "audited_rows": checkpointed_audit.audited_rows} if checkpointed_audit else None,
+               "statuses": summarize_output(df_output).to_dict(orient="records"), "invalid_rows": invalid_rows_frame(df_output).to_dict(orient="records"), "metrics": run_metrics.to_dict()}
+    return json.loads(json.dumps(summary, default=_json_default))
+
+class JobStore:
+    """
+    SQLite table of audit jobs: status, progress, message and, once finished, the result path and summary, plus the
+    host and pid of the server process running each job. Safe to share between threads and server processes.
+    """
+    def __init__(self, path=DEFAULT_JOB_STORE_PATH):
+        self.path = path; self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, practice_hash TEXT NOT NULL, practice_name TEXT, file_name TEXT, status TEXT NOT NULL, phase TEXT, done INTEGER NOT NULL DEFAULT 0, total INTEGER NOT NULL DEFAULT 0, message TEXT, result_path TEXT, summary_json TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_practice ON jobs (practice_hash, created_at)")
+        job_columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in (("owner_host", "TEXT"), ("owner_pid", "INTEGER")): # Stores created before jobs recorded their owner
+            if column not in job_columns: self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self._conn.commit()
+
+    def _execute(self, query, params=()):
+        with self._lock: self._conn.execute(query, params); self._conn.commit()
+
+    def create_job(self, job_id, practice_hash, practice_name, file_name):
+        self._execute("INSERT INTO jobs (job_id, practice_hash, practice_name, file_name, status, created_at, owner_host, owner_pid) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)", (job_id, practice_hash, practice_name, file_name, time.time(), socket.gethostname(), os.getpid()))
+
+    def mark_running(self, job_id): self._execute("UPDATE jobs SET status = 'running', started_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+    def update_progress(self, job_id, phase, done, total): self._execute("UPDATE jobs SET phase = ?, done = ?, total = ? WHERE job_id = ?", (phase, int(done), int(total), job_id))
+
+    def finish_job(self, job_id, status, message=None, result_path=None, summary=None):
+        self._execute("UPDATE jobs SET status = ?, message = ?, result_path = ?, summary_json = ?, finished_at = ? WHERE job_id = ?", (status, message, result_path, json.dumps(summary, default=_json_default) if summary is not None else None, time.time(), job_id))
+
+    @staticmethod
+    def _to_job(row):
+        job = dict(row); summary_json = job.pop("summary_json")
+        job["summary"] = json.loads(summary_json) if summary_json else None
+        return job
+
+    def get_job(self, job_id):
+        with self._lock: row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def list_jobs(self, job_ids=(), limit=50):
+        """Jobs with one of job_ids, newest first. Listing is by job id only (never by practice), so a session only sees the jobs it submitted."""
+        job_ids = list(job_ids)[-500:]
+        if not job_ids: return []
+        with self._lock: rows = self._conn.execute(f"SELECT * FROM jobs WHERE job_id IN ({','.join('?' * len(job_ids))}) ORDER BY created_at DESC LIMIT ?", (*job_ids, limit)).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def status_counts(self):
+        with self._lock: return dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def mark_interrupted(self):
+        """
+        Fails the queued or running jobs whose server process has exited: processes on this host that are no longer
+        running, and jobs recorded without an owner. Jobs of live processes and of other hosts are left alone. Returns how many.
+        """
+        host = socket.gethostname()
+        with self._lock:
+            rows = self._conn.execute("SELECT job_id, owner_host, owner_pid FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+            orphaned = [(time.time(), row["job_id"]) for row in rows if row["owner_host"] is None or row["owner_pid"] is None or (row["owner_host"] == host and not _process_alive(row["owner_pid"]))]
+            self._conn.executemany("UPDATE jobs SET status = 'failed', message = 'Interrupted by a server restart. Run the file again to continue from its last checkpoint.', finished_at = ? WHERE job_id = ?", orphaned)
+            self._conn.commit()
+        return len(orphaned)
+
+    def purge_finished(self, max_age_hours=JOB_RETENTION_HOURS):
+        """Deletes finished jobs older than max_age_hours and returns their result paths."""
+        cutoff = time.time() - float(max_age_hours) * 3600
+        with self._lock:
+            rows = self._conn.execute("SELECT job_id, result_path FROM jobs WHERE status NOT IN ('queued', 'running') AND COALESCE(finished_at, created_at) < ?", (cutoff,)).fetchall()
+            self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(row["job_id"],) for row in rows]); self._conn.commit()
+        return [row["result_path"] for row in rows if row["result_path"]]
+
+    def close(self):
+        with self._lock: self._conn.close()
+
+class AuditJobRunner:
+    """
+    Runs submitted audits (and batch audits, see submit_batch) on max_concurrent_jobs worker threads, at most max_jobs_per_practice at a time for one
+    customer key; the other jobs wait in submission order. Threads rather than processes: an audit mostly waits on
+    Tebra, the parsed zeep client is shared between jobs, and credentials and uploaded files stay in memory.
+    Jobs left unfinished by a server process that has exited are marked failed when the runner starts (JobStore.mark_interrupted).
+    """
+    def __init__(self, store=None, max_concurrent_jobs=DEFAULT_MAX_CONCURRENT_JOBS, max_jobs_per_practice=DEFAULT_MAX_JOBS_PER_PRACTICE, results_dir=DEFAULT_JOB_RESULTS_DIR):
+        self.store = store if store is not None else JobStore(); self.results_dir = results_dir
+        self.max_concurrent_jobs = max(1, int(max_concurrent_jobs)); self.max_jobs_per_practice = max(1, int(max_jobs_per_practice))
+        self._condition = threading.Condition(); self._queue = []; self._running_by_practice = collections.Counter(); self._cancel_events = {}
+        self._clients = {}; self._client_lock = threading.Lock()
+        os.makedirs(results_dir, exist_ok=True)
+        self.store.mark_interrupted(); self.purge_finished_jobs()
+        self._workers = [threading.Thread(target=self._worker_loop, name=f"tebra-job-{number}", daemon=True) for number in range(self.max_concurrent_jobs)]
+        for worker in self._workers: worker.start()
+
+    def submit(self, source, file_name, credentials, settings=None, practice_name=None):
+        """Queues an audit of source (the file's bytes) and returns its job id."""
+        job_id = uuid.uuid4().hex; practice_hash = practice_key_hash(credentials["CustomerKey"])
+        self.store.create_job(job_id, practice_hash, practice_name, file_name)
+        with self._condition:
+            self._cancel_events[job_id] = threading.Event()
+            self._queue.append({"kind": "audit", "job_id": job_id, "practice_hash": practice_hash, "source": source, "file_name": file_name, "credentials": dict(credentials), "settings": dict(settings or {})})
+            self._condition.notify_all()
+        return job_id
+
+    def submit_batch(self, files, practices, settings=None, label=None):
+        """Queues a batch audit (tebra_audit_batch.run_batch_audit) of files [(file_name, bytes)] for the practices of a credentials mapping; returns its job id."""
+        job_id = uuid.uuid4().hex; practice_hash = practice_key_hash("batch:" + ";".join(sorted(entry["CustomerKey"] for entry in practices.values())))
+        self.store.create_job(job_id, practice_hash, label or f"Batch ({len(practices)} practices)", f"{len(files)} files")
+        with self._condition:
+            self._cancel_events[job_id] = threading.Event()
+            self._queue.append({"kind": "batch", "job_id": job_id, "practice_hash": practice_hash, "files": list(files), "practices": practices, "settings": dict(settings or {})})
+            self._condition.notify_all()
+        return job_id
+
+    def cancel(self, job_id):
+        """Drops a queued job, or asks a running one to stop at its next progress report (checkpointed rows are kept)."""
+        with self._condition:
+            event = self._cancel_events.get(job_id)
+            if event is None: return False
+            event.set(); queued = [job for job in self._queue if job["job_id"] == job_id]
+            for job in queued: self._queue.remove(job); self._cancel_events.pop(job_id, None)
+        if queued: self.store.finish_job(job_id, "cancelled", "Cancelled before it started.")
+        return True
+
+    def wait(self, job_id, timeout=None, poll_interval=0.2):
+        """Blocks until the job is finished (or timeout seconds passed) and returns it."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            job = self.store.get_job(job_id)
+            if job is None or job["status"] not in ACTIVE_JOB_STATUSES or (deadline is not None and time.monotonic() >= deadline): return job
+            time.sleep(poll_interval)
+
+    def result_bytes(self, job_id):
+        job = self.store.get_job(job_id)
+        if not job or not job["result_path"] or not os.path.exists(job["result_path"]): return None
+        with open(job["result_path"], "rb") as f: return f.read()
+
+    def purge_finished_jobs(self, max_age_hours=JOB_RETENTION_HOURS):
+        for path in self.store.purge_finished(max_age_hours):
+            try: os.remove(path)
+            except OSError: pass
+
+    def get_client(self, wsdl_url=DEFAULT_WSDL_URL, wsdl_path=None):
+        # One client per WSDL location, re-created after CLIENT_TTL_SECONDS; creation is serialized so concurrent jobs parse the WSDL once
+        client_key = (wsdl_url, wsdl_path or None)
+        with self._client_lock:
+            client, created_at = self._clients.get(client_key, (None, 0.0))
+            if client is None or time.monotonic() - created_at > CLIENT_TTL_SECONDS:
+                client = create_api_client(wsdl_url, wsdl_path=wsdl_path or None); self._clients[client_key] = (client, time.monotonic())
+        return client
+
+    def _next_job(self):
+        for job in self._queue:
+            if self._running_by_practice[job["practice_hash"]] < self.max_jobs_per_practice: self._queue.remove(job); return job
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None: self._condition.wait(); job = self._next_job()
+                self._running_by_practice[job["practice_hash"]] += 1
+            try: self._run_job(job)
+            finally:
+                with self._condition: self._running_by_practice[job["practice_hash"]] -= 1; self._cancel_events.pop(job["job_id"], None); self._condition.notify_all()
+
+    def _run_job(self, job):
+        job_id = job["job_id"]; cancel_event = self._cancel_events[job_id]
+        store_progress = ProgressThrottle(lambda phase, done, total: self.store.update_progress(job_id, phase, done, total), min_interval=JOB_PROGRESS_INTERVAL)
+        def report_progress(phase, done, total):
+            if cancel_event.is_set(): raise AuditJobCancelled()
+            store_progress(phase, done, total)
+        self.store.mark_running(job_id)
+        try:
+            if job["kind"] == "batch": output_path, summary = self._run_batch(job, cancel_event)
+            else:
+                output_path = os.path.join(self.results_dir, f"{job_id}.xlsx"); settings = {**DEFAULT_AUDIT_SETTINGS, **job["settings"]}
+                try: client = self.get_client(settings["wsdl_url"], settings["wsdl_path"])
+                except Exception as e: raise AuditJobError(f"Failed to connect to Tebra API: {e}") from e
+                summary = execute_audit(job["source"], job["file_name"], job["credentials"], settings, output_path=output_path, client=client, progress_callback=report_progress)
+            self.store.finish_job(job_id, "done", result_path=output_path, summary=summary)
+        except AuditJobCancelled: self.store.finish_job(job_id, "cancelled", "Cancelled while running; rows already matched are resumed when the file is run again.")
+        except AuditJobError as e: self.store.finish_job(job_id, "failed", str(e))
+        except Exception as e: self.store.finish_job(job_id, "failed", f"Unexpected error: {type(e).__name__} - {e}")
+        finally: job["source"] = job["credentials"] = job["files"] = job["practices"] = None
+
+    def _run_batch(self, job, cancel_event):
+        """Runs a batch job in worker processes and zips its result workbooks and summary; returns (zip path, batch summary)."""
+        from tebra_audit_batch import run_batch_audit # Imported here: tebra_audit_batch builds on this module
+        job_id = job["job_id"]; output_dir = os.path.join(self.results_dir, job_id); files_done = [0]; total_files = len(job["files"])
+        def count_files(practice, file_name, phase, done, total):
+            if phase == "files": files_done[0] += 1; self.store.update_progress(job_id, "files", files_done[0], total_files)
+        self.store.update_progress(job_id, "files", 0, total_files)
+        try:
+            batch = run_batch_audit(job["files"], job["practices"], output_dir, settings=job["settings"], progress_callback=count_files, cancel_event=cancel_event)
+            if cancel_event.is_set(): raise AuditJobCancelled()
+            zip_path = os.path.join(self.results_dir, f"{job_id}.zip")
+            with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                for folder, _, file_names in os.walk(output_dir):
+                    for file_name in file_names: archive.write(os.path.join(folder, file_name), os.path.relpath(os.path.join(folder, file_name), output_dir))
+        finally: shutil.rmtree(output_dir, ignore_errors=True)
+        batch["summary_path"] = os.path.basename(batch["summary_path"])
+        return zip_path, batch
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Run-level instrumentation for Tebra Audit: per-phase timings, SOAP call latencies/errors and cache hit rates.
+One RunMetrics is filled in by an AuditRun (and by the app/CLI around file reading and export) and can be shown,
+written as a workbook sheet or dumped as JSON for monitoring.
+"""
+
+import time
+import json
+import bisect
+import threading
+import contextlib
+
+import pandas as pd
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0) # Upper bounds in seconds; slower calls land in the last "+Inf" bucket
+PHASE_LABELS = {"read_file": "Read audit file", "directory": "Patient directory (GetPatients)", "patients": "GetPatient prefetch", "prepare": "Normalize Excel columns", "patient_checks": "Patient checks",
+                "charges": "GetCharges (batched)", "comparisons": "Charge comparison", "export": "Results export"}
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values: return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+def _bucket_label(upper): return f"<= {upper:g} s" if upper != float("inf") else f"> {LATENCY_BUCKETS[-1]:g} s"
+
+class RunMetrics:
+    """
+    Thread-safe counters for one audit run. Phases accumulate wall time over every `with metrics.phase(name)` block,
+    so a phase entered several times (e.g. single-day GetCharges fallbacks) is summed. record_call() is called once
+    per SOAP request with error_type None on success, including its retries and backoff; record_attempt() once per
+    attempt sent to Tebra (by the RequestController), so retries are counted and timed apart;
+    count_cache() once per cache lookup.
+    """
+    def __init__(self):
+        self.started_at = time.time(); self._lock = threading.Lock()
+        self.phases = {}; self.calls = {}; self.caches = {}; self.counters = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try: yield
+        finally: self.add_phase_time(name, time.perf_counter() - start)
+
+    def add_phase_time(self, name, seconds):
+        with self._lock:
+            entry = self.phases.setdefault(name, {"seconds": 0.0, "entries": 0}); entry["seconds"] += seconds; entry["entries"] += 1
+
+    def _call_entry(self, method):
+        entry = self.calls.get(method)
+        if entry is None: entry = self.calls[method] = {"count": 0, "errors": {}, "latencies": [], "histogram": [0] * (len(LATENCY_BUCKETS) + 1), "attempts": 0, "retries": 0, "attempt_latencies": []}
+        return entry
+
+    def record_call(self, method, seconds, error_type=None):
+        with self._lock:
+            entry = self._call_entry(method)
+            entry["count"] += 1; entry["latencies"].append(seconds); entry["histogram"][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            if error_type: entry["errors"][error_type] = entry["errors"].get(error_type, 0) + 1
+
+    def record_attempt(self, method, seconds, retry=False):
+        with self._lock:
+            entry = self._call_entry(method); entry["attempts"] += 1; entry["attempt_latencies"].append(seconds)
+            if retry: entry["retries"] += 1
+
+    def count_cache(self, cache_name, hit):
+        with self._lock:
+            entry = self.caches.setdefault(cache_name, {"hits": 0, "misses": 0}); entry["hits" if hit else "misses"] += 1
+
+    def increment(self, name, amount=1):
+        with self._lock: self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_counter(self, name, value):
+        """Overwrites a counter, for levels such as the current concurrency limit."""
+        with self._lock: self.counters[name] = value
+
+    def to_dict(self):
+        """JSON-serializable snapshot of everything recorded so far."""
+        with self._lock:
+            calls = {}
+            for method, entry in self.calls.items():
+                latencies = sorted(entry["latencies"]); attempt_latencies = sorted(entry["attempt_latencies"]); error_count = sum(entry["errors"].values())
+                calls[method] = {"count": entry["count"], "attempts": entry["attempts"] if attempt_latencies else entry["count"], "retries": entry["retries"], # Without a RequestController every call is one attempt
+                                 "attempt_p50_seconds": _percentile(attempt_latencies, 0.50), "attempt_p95_seconds": _percentile(attempt_latencies, 0.95), "errors": error_count, "errors_by_type": dict(entry["errors"]), "error_rate": error_count / entry["count"] if entry["count"] else 0.0,
+                                 "total_seconds": sum(latencies), "mean_seconds": sum(latencies) / len(latencies) if latencies else None, "p50_seconds": _percentile(latencies, 0.50),
+                                 "p95_seconds": _percentile(latencies, 0.95), "max_seconds": latencies[-1] if latencies else None,
+                                 "histogram": {_bucket_label(upper): count for upper, count in zip(LATENCY_BUCKETS + (float("inf"),), entry["histogram"])}}
+            caches = {name: {**entry, "hit_rate": entry["hits"] / (entry["hits"] + entry["misses"]) if entry["hits"] + entry["misses"] else None} for name, entry in self.caches.items()}
+            phases = {name: dict(entry) for name, entry in self.phases.items()}
+            counters = dict(self.counters)
+        return {"started_at": self.started_at, "phases": phases, "soap_calls": calls, "caches": caches, "counters": counters}
+
+    def to_json(self, **kwargs): return json.dumps(self.to_dict(), **kwargs)
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f: f.write(self.to_json(indent=2))
+
+    def phase_frame(self, snapshot=None):
+        snapshot = snapshot or self.to_dict()
+        return pd.DataFrame([{"Phase": PHASE_LABELS.get(name, name), "Seconds": round(entry["seconds"], 3), "Entries": entry["entries"]} for name, entry in snapshot["phases"].items()], columns=["Phase", "Seconds", "Entries"])
+
+    def call_frame(self, snapshot=None):
+        snapshot = snapshot or self.to_dict(); rows = []
+        for method, entry in snapshot["soap_calls"].items():
+            rows.append({"Request": method, "Calls": entry["count"], "Attempts": entry.get("attempts", entry["count"]), "Retries": entry.get("retries", 0), "Errors": entry["errors"], "Errors by type": ", ".join(f"{error}: {count}" for error, count in sorted(entry["errors_by_type"].items())),
+                         "Mean (s)": entry["mean_seconds"], "p50 (s)": entry["p50_seconds"], "p95 (s)": entry["p95_seconds"], "Max (s)": entry["max_seconds"], **entry["histogram"]})
+        return pd.DataFrame(rows)
+
+    def cache_frame(self, snapshot=None):
+        snapshot = snapshot or self.to_dict()
+        return pd.DataFrame([{"Cache": name, "Hits": entry["hits"], "Misses": entry["misses"], "Hit rate": entry["hit_rate"]} for name, entry in snapshot["caches"].items()], columns=["Cache", "Hits", "Misses", "Hit rate"])
+
+    def to_frame(self):
+        """Long (Section, Metric, Value) table of every metric, used for the 'Performance' workbook sheet."""
+        snapshot = self.to_dict(); rows = []
+        for name, entry in snapshot["phases"].items(): rows.append(("Phase seconds", PHASE_LABELS.get(name, name), round(entry["seconds"], 3)))
+        for method, entry in snapshot["soap_calls"].items():
+            rows.extend([(f"SOAP {method}", "Calls", entry["count"]), (f"SOAP {method}", "Attempts", entry["attempts"]), (f"SOAP {method}", "Retries", entry["retries"]), (f"SOAP {method}", "Errors", entry["errors"])])
+            rows.extend((f"SOAP {method}", f"Error: {error}", count) for error, count in sorted(entry["errors_by_type"].items()))
+            rows.extend((f"SOAP {method}", f"{label} seconds", round(entry[key], 4)) for label, key in (("Mean", "mean_seconds"), ("p50", "p50_seconds"), ("p95", "p95_seconds"), ("Max", "max_seconds"), ("Attempt p50", "attempt_p50_seconds"), ("Attempt p95", "attempt_p95_seconds")) if entry[key] is not None)
+            rows.extend((f"SOAP {method}", f"Latency {bucket}", count) for bucket, count in entry["histogram"].items())
+        for name, entry in snapshot["caches"].items(): rows.extend([(f"Cache {name}", "Hits", entry["hits"]), (f"Cache {name}", "Misses", entry["misses"])])
+        for name, value in snapshot["counters"].items(): rows.append(("Counters", name, value))
+        return pd.DataFrame(rows, columns=["Section", "Metric", "Value"])
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Practice patient directory: every patient of the practice pulled through a few paged GetPatients requests and indexed
+by PatientID and by normalized name + DOB, so an audit resolves its patients without one GetPatient call per PatientID.
+Optionally kept per practice in a local SQLite file and topped up with the patients modified since the last sync.
+"""
+
+import os
+import time
+import pickle
+import sqlite3
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import zeep.exceptions
+
+from tebra_audit_engine import (TEBRA_NS, TebraPatient, DEFAULT_PREFETCH_WORKERS, MAX_PREFETCH_WORKERS, get_nested_attribute, get_tebra_patient_filter_name, normalize_name, normalize_dob)
+from tebra_request_control import CircuitOpenError, is_throttled_response
+from tebra_audit_checkpoint import practice_key_hash
+
+DEFAULT_DIRECTORY_PATH = os.environ.get("TEBRA_AUDIT_DIRECTORY_PATH", os.path.join(".tebra_cache", "patient_directory.sqlite3"))
+DIRECTORY_START_DATE = datetime.date(2000, 1, 1) # Earliest patient creation date requested
+DIRECTORY_WINDOW_DAYS = 366 # Creation-date span of the first requests; windows that come back full are split in half
+DIRECTORY_PAGE_LIMIT = 1000 # GetPatients returns at most this many patients, so a response this large is treated as truncated
+DIRECTORY_MAX_AGE_HOURS = 24 # A stored directory fully fetched longer ago than this is fetched again; younger ones only fetch patients modified since
+DIRECTORY_HINT_LIMIT = 5 # Most PatientIDs named in a "same name and DOB" hint
+
+class PatientDirectoryError(Exception):
+    """The directory cannot be fetched (e.g. the WSDL has no GetPatients operation); the audit falls back to GetPatient."""
+
+def patient_name_dob_key(name_key, dob_key):
+    # compare_normalized_names matches the first and last name token, so those two and the normalized DOB form the key
+    parts = name_key.split() if isinstance(name_key, str) else []
+    return (parts[0], parts[-1], dob_key) if parts and dob_key else None
+
+class PatientDirectory:
+    """In-memory index of a practice's patients (TebraPatient records) by PatientID and by normalized name + DOB."""
+    def __init__(self, patients=()):
+        self.by_id = {}; self.by_name_dob = {}
+        self.add_many(patients)
+
+    @staticmethod
+    def _name_dob_key(patient): return patient_name_dob_key(normalize_name(get_tebra_patient_filter_name(patient)), normalize_dob(patient.DOB))
+
+    def add_many(self, patients):
+        """Adds or replaces patients (by ID); returns how many were added or replaced."""
+        count = 0
+        for patient in patients:
+            patient_id = str(patient.ID or '').strip()
+            if not patient_id: continue
+            previous = self.by_id.get(patient_id)
+            if previous is not None:
+                previous_key = self._name_dob_key(previous)
+                if previous_key in self.by_name_dob: self.by_name_dob[previous_key].discard(patient_id)
+            self.by_id[patient_id] = patient; count += 1
+            key = self._name_dob_key(patient)
+            if key: self.by_name_dob.setdefault(key, set()).add(patient_id)
+        return count
+
+    def __len__(self): return len(self.by_id)
+    def get(self, patient_id): return self.by_id.get(str(patient_id).strip())
+
+    def find(self, name_key, dob_key):
+        """Sorted PatientIDs whose patient matches a normalized name ('first ... last') and DOB the way compare_names/compare_dob would."""
+        key = patient_name_dob_key(name_key, dob_key)
+        return sorted(self.by_name_dob.get(key, ())) if key else []
+
+    def seed(self, patient_cache, patient_ids, metrics=None):
+        """
+        Stores (TebraPatient, None) in patient_cache (an AuditRun's patient cache) for every ID not cached yet that the
+        directory has; IDs it lacks are left for the GetPatient prefetch. Returns the number of IDs seeded.
+        """
+        seeded = 0
+        for patient_id in patient_ids:
+            if not patient_id or patient_id in patient_cache: continue
+            patient = self.by_id.get(patient_id)
+            if metrics is not None: metrics.count_cache("patient_directory", patient is not None)
+            if patient is not None: patient_cache[patient_id] = (patient, None); seeded += 1
+        return seeded
+
+    def hint(self, name_key, dob_key, excluded_id=None):
+        """'Tebra patient ID(s) with this name and DOB: ...' for a row whose patient check failed, or None."""
+        patient_ids = [patient_id for patient_id in self.find(name_key, dob_key) if patient_id != excluded_id]
+        if not patient_ids: return None
+        shown = ", ".join(patient_ids[:DIRECTORY_HINT_LIMIT]) + (f" and {len(patient_ids) - DIRECTORY_HINT_LIMIT} more" if len(patient_ids) > DIRECTORY_HINT_LIMIT else "")
+        return f"Tebra patient ID(s) with this name and DOB: {shown}"
+
+def get_directory_request_types(client):
+    """zeep GetPatients request/filter types. Raises PatientDirectoryError when the WSDL lacks them."""
+    try: return {name: client.get_type(f'{TEBRA_NS}{name}') for name in ('GetPatientsReq', 'PatientFilter')}
+    except (LookupError, zeep.exceptions.Error) as e: raise PatientDirectoryError(f"The Tebra WSDL has no GetPatients request ({e}).") from e
+
+def get_tebra_patients_soap(client, header, filter_kwargs, request_types, metrics=None, request_controller=None):
+    """One GetPatients request with a PatientFilter built from filter_kwargs. Returns ([TebraPatient], None) or ([], error message)."""
+    soap_method_name = "GetPatients"; filter_label = ", ".join(f"{key} {value}" for key, value in filter_kwargs.items())
+    call_start = time.perf_counter(); error_type = None
+    try:
+        patients_request_object = request_types['GetPatientsReq'](RequestHeader=header, Filter=request_types['PatientFilter'](**filter_kwargs))
+        send = lambda: client.service.GetPatients(request=patients_request_object)
+        response = request_controller.call(soap_method_name, send, is_throttled_response) if request_controller is not None else send()
+        if hasattr(response, 'ErrorResponse') and response.ErrorResponse.IsError: error_type = "API Error"; error_msg = get_nested_attribute(response, 'ErrorResponse.ErrorMessage', 'Unknown API error'); return [], f"API Error ({soap_method_name} {filter_label}): {error_msg}"
+        patients_data = get_nested_attribute(response, 'Patients.PatientData', default=[])
+        if patients_data is None: patients_data = []
+        elif not isinstance(patients_data, list): patients_data = [patients_data]
+        return [TebraPatient.from_soap(patient) for patient in patients_data], None
+    except zeep.exceptions.Fault as fault: error_type = "SOAP Fault"; return [], f"SOAP Fault ({soap_method_name} {filter_label}): {fault.message}"
+    except CircuitOpenError as e: error_type = "Circuit open"; return [], f"Tebra API unavailable ({soap_method_name} {filter_label}): {e}"
+    except (TypeError, AttributeError, ValueError, zeep.exceptions.Error) as e: error_type = type(e).__name__; return [], f"Zeep/Request Error ({soap_method_name} {filter_label}): {type(e).__name__} - {e}"
+    except Exception as e: error_type = type(e).__name__; return [], f"Unexpected Error ({soap_method_name} {filter_label}): {type(e).__name__} - {e}"
+    finally:
+        if metrics is not None: metrics.record_call(soap_method_name, time.perf_counter() - call_start, error_type)
+
+def split_date_range(from_date, to_date, window_days):
+    """Consecutive (from, to) date windows of at most window_days days covering [from_date, to_date]."""
+    windows = []
+    while from_date <= to_date:
+        window_end = min(to_date, from_date + datetime.timedelta(days=window_days - 1)); windows.append((from_date, window_end)); from_date = window_end + datetime.timedelta(days=1)
+    return windows
+
+def fetch_patient_directory(client, header, modified_since=None, start_date=DIRECTORY_START_DATE, end_date=None, window_days=DIRECTORY_WINDOW_DAYS, page_limit=DIRECTORY_PAGE_LIMIT,
+                            max_workers=DEFAULT_PREFETCH_WORKERS, progress_callback=None, metrics=None, request_controller=None):
+    """
+    Pulls the practice's patients with GetPatients requests over creation-date windows from start_date to end_date
+    (today), or over last-modified windows from modified_since (a date) for an incremental refresh. A window that comes
+    back with page_limit patients may be truncated, so it is split in half and requested again. Windows are requested
+    through a bounded thread pool (sized and throttled by request_controller, if given).
+    Returns (patients, requests sent, errors); errors name the windows that failed or were still full at one day, in
+    which case the directory may be incomplete. Raises PatientDirectoryError when the WSDL has no GetPatients.
+    """
+    request_types = get_directory_request_types(client); end_date = end_date or datetime.date.today()
+    from_field, to_field = ("FromLastModifiedDate", "ToLastModifiedDate") if modified_since else ("FromCreatedDate", "ToCreatedDate")
+    windows = split_date_range(modified_since or start_date, end_date, window_days)
+    patients = {}; errors = []; requests_sent = 0; total = len(windows)
+    def fetch_window(window): return get_tebra_patients_soap(client, header, {from_field: window[0].isoformat(), to_field: window[1].isoformat()}, request_types, metrics, request_controller)
+    max_workers = max(1, min(request_controller.pool_size() if request_controller is not None else int(max_workers), MAX_PREFETCH_WORKERS, len(windows)))
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tebra-directory")
+    try:
+        pending = {executor.submit(fetch_window, window): window for window in windows}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                window_from, window_to = pending.pop(future); requests_sent += 1
+                window_patients, api_error = future.result()
+                if api_error: errors.append(api_error)
+                elif len(window_patients) >= page_limit and window_from < window_to:
+                    middle = window_from + (window_to - window_from) // 2; total += 2
+                    for half in ((window_from, middle), (middle + datetime.timedelta(days=1), window_to)): pending[executor.submit(fetch_window, half)] = half
+                else:
+                    if len(window_patients) >= page_limit: errors.append(f"GetPatients returned {len(window_patients)} patients for {window_from.isoformat()} alone; some may be missing.")
+                    patients.update((str(patient.ID).strip(), patient) for patient in window_patients if patient.ID is not None)
+                if progress_callback: progress_callback(requests_sent, total)
+    finally: executor.shutdown(wait=True, cancel_futures=True) # If the progress callback aborts the run (job cancelled), queued requests are dropped
+    return list(patients.values()), requests_sent, errors
+
+class PatientDirectoryStore:
+    """
+    SQLite file with the last fetched directory of each practice (patients keyed by customer key hash and PatientID)
+    and when it was last fully and incrementally synced. Safe to share between threads.
+    """
+    def __init__(self, path=DEFAULT_DIRECTORY_PATH):
+        self.path = path; self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS directory_patients (practice_hash TEXT NOT NULL, patient_id TEXT NOT NULL, payload BLOB NOT NULL, PRIMARY KEY (practice_hash, patient_id))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS directory_syncs (practice_hash TEXT PRIMARY KEY, full_synced_at REAL, synced_at REAL NOT NULL)")
+        self._conn.commit()
+
+    def load(self, customer_key):
+        """Returns (PatientDirectory, {"full_synced_at", "synced_at"}) for the practice, or (None, None) if nothing is stored."""
+        practice_hash = practice_key_hash(customer_key)
+        with self._lock:
+            sync_row = self._conn.execute("SELECT full_synced_at, synced_at FROM directory_syncs WHERE practice_hash = ?", (practice_hash,)).fetchone()
+            if sync_row is None: return None, None
+            payloads = [payload for (payload,) in self._conn.execute("SELECT payload FROM directory_patients WHERE practice_hash = ?", (practice_hash,))]
+        return PatientDirectory(pickle.loads(payload) for payload in payloads), {"full_synced_at": sync_row[0], "synced_at": sync_row[1]}
+
+    def save(self, customer_key, patients, synced_at, full_sync=False, complete=True):
+        """
+        Stores fetched patients. A full sync replaces the practice's stored patients; an incremental one adds or updates.
+        With complete=False (some windows failed) the sync times are not advanced, so the next run fetches those patients again.
+        """
+        practice_hash = practice_key_hash(customer_key)
+        rows = [(practice_hash, str(patient.ID).strip(), pickle.dumps(patient, protocol=pickle.HIGHEST_PROTOCOL)) for patient in patients]
+        with self._lock:
+            if full_sync: self._conn.execute("DELETE FROM directory_patients WHERE practice_hash = ?", (practice_hash,))
+            self._conn.executemany("INSERT OR REPLACE INTO directory_patients (practice_hash, patient_id, payload) VALUES (?, ?, ?)", rows)
+            if complete and full_sync: self._conn.execute("INSERT OR REPLACE INTO directory_syncs (practice_hash, full_synced_at, synced_at) VALUES (?, ?, ?)", (practice_hash, synced_at, synced_at))
+            elif complete: self._conn.execute("UPDATE directory_syncs SET synced_at = ? WHERE practice_hash = ?", (synced_at, practice_hash))
+            elif full_sync: self._conn.execute("INSERT OR REPLACE INTO directory_syncs (practice_hash, full_synced_at, synced_at) VALUES (?, NULL, ?)", (practice_hash, synced_at))
+            self._conn.commit()
+
+    def delete(self, customer_key):
+        practice_hash = practice_key_hash(customer_key)
+        with self._lock:
+            self._conn.execute("DELETE FROM directory_patients WHERE practice_hash = ?", (practice_hash,)); self._conn.execute("DELETE FROM directory_syncs WHERE practice_hash = ?", (practice_hash,)); self._conn.commit()
+
+    def close(self):
+        with self._lock: self._conn.close()
+
+def load_patient_directory(client, header, customer_key, store=None, max_age_hours=DIRECTORY_MAX_AGE_HOURS, refresh=False, max_workers=DEFAULT_PREFETCH_WORKERS, progress_callback=None, metrics=None, request_controller=None):
+    """
+    Returns (PatientDirectory, info) for the practice. With a store (PatientDirectoryStore), a directory fully fetched
+    less than max_age_hours ago is loaded and topped up with the patients modified since its last sync (from the day
+    before, as GetPatients filters by date); otherwise, or with refresh=True, every patient is fetched and stored.
+    info: {"source": "fetched"/"stored", "patients", "updated_patients", "requests", "errors", "seconds"}.
+    Raises PatientDirectoryError when GetPatients is unavailable.
+    """
+    start_time = time.perf_counter(); synced_at = time.time(); directory = sync = None
+    if store is not None and not refresh:
+        directory, sync = store.load(customer_key)
+        if sync is None or not sync["full_synced_at"] or synced_at - sync["full_synced_at"] > float(max_age_hours) * 3600: directory = None
+    fetch_kwargs = dict(max_workers=max_workers, progress_callback=progress_callback, metrics=metrics, request_controller=request_controller)
+    if directory is None:
+        patients, requests_sent, errors = fetch_patient_directory(client, header, **fetch_kwargs)
+        directory = PatientDirectory(patients); source = "fetched"; updated_patients = len(patients)
+        if store is not None: store.save(customer_key, patients, synced_at, full_sync=True, complete=not errors)
+    else:
+        modified_since = datetime.date.fromtimestamp(sync["synced_at"]) - datetime.timedelta(days=1)
+        patients, requests_sent, errors = fetch_patient_directory(client, header, modified_since=modified_since, **fetch_kwargs)
+        updated_patients = directory.add_many(patients); source = "stored"
+        store.save(customer_key, patients, synced_at, full_sync=False, complete=not errors)
+    if metrics is not None: metrics.increment("directory_requests", requests_sent); metrics.set_counter("directory_patients", len(directory))
+    return directory, {"source": source, "patients": len(directory), "updated_patients": updated_patients, "requests": requests_sent, "errors": errors, "seconds": time.perf_counter() - start_time}
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive request control for the Tebra SOAP API: an AIMD concurrency limit driven by observed latency and failures,
+retries with jittered exponential backoff for transient failures, and a circuit breaker for outages
+"""
+
+import re
+import time
+import random
+import logging
+import threading
+
+import requests
+import zeep.exceptions
+
+logger = logging.getLogger("tebra_audit")
+
+DEFAULT_MAX_RETRIES = 3
+RETRY_BASE_SECONDS = 0.5 # Backoff before retry n is uniform in [0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2**n)] ("full jitter")
+RETRY_MAX_SECONDS = 15.0
+LATENCY_TOLERANCE = 2.0 # Recent latency above twice the method's long-term latency counts as congestion
+LATENCY_SMOOTHING = 0.2 # EWMA weight of the newest sample in the recent latency
+BASELINE_SMOOTHING = 0.01 # EWMA weight in the long-term latency (about the last hundred responses), so noisy latencies don't read as congestion and a lasting shift is accepted
+FAILURE_DECREASE_RATIO = 0.5 # Multiplicative decrease on faults/timeouts/throttling responses
+LATENCY_DECREASE_RATIO = 0.8 # Gentler decrease when responses only slow down
+BREAKER_FAILURE_THRESHOLD = 8 # Consecutive failed requests (not throttled ones: the service is up then) that open the circuit
+BREAKER_COOLDOWN_SECONDS = 15.0 # Open time before a probe request; doubled after every failed probe
+BREAKER_MAX_COOLDOWN_SECONDS = 120.0
+BREAKER_MAX_WAIT_SECONDS = 60.0 # A call waits out open periods for this long before failing; longer outages fail the remaining calls fast
+RETRYABLE_HTTP_STATUSES = frozenset((408, 429, 500, 502, 503, 504))
+_THROTTLING_MESSAGE_RE = re.compile(r'throttl|rate limit|too many requests|(server|service) (is )?(too )?busy|try again', flags=re.IGNORECASE)
+_TRANSIENT_MESSAGE_RE = re.compile(r'temporar|unavailable|timed? ?out|timeout', flags=re.IGNORECASE)
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+def is_throttling_message(message): return bool(message and _THROTTLING_MESSAGE_RE.search(str(message)))
+def is_transient_message(message): return bool(message and (_THROTTLING_MESSAGE_RE.search(str(message)) or _TRANSIENT_MESSAGE_RE.search(str(message))))
+
+def classify_failure(error):
+    """
+    "throttled" when Tebra asks for fewer requests (HTTP 429, "too many requests" faults), "failed" for other transient
+    failures worth retrying (timeouts, dropped connections, 5xx statuses, server-side SOAP faults), None otherwise.
+    """
+    if isinstance(error, zeep.exceptions.TransportError):
+        if error.status_code == 429 or is_throttling_message(error.message): return "throttled"
+        return "failed" if error.status_code in RETRYABLE_HTTP_STATUSES else None
+    if isinstance(error, zeep.exceptions.Fault):
+        if is_throttling_message(error.message): return "throttled"
+        return "failed" if not str(error.code or '').lower().endswith('client') or is_transient_message(error.message) else None # Client faults are bad requests
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)): return "failed"
+    return None
+
+def is_throttled_response(response):
+    """True when a response carries an ErrorResponse that reads like throttling or a temporary failure (retried like a throttling fault)."""
+    error_response = getattr(response, 'ErrorResponse', None)
+    return bool(error_response is not None and getattr(error_response, 'IsError', False) and is_transient_message(getattr(error_response, 'ErrorMessage', None)))
+
+class RequestController:
+    """
+    Shared by the worker threads of one audit run. call(method, send) waits for a slot under the current concurrency
+    limit, sends the request and retries transient failures (classify_failure) with jittered backoff. With adaptive=True
+    the limit grows by one slot per limit's worth of healthy responses (additive increase, only while every slot is in
+    use) and is cut when requests are throttled or fail, or a method's recent latency exceeds LATENCY_TOLERANCE times its
+    long-term latency (multiplicative decrease, at most once per round trip). After breaker_threshold consecutive failed
+    requests the circuit opens: no request is sent for the cooldown, then one probe request decides whether it closes
+    again (a failed probe doubles the cooldown). Calls wait while the circuit is open, but fail fast with
+    CircuitOpenError once that would take longer than breaker_max_wait seconds. Counters and the current limit are recorded in metrics (a RunMetrics), if given.
+    """
+    def __init__(self, initial_limit, max_limit=None, min_limit=1, adaptive=True, max_retries=DEFAULT_MAX_RETRIES, breaker_threshold=BREAKER_FAILURE_THRESHOLD, breaker_cooldown=BREAKER_COOLDOWN_SECONDS,
+                 breaker_max_wait=BREAKER_MAX_WAIT_SECONDS, metrics=None):
+        self.max_limit = max(1, int(max_limit if max_limit is not None and adaptive else initial_limit)); self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = float(max(self.min_limit, min(int(initial_limit), self.max_limit))); self.adaptive = adaptive; self.max_retries = max(0, int(max_retries))
+        self.breaker_threshold = max(1, int(breaker_threshold)); self.breaker_cooldown = float(breaker_cooldown); self.breaker_max_wait = float(breaker_max_wait); self.metrics = metrics
+        self.state = "closed"; self._cooldown = self.breaker_cooldown; self._opened_until = 0.0; self._probe_out = False; self._consecutive_failures = 0
+        self._in_flight = 0; self._baseline = {}; self._smoothed = {}; self._last_decrease = 0.0
+        self._cond = threading.Condition(); self._random = random.Random()
+        self.retries = 0; self.increases = 0; self.decreases = 0; self.trips = 0; self.rejections = 0; self.peak_limit = self.limit; self.lowest_limit = self.limit
+        self._record_limit()
+
+    def call(self, method, send, transient_result=None):
+        """
+        Returns send()'s result, or raises the exception of its last attempt (CircuitOpenError while the circuit is open).
+        Transient exceptions (classify_failure) and results for which transient_result(result) is true (treated as throttling) are retried up to max_retries times.
+        """
+        attempt = 0; deadline = time.monotonic() + self.breaker_max_wait
+        while True:
+            probe = self._acquire(deadline); start = time.perf_counter(); error = None; outcome = None
+            try:
+                try: result = send(); outcome = "throttled" if transient_result and transient_result(result) else None
+                except Exception as e: error = e; outcome = classify_failure(e)
+            finally:
+                latency = time.perf_counter() - start; self._release(method, latency, outcome, probe)
+                if self.metrics is not None: self.metrics.record_attempt(method, latency, retry=attempt > 0)
+            if outcome is None or attempt >= self.max_retries:
+                if error is not None: raise error
+                return result
+            attempt += 1
+            with self._cond: self.retries += 1
+            if self.metrics is not None: self.metrics.increment("soap_retries")
+            time.sleep(self.backoff_seconds(attempt))
+
+    def pool_size(self):
+        """Worker threads worth starting for requests through this controller: max_limit when adaptive (the limit may grow to it), else the fixed limit."""
+        return self.max_limit if self.adaptive else max(1, int(self.limit))
+
+    def backoff_seconds(self, attempt): return self._random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+
+    def _acquire(self, deadline):
+        # Returns True when the caller is the half-open probe (sent regardless of the limit)
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.state == "open":
+                    if self._opened_until > deadline:
+                        self.rejections += 1
+                        if self.metrics is not None: self.metrics.increment("circuit_breaker_rejections")
+                        raise CircuitOpenError(f"Tebra API circuit breaker open after repeated failures; next attempt in {self._opened_until - now:.0f} s.")
+                    if now < self._opened_until: self._cond.wait(self._opened_until - now); continue
+                    self.state = "half_open"; self._probe_out = False
+                if self.state == "half_open":
+                    if not self._probe_out: self._probe_out = True; self._in_flight += 1; return True
+                elif self._in_flight < int(self.limit): self._in_flight += 1; return False
+                self._cond.wait()
+
+    def _release(self, method, latency, outcome, probe):
+        # outcome: None (answered), "throttled" (answered, asking for fewer requests) or "failed" (classify_failure)
+        with self._cond:
+            saturated = self._in_flight >= int(self.limit); self._in_flight -= 1; now = time.monotonic()
+            if probe: self._probe_out = False
+            if outcome == "failed":
+                self._consecutive_failures += 1
+                if probe: self._open_circuit(now, reopen=True)
+                elif self.state == "closed" and self._consecutive_failures >= self.breaker_threshold: self._open_circuit(now, reopen=False)
+            else:
+                self._consecutive_failures = 0
+                if probe: self.state = "closed"; self._cooldown = self.breaker_cooldown; logger.info("Tebra API circuit breaker closed.")
+            if outcome is not None: self._decrease(method, now, FAILURE_DECREASE_RATIO)
+            elif self._observe_latency(method, latency): self._decrease(method, now, LATENCY_DECREASE_RATIO)
+            elif self.adaptive and saturated and self.limit < self.max_limit: self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit); self.increases += 1; self._record_limit()
+            self._cond.notify_all()
+
+    def _observe_latency(self, method, latency):
+        # Updates the method's long-term and recent latency; True when the recent latency signals congestion
+        baseline = self._baseline.get(method); smoothed = self._smoothed.get(method)
+        self._baseline[method] = baseline = latency if baseline is None else baseline + BASELINE_SMOOTHING * (latency - baseline)
+        self._smoothed[method] = smoothed = latency if smoothed is None else smoothed + LATENCY_SMOOTHING * (latency - smoothed)
+        return smoothed > baseline * LATENCY_TOLERANCE
+
+    def _decrease(self, method, now, ratio):
+        if not self.adaptive or now - self._last_decrease < self._smoothed.get(method, 1.0): return # One cut per round trip: replies to requests sent before the cut carry no new signal
+        new_limit = max(float(self.min_limit), self.limit * ratio)
+        if new_limit < self.limit: self.limit = new_limit; self.decreases += 1; self._last_decrease = now; self._record_limit()
+
+    def _open_circuit(self, now, reopen):
+        if reopen: self._cooldown = min(self._cooldown * 2, BREAKER_MAX_COOLDOWN_SECONDS)
+        self.state = "open"; self._opened_until = now + self._cooldown; self.trips += 1
+        if self.metrics is not None: self.metrics.increment("circuit_breaker_trips")
+        logger.warning("Tebra API circuit breaker opened after %d consecutive failures; probing again in %.0f s.", self._consecutive_failures, self._cooldown)
+
+    def _record_limit(self):
+        self.peak_limit = max(self.peak_limit, self.limit); self.lowest_limit = min(self.lowest_limit, self.limit)
+        if self.metrics is not None:
+            for name, value in (("concurrency_limit", self.limit), ("concurrency_limit_peak", self.peak_limit), ("concurrency_limit_lowest", self.lowest_limit)): self.metrics.set_counter(name, round(value, 2))
+
+    def stats(self):
+        with self._cond:
+            return {"state": self.state, "limit": round(self.limit, 2), "peak_limit": round(self.peak_limit, 2), "lowest_limit": round(self.lowest_limit, 2), "in_flight": self._in_flight,
+                    "retries": self.retries, "increases": self.increases, "decreases": self.decreases, "breaker_trips": self.trips, "breaker_rejections": self.rejections}
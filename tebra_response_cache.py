@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent SQLite cache for Tebra SOAP responses (GetPatient / GetCharges), shared across audit runs
+"""
+
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+from types import SimpleNamespace
+
+import zeep.helpers
+
+DEFAULT_CACHE_PATH = os.environ.get("TEBRA_AUDIT_CACHE_PATH", os.path.join(".tebra_cache", "responses.sqlite3"))
+DEFAULT_TTL_HOURS = 24
+DEFAULT_MAX_SIZE_MB = 256
+EVICT_TARGET_RATIO = 0.9 # Size-based eviction trims down to 90% of the limit so it doesn't run on every write
+
+def to_plain_object(value):
+    """Converts a zeep response (or list of them) into picklable SimpleNamespace trees that keep attribute access."""
+    def convert(item):
+        if isinstance(item, dict): return SimpleNamespace(**{key: convert(val) for key, val in item.items()})
+        if isinstance(item, list): return [convert(val) for val in item]
+        return item
+    return convert(zeep.helpers.serialize_object(value, target_cls=dict))
+
+class ResponseCache:
+    """
+    Stores serialized SOAP responses keyed by (customer key, request type, filter).
+    Entries older than ttl_hours are treated as misses; the least recently used entries are evicted once the
+    stored payloads exceed max_size_mb. With refresh=True every lookup is a miss, but fresh responses are still written.
+    Safe to share between the prefetch worker threads.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_hours=DEFAULT_TTL_HOURS, max_size_mb=DEFAULT_MAX_SIZE_MB, refresh=False):
+        self.path = path; self.ttl_seconds = float(ttl_hours) * 3600; self.max_size_bytes = int(float(max_size_mb) * 1024 * 1024); self.refresh = refresh
+        self.hits = 0; self.misses = 0; self.writes = 0; self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses (cache_key TEXT PRIMARY KEY, customer_key_hash TEXT NOT NULL, request_type TEXT NOT NULL, filter_json TEXT NOT NULL, payload BLOB NOT NULL, size_bytes INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+        self.purge_expired()
+
+    @staticmethod
+    def _make_key(customer_key, request_type, filter_params):
+        # The customer key is only stored hashed; filters are serialized with sorted keys so equal filters share an entry
+        customer_key_hash = hashlib.sha256(str(customer_key or '').encode('utf-8')).hexdigest()
+        filter_json = json.dumps(filter_params, sort_keys=True, default=str)
+        cache_key = hashlib.sha256(f"{customer_key_hash}|{request_type}|{filter_json}".encode('utf-8')).hexdigest()
+        return cache_key, customer_key_hash, filter_json
+
+    def get(self, customer_key, request_type, filter_params):
+        """Returns (True, value) on a fresh hit, otherwise (False, None)."""
+        if self.refresh:
+            with self._lock: self.misses += 1
+            return False, None
+        cache_key, _, _ = self._make_key(customer_key, request_type, filter_params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT payload, created_at FROM responses WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds: self.misses += 1; return False, None
+            try: value = pickle.loads(row[0])
+            except Exception: self._conn.execute("DELETE FROM responses WHERE cache_key = ?", (cache_key,)); self._conn.commit(); self.misses += 1; return False, None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE cache_key = ?", (now, cache_key)); self._conn.commit()
+            self.hits += 1
+        return True, value
+
+    def put(self, customer_key, request_type, filter_params, value):
+        """Stores a successful response. Returns False if the value could not be serialized."""
+        cache_key, customer_key_hash, filter_json = self._make_key(customer_key, request_type, filter_params)
+        try: payload = pickle.dumps(to_plain_object(value), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception: return False
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses (cache_key, customer_key_hash, request_type, filter_json, payload, size_bytes, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (cache_key, customer_key_hash, request_type, filter_json, sqlite3.Binary(payload), len(payload), now, now))
+            self._conn.commit(); self.writes += 1
+        return True
+
+    def purge_expired(self):
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)).rowcount
+            self._conn.commit(); self.evictions += max(deleted, 0)
+        return deleted
+
+    def evict_to_size(self):
+        """Deletes least recently used entries until the stored payloads fit in max_size_bytes."""
+        with self._lock:
+            total_bytes = self._conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM responses").fetchone()[0]
+            if total_bytes <= self.max_size_bytes: return 0
+            target_bytes = self.max_size_bytes * EVICT_TARGET_RATIO; doomed_keys = []
+            for cache_key, size_bytes in self._conn.execute("SELECT cache_key, size_bytes FROM responses ORDER BY accessed_at ASC"):
+                if total_bytes <= target_bytes: break
+                doomed_keys.append((cache_key,)); total_bytes -= size_bytes
+            self._conn.executemany("DELETE FROM responses WHERE cache_key = ?", doomed_keys); self._conn.commit()
+            self.evictions += len(doomed_keys)
+        return len(doomed_keys)
+
+    def clear(self, customer_key=None):
+        """Removes every entry, or only those of one customer key."""
+        with self._lock:
+            if customer_key is None: self._conn.execute("DELETE FROM responses")
+            else: self._conn.execute("DELETE FROM responses WHERE customer_key_hash = ?", (self._make_key(customer_key, '', {})[1],))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, total_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "evictions": self.evictions, "entries": entries, "size_bytes": total_bytes}
+
+    def close(self):
+        with self._lock: self._conn.close()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures: a synthetic audit file with deliberate mismatches and malformed rows, and the mock Tebra server from
+benchmarks/ answering it in-process, so the tests run the real zeep client without network access.
+"""
+
+import os
+import sys
+import copy
+import types
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, "benchmarks")]
+
+import pytest
+
+from synthetic_audit_data import generate_dataset, write_audit_file
+from mock_tebra_server import MockTebraService, start_mock_server
+from tebra_audit_engine import AuditRun, create_api_client, build_request_header, read_audit_file
+
+def messy_dataset(rows=300, seed=3):
+    """generate_dataset rows plus the malformed values real files carry (unknown IDs, bad dates, wrong names, padded codes, duplicate charges)."""
+    dataset = generate_dataset(rows, mismatch_ratio=0.3, days=20, noise_charges=40, seed=seed); excel_rows = dataset["rows"]
+    excel_rows[0]["PatientID"] = "999999"; excel_rows[1]["PatientID"] = ""; excel_rows[2]["DateOfService"] = "not a date"; excel_rows[3]["PatientName"] = "Wrong, Name"
+    excel_rows[4]["DOB"] = "01/01/1900"; excel_rows[5]["ProcedureModifier1"] = " 25 "; excel_rows[6]["ReferringProvider"] = "Dr Nobody"; excel_rows[7]["ServiceUnitCount"] = "1.0"
+    excel_rows[8]["ServiceChargeAmount"] = 100.005; excel_rows[9]["PlaceOfServiceCode"] = "office"
+    charges_by_claim = {charge["ID"]: charge for charge in dataset["charges"]}
+    for row in excel_rows[10:14]: # Same patient, DOS and CPT with another amount: the amount decides the match
+        if row["claimID"] in charges_by_claim: dataset["charges"].append({**copy.deepcopy(charges_by_claim[row["claimID"]]), "ID": f"dup-{row['claimID']}", "TotalCharges": "1.00"})
+    return dataset
+
+@pytest.fixture(scope="session")
+def dataset(): return messy_dataset()
+
+@pytest.fixture(scope="session")
+def tebra(dataset):
+    """WSDL URL, zeep client and request header of an in-process mock Tebra server."""
+    server, wsdl_url = start_mock_server(MockTebraService(dataset))
+    try:
+        client = create_api_client(wsdl_url=wsdl_url, wsdl_path=None, cache_dir=None)
+        yield types.SimpleNamespace(wsdl_url=wsdl_url, client=client, header=build_request_header({"CustomerKey": "test-key", "User": "test", "Password": "test"}, client))
+    finally: server.shutdown(); server.server_close()
+
+@pytest.fixture(scope="session")
+def audit_df(dataset, tmp_path_factory): return read_audit_file(write_audit_file(dataset, str(tmp_path_factory.mktemp("audit") / "audit.xlsx")))
+
+@pytest.fixture
+def new_audit_run(tebra):
+    """AuditRun factory with fresh caches on the shared client; keyword arguments go to AuditRun."""
+    return lambda **kwargs: AuditRun(tebra.client, tebra.header, **kwargs)
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""The batch command line accepts the single-file CLI's audit options and passes them to every practice's process."""
+
+import os
+import sqlite3
+
+from synthetic_audit_data import write_audit_file
+from tebra_audit_batch import main, build_arg_parser
+from tebra_audit_cli import build_settings
+from tebra_audit_checkpoint import practice_key_hash
+from tebra_audit_jobs import DEFAULT_AUDIT_SETTINGS
+
+def test_batch_settings_cover_every_audit_setting():
+    args = build_arg_parser().parse_args(["a.xlsx", "--credentials", "practices.csv", "--refresh-cache", "--cache-path", "cache.sqlite3", "--checkpoint-path", "checkpoints.sqlite3", "--directory-path", "directory.sqlite3"])
+    settings = build_settings(args); assert set(settings) == set(DEFAULT_AUDIT_SETTINGS)
+    assert settings["use_response_cache"] and settings["refresh_response_cache"] and (settings["cache_path"], settings["checkpoint_path"], settings["directory_path"]) == ("cache.sqlite3", "checkpoints.sqlite3", "directory.sqlite3")
+
+def test_batch_keeps_its_stores_at_the_given_paths(tebra, dataset, tmp_path, capsys):
+    input_path = write_audit_file(dataset, str(tmp_path / "audit.xlsx")); credentials_path = tmp_path / "practices.csv"
+    credentials_path.write_text("Practice,CustomerKey,User,Password,Files\nClinic,test-key,test,test,audit*.xlsx\n", encoding="utf-8")
+    cache_path = str(tmp_path / "stores" / "responses.sqlite3"); checkpoint_path = str(tmp_path / "stores" / "checkpoints.sqlite3"); os.makedirs(tmp_path / "stores")
+    arguments = [input_path, "--credentials", str(credentials_path), "-o", str(tmp_path / "out"), "--processes", "1", "--wsdl-url", tebra.wsdl_url, "--no-wsdl-cache",
+                 "--cache", "--cache-path", cache_path, "--checkpoint-path", checkpoint_path, "-q"]
+    assert main(arguments) == 0 and os.path.exists(cache_path)
+    with sqlite3.connect(checkpoint_path) as conn: assert conn.execute("SELECT COUNT(*) FROM row_verdicts WHERE practice_hash = ?", (practice_key_hash("test-key"),)).fetchone()[0] > 0
+    assert main(arguments + ["--refresh-cache"]) == 0 and "Audited 1 files for 1 practices" in capsys.readouterr().out
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""Batched GetCharges requests must return, per (patient, DOS) key, exactly the charges of one GetCharges call per key."""
+
+import types
+
+import tebra_audit_engine
+from mock_tebra_server import MockTebraService, start_mock_server
+from tebra_audit_engine import fetch_tebra_charges_batched, plan_charge_requests, get_tebra_patient_filter_name, create_api_client, build_request_header
+
+def test_truncated_charge_responses_are_split(dataset, tebra, audit_df, new_audit_run):
+    # Against a server that returns at most 25 charges per response, practice-wide windows come back full and must be re-fetched in halves
+    audit_run = new_audit_run(); audit_run.run(audit_df)
+    charge_keys = [key for key, (charges, error) in audit_run.tebra_charges_cache.items() if error is None]
+    patient_names_by_id = {patient_id: get_tebra_patient_filter_name(patient) for patient_id, (patient, _) in audit_run.tebra_patient_cache.items() if patient is not None}
+    charge_ids = lambda cache: {key: (sorted(charge.ID for charge in charges), error) for key, (charges, error) in cache.items()}
+    expected_cache = {}; fetch_tebra_charges_batched(tebra.client, tebra.header, charge_keys, expected_cache, mode="practice", patient_names_by_id=patient_names_by_id)
+    server, wsdl_url = start_mock_server(MockTebraService(dataset, page_limit=25))
+    try:
+        capped_client = create_api_client(wsdl_url=wsdl_url, wsdl_path=None, cache_dir=None); capped_cache = {}
+        requests_sent = fetch_tebra_charges_batched(capped_client, build_request_header({"CustomerKey": "test-key", "User": "test", "Password": "test"}, capped_client), charge_keys, capped_cache,
+                                                    mode="practice", patient_names_by_id=patient_names_by_id, page_limit=25)
+    finally: server.shutdown(); server.server_close()
+    assert charge_ids(capped_cache) == charge_ids(expected_cache)
+    assert requests_sent > len(plan_charge_requests(charge_keys, mode="practice"))
+
+def test_undated_charge_only_drops_its_patients_keys(monkeypatch):
+    # One charge without a service date in a practice-wide window: only its patient's keys fall back to single-day requests
+    charge = lambda patient_id, name, dos: types.SimpleNamespace(PatientID=patient_id, PatientName=name, ServiceStartDate=dos)
+    window = [charge("1", "Ann Lee", "01/02/2024 12:00:00 AM"), charge("2", "Bo Kim", None), charge("2", "Bo Kim", "01/03/2024 12:00:00 AM"), charge("3", "Cy Ray", "01/04/2024 12:00:00 AM")]
+    monkeypatch.setattr(tebra_audit_engine, "get_tebra_charges_window_cached", lambda *args, **kwargs: (window, None))
+    keys = [("Ann Lee", "2024-01-02"), ("Bo Kim", "2024-01-03"), ("Cy Ray", "2024-01-04"), ("Cy Ray", "2024-01-05")]; cache = {}
+    assert fetch_tebra_charges_batched(None, None, keys, cache, mode="practice", patient_names_by_id={"1": "Ann Lee", "2": "Bo Kim", "3": "Cy Ray"}) == 1
+    assert sorted(cache) == [("Ann Lee", "2024-01-02"), ("Cy Ray", "2024-01-04"), ("Cy Ray", "2024-01-05")]
+    assert [len(cache[key][0]) for key in sorted(cache)] == [1, 1, 0]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""A checkpointed audit interrupted partway and resumed must return the results of one uninterrupted run, re-auditing every row it did not match."""
+
+import pytest
+
+from tebra_audit_engine import MATCH_MODES
+from tebra_audit_checkpoint import CheckpointStore, CheckpointedAudit
+
+def interrupt_on_chunk(audit_run, chunk_number):
+    """Makes audit_run.run raise ConnectionError on its chunk_number-th call, as a dropped connection would."""
+    run = audit_run.run; calls = [0]
+    def flaky_run(df):
+        calls[0] += 1
+        if calls[0] == chunk_number: raise ConnectionError("connection reset")
+        return run(df)
+    audit_run.run = flaky_run
+    return audit_run
+
+@pytest.fixture
+def store(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.sqlite3"))
+    yield store
+    store.close()
+
+@pytest.mark.parametrize("match_mode", MATCH_MODES)
+def test_resume_after_interrupt_equals_uninterrupted_run(new_audit_run, audit_df, store, match_mode):
+    expected = new_audit_run(match_mode=match_mode).run(audit_df)
+    interrupted = CheckpointedAudit(interrupt_on_chunk(new_audit_run(match_mode=match_mode), 3), store, "test-key", checkpoint_rows=50)
+    with pytest.raises(ConnectionError): interrupted.run(audit_df)
+    assert interrupted.audited_rows == 100
+    resumed = CheckpointedAudit(new_audit_run(match_mode=match_mode), store, "test-key", checkpoint_rows=50)
+    assert resumed.run(audit_df) == expected
+    matched_rows = sum(1 for result in expected[:100] if result["Status"] == "Match") # Mismatch and Error rows of the interrupted run are audited again
+    assert 0 < matched_rows < 100 and (resumed.resumed_rows, resumed.audited_rows) == (matched_rows, len(audit_df) - matched_rows)
+    rerun = CheckpointedAudit(new_audit_run(match_mode=match_mode), store, "test-key") # The finished run is not resumed again
+    rerun.run(audit_df); assert (rerun.resumed_rows, rerun.audited_rows) == (0, len(audit_df))
+
+def test_expired_checkpoints_are_not_resumed(new_audit_run, audit_df, store):
+    with pytest.raises(ConnectionError): CheckpointedAudit(interrupt_on_chunk(new_audit_run(), 2), store, "test-key", checkpoint_rows=50).run(audit_df)
+    resumed = CheckpointedAudit(new_audit_run(), store, "test-key", reuse_max_age_hours=0); resumed.run(audit_df)
+    assert (resumed.resumed_rows, resumed.audited_rows) == (0, len(audit_df))
+
+def test_interrupted_run_of_another_practice_is_not_resumed(new_audit_run, audit_df, store):
+    with pytest.raises(ConnectionError): CheckpointedAudit(interrupt_on_chunk(new_audit_run(), 2), store, "test-key", checkpoint_rows=50).run(audit_df)
+    other_practice = CheckpointedAudit(new_audit_run(), store, "other-key", checkpoint_rows=50); other_practice.run(audit_df)
+    assert (other_practice.resumed_rows, other_practice.audited_rows) == (0, len(audit_df))
+
+def test_incremental_run_reuses_only_match_verdicts(new_audit_run, audit_df, store):
+    first = CheckpointedAudit(new_audit_run(), store, "test-key"); expected = first.run(audit_df)
+    changed_df = audit_df.copy(); changed_df.loc[changed_df.index[:5], "ServiceChargeAmount"] = 1.0
+    incremental = CheckpointedAudit(new_audit_run(), store, "test-key", incremental=True)
+    assert incremental.run(changed_df) == new_audit_run().run(changed_df)
+    assert incremental.reused_rows == sum(1 for result in expected[5:] if result["Status"] == "Match")
+    assert incremental.reused_rows + incremental.audited_rows == len(changed_df)
+    expired = CheckpointedAudit(new_audit_run(), store, "test-key", incremental=True, reuse_max_age_hours=0)
+    expired.run(changed_df); assert expired.reused_rows == 0
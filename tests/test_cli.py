@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""The command line runs the audit through execute_audit, with every option passed on as a setting."""
+
+import json
+
+import pandas as pd
+
+from synthetic_audit_data import write_audit_file
+from tebra_audit_cli import main, build_arg_parser, build_settings
+from tebra_audit_jobs import DEFAULT_AUDIT_SETTINGS
+
+def test_cli_settings_cover_every_audit_setting():
+    settings = build_settings(build_arg_parser().parse_args(["audit.xlsx", "--cache", "--no-directory-store", "--no-wsdl-cache"]))
+    assert set(settings) == set(DEFAULT_AUDIT_SETTINGS)
+    assert settings["use_response_cache"] and not settings["persist_directory"] and settings["wsdl_cache_dir"] is None and settings["resume_runs"]
+
+def test_cli_audits_a_file(tebra, dataset, audit_df, new_audit_run, tmp_path, capsys):
+    input_path = write_audit_file(dataset, str(tmp_path / "audit.xlsx")); output_path = str(tmp_path / "results.csv"); metrics_path = str(tmp_path / "metrics.json")
+    exit_code = main([input_path, "-o", output_path, "--wsdl-url", tebra.wsdl_url, "--no-wsdl-cache", "--customer-key", "test-key", "--user", "test", "--password", "test",
+                      "--checkpoint-path", str(tmp_path / "checkpoints.sqlite3"), "--checkpoint-rows", "100", "--metrics-json", metrics_path, "-q"])
+    assert exit_code == 0
+    expected = [result["Status"] for result in new_audit_run().run(audit_df)]
+    assert list(pd.read_csv(output_path)["Audit Results"]) == [{"Match": "Verified"}.get(status, "Invalid") for status in expected]
+    with open(metrics_path, encoding="utf-8") as f: assert "GetCharges" in json.load(f)["soap_calls"]
+    assert f"Audited {len(expected)} rows" in capsys.readouterr().out
+
+def test_cli_reports_unreadable_files(tebra, tmp_path, capsys):
+    missing_path = str(tmp_path / "missing.xlsx")
+    assert main([missing_path, "--wsdl-url", tebra.wsdl_url, "--no-wsdl-cache", "--customer-key", "k", "--user", "u", "--password", "p", "-q"]) == 1
+    assert "Error reading Excel file" in capsys.readouterr().err
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""read_excel_streaming must return the same DataFrame as pd.read_excel, whatever the chunk size."""
+
+import datetime
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+from openpyxl.styles import Font
+
+from tebra_audit_engine import ID_COLUMN_DTYPES, EXCEL_READ_CHUNK_ROWS, REQUIRED_COLUMNS, read_excel_streaming, read_audit_file
+
+HEADER = REQUIRED_COLUMNS + ["ServiceLocationName", "Notes"]
+
+def write_mixed_workbook(path, rows=23):
+    """
+    A sheet with the cell types audit exports carry: numeric and text IDs, dates as date cells and as text, int and
+    float amounts, blanks, an error cell, a blank row in between, a column that turns from numbers to text partway
+    through, styled empty cells past the last value and styled empty rows at the end.
+    """
+    workbook = Workbook(); sheet = workbook.active; sheet.append(HEADER)
+    for number in range(rows):
+        values = {column: "" for column in HEADER}
+        values.update({"PatientID": 10000 + number if number % 3 else f"P{number}", "PatientName": f"Doe{number}, Jane", "DOB": datetime.datetime(1950, 1, 1) + datetime.timedelta(days=number * 97) if number % 2 else "01/31/1950",
+                       "DateOfService": datetime.datetime(2024, 1, 1 + number % 28), "ProcedureCode": 99213 if number % 4 else "J1100", "ProcedureModifier1": 25 if number % 5 == 0 else None,
+                       "ServiceUnitCount": number % 3 + 1 if number < rows // 2 else "1 unit", "ServiceChargeAmount": 100.5 if number % 2 else 80, "EncounterDiagnosisID1": "E11.9",
+                       "EncounterID": 300000 + number, "claimID": 700000 + number if number % 7 else f"C-{number}", "PriIns_CompanyName": "Aetna", "ServiceLocationName": "Main Office" if number % 2 else None})
+        if number == 11: values = {column: None for column in HEADER} # Blank row between data rows
+        sheet.append([values[column] if values[column] != "" else None for column in HEADER])
+    sheet.cell(row=4, column=HEADER.index("ReferringProvider") + 1).value = "#N/A" # Stored as an error cell
+    sheet.cell(row=3, column=len(HEADER) + 2).font = Font(bold=True) # Styled empty cell right of the data
+    for row in range(rows + 2, rows + 5): sheet.cell(row=row, column=1).font = Font(bold=True) # Styled empty trailing rows
+    workbook.save(path)
+    return path
+
+@pytest.fixture(scope="module")
+def mixed_workbook(tmp_path_factory): return write_mixed_workbook(str(tmp_path_factory.mktemp("excel") / "mixed.xlsx"))
+
+@pytest.mark.parametrize("chunk_rows", [1, 4, 10, EXCEL_READ_CHUNK_ROWS])
+def test_streaming_read_matches_read_excel(mixed_workbook, chunk_rows):
+    pd.testing.assert_frame_equal(read_excel_streaming(mixed_workbook, chunk_rows=chunk_rows), pd.read_excel(mixed_workbook, dtype=ID_COLUMN_DTYPES, keep_default_na=False))
+
+def test_streaming_read_of_synthetic_audit_file(dataset, tmp_path):
+    path = str(tmp_path / "audit.xlsx"); pd.DataFrame(dataset["rows"]).to_excel(path, index=False)
+    pd.testing.assert_frame_equal(read_excel_streaming(path, chunk_rows=64), pd.read_excel(path, dtype=ID_COLUMN_DTYPES, keep_default_na=False))
+
+def test_read_audit_file_reads_file_objects(mixed_workbook):
+    with open(mixed_workbook, "rb") as f: df = read_audit_file(f, filename="mixed.xlsx")
+    assert list(df["Original Excel Row Index"]) == list(range(len(df))) and not df.isna().any().any()
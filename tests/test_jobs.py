@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""JobStore and AuditJobRunner: orphaned jobs after a restart, per-practice job limits, cancellation and a complete job."""
+
+import io
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import tebra_audit_jobs
+from synthetic_audit_data import write_audit_file
+from tebra_audit_jobs import JobStore, AuditJobRunner
+from tebra_audit_checkpoint import practice_key_hash
+
+CREDENTIALS = {"CustomerKey": "test-key", "User": "test", "Password": "test"}
+
+@pytest.fixture
+def store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    yield store
+    store.close()
+
+def set_owner(store, job_id, host, pid):
+    with sqlite3.connect(store.path) as conn: conn.execute("UPDATE jobs SET owner_host = ?, owner_pid = ? WHERE job_id = ?", (host, pid, job_id))
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"]); process.wait()
+    return process.pid
+
+def test_mark_interrupted_fails_only_orphaned_jobs(store):
+    for job_id in ("legacy", "exited", "live", "other-host", "finished"): store.create_job(job_id, practice_key_hash("test-key"), None, "audit.xlsx")
+    store.mark_running("exited"); store.finish_job("finished", "done")
+    set_owner(store, "legacy", None, None); set_owner(store, "exited", socket.gethostname(), exited_pid()); set_owner(store, "other-host", "another-server", exited_pid())
+    assert store.mark_interrupted() == 2
+    assert {job_id: store.get_job(job_id)["status"] for job_id in ("legacy", "exited", "live", "other-host", "finished")} == {"legacy": "failed", "exited": "failed", "live": "queued", "other-host": "queued", "finished": "done"}
+    assert "Interrupted by a server restart" in store.get_job("exited")["message"] and store.mark_interrupted() == 0
+
+def test_list_jobs_returns_only_the_given_ids(store):
+    for job_id in ("a", "b", "c"): store.create_job(job_id, practice_key_hash("test-key"), None, f"{job_id}.xlsx")
+    assert [job["job_id"] for job in store.list_jobs(["a", "c"])] == ["c", "a"] and store.list_jobs([]) == []
+
+class FakeAudits:
+    """Replaces execute_audit: each job reports progress until release(file_name), so tests control which jobs are running."""
+    def __init__(self): self.lock = threading.Lock(); self.running = []; self.started = []; self.peak_by_practice = {}; self.released = set(); self.release_all = False
+    def __call__(self, source, file_name, credentials, settings=None, output_path=None, client=None, header=None, progress_callback=None):
+        with self.lock:
+            self.running.append((credentials["CustomerKey"], file_name)); self.started.append(file_name); key = credentials["CustomerKey"]
+            self.peak_by_practice[key] = max(self.peak_by_practice.get(key, 0), sum(1 for running_key, _ in self.running if running_key == key))
+        try:
+            while file_name not in self.released and not self.release_all: progress_callback("charges", 1, 2); time.sleep(0.01)
+        finally:
+            with self.lock: self.running.remove((credentials["CustomerKey"], file_name))
+        return {"file_name": file_name}
+    def release(self, file_name): self.released.add(file_name)
+    def running_files(self):
+        with self.lock: return sorted(file_name for _, file_name in self.running)
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline: raise AssertionError("condition not reached")
+        time.sleep(0.01)
+
+@pytest.fixture
+def fake_runner(monkeypatch, store, tmp_path):
+    audits = FakeAudits(); monkeypatch.setattr(tebra_audit_jobs, "execute_audit", audits)
+    runner = AuditJobRunner(store, max_concurrent_jobs=2, max_jobs_per_practice=1, results_dir=str(tmp_path / "results")); runner.get_client = lambda *args, **kwargs: None
+    yield runner, audits
+    audits.release_all = True # Lets the worker threads go idle
+
+def test_jobs_of_one_practice_wait_for_each_other(fake_runner):
+    runner, audits = fake_runner
+    job_a1 = runner.submit(b"", "a1.xlsx", CREDENTIALS); job_a2 = runner.submit(b"", "a2.xlsx", CREDENTIALS); job_b1 = runner.submit(b"", "b1.xlsx", {**CREDENTIALS, "CustomerKey": "other-key"})
+    wait_for(lambda: audits.running_files() == ["a1.xlsx", "b1.xlsx"]) # The second slot goes to the other practice, not to a2
+    assert runner.store.get_job(job_a2)["status"] == "queued"
+    audits.release("a1.xlsx"); wait_for(lambda: audits.running_files() == ["a2.xlsx", "b1.xlsx"])
+    audits.release("a2.xlsx"); audits.release("b1.xlsx")
+    assert [runner.wait(job_id, timeout=10)["status"] for job_id in (job_a1, job_a2, job_b1)] == ["done"] * 3
+    assert audits.peak_by_practice == {"test-key": 1, "other-key": 1}
+
+def test_cancel_queued_and_running_jobs(fake_runner):
+    runner, audits = fake_runner
+    running_job = runner.submit(b"", "a1.xlsx", CREDENTIALS); queued_job = runner.submit(b"", "a2.xlsx", CREDENTIALS)
+    wait_for(lambda: audits.running_files() == ["a1.xlsx"])
+    assert runner.cancel(queued_job) and runner.store.get_job(queued_job)["status"] == "cancelled"
+    assert runner.cancel(running_job); job = runner.wait(running_job, timeout=10)
+    assert job["status"] == "cancelled" and "resumed" in job["message"]
+    assert audits.started == ["a1.xlsx"] and not runner.cancel(running_job) and not runner.cancel("unknown")
+
+def test_job_runs_a_complete_audit(tebra, dataset, store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # Default store paths are relative to the working directory
+    runner = AuditJobRunner(store, results_dir=str(tmp_path / "results")); runner.get_client = lambda *args, **kwargs: tebra.client
+    with open(write_audit_file(dataset, str(tmp_path / "audit.xlsx")), "rb") as f: source = f.read()
+    job = runner.wait(runner.submit(source, "audit.xlsx", CREDENTIALS, settings={"checkpoint_rows": 100}), timeout=120)
+    assert job["status"] == "done" and job["summary"]["rows"] == len(dataset["rows"]) and job["summary"]["checkpoint"]["audited_rows"] == len(dataset["rows"])
+    results = pd.read_excel(io.BytesIO(runner.result_bytes(job["job_id"])))
+    assert len(results) == len(dataset["rows"]) and set(results["Audit Results"]) == {"Verified", "Invalid"}
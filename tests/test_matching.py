@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Set-based matching (compare_charges_joined) must produce exactly the per-row results of compare_charge_row."""
+
+import copy
+
+import pytest
+
+from tebra_audit_engine import CHARGE_FETCH_MODES, ExcelRowValues, prepare_audit_frame, prepared_records, extract_row_state, check_patient_row, compare_charge_row, compare_charges_joined
+
+def build_row_states(audit_run, df):
+    """The states iter_results hands to the comparison phase, after audit_run has fetched every patient and charge."""
+    prepared = prepare_audit_frame(df); norm_records = prepared_records(prepared); excel_values = ExcelRowValues(df); states = []
+    for position, index in enumerate(df.index):
+        state = extract_row_state(index, excel_values.row(position), norm_records[position])
+        if not state["extract_failed"]: check_patient_row(state, *audit_run.tebra_patient_cache[state["patient_id"]])
+        states.append(state)
+    return states, prepared
+
+def test_joined_comparison_equals_row_comparison(new_audit_run, audit_df):
+    audit_run = new_audit_run(match_mode="row"); audit_run.run(audit_df)
+    states, prepared = build_row_states(audit_run, audit_df)
+    row_results = [compare_charge_row(state, *(audit_run.tebra_charges_cache[(state["patient_name"], state["dos_str"])] if state["proceed"] else ([], None))) for state in copy.deepcopy(states)]
+    joined_results = compare_charges_joined(states, prepared, audit_run.tebra_charges_cache)
+    assert joined_results == row_results
+    assert {result["Status"] for result in row_results} == {"Match", "Mismatch", "Error"} # The fixture covers every outcome
+
+@pytest.mark.parametrize("charge_fetch_mode", CHARGE_FETCH_MODES)
+def test_join_and_row_match_modes_agree(new_audit_run, audit_df, charge_fetch_mode):
+    row_results = new_audit_run(match_mode="row", charge_fetch_mode=charge_fetch_mode).run(audit_df)
+    assert new_audit_run(match_mode="join", charge_fetch_mode=charge_fetch_mode).run(audit_df) == row_results
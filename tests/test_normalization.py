@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""The vectorized normalizers used by prepare_audit_frame must agree with their scalar counterparts value for value."""
+
+import random
+import string
+import datetime
+
+import pandas as pd
+import pytest
+
+from tebra_audit_engine import (normalize_code, normalize_string, normalize_name, normalize_dob, _normalize_pos_value, _normalize_code_vec, _normalize_string_vec, _normalize_name_vec,
+                                _normalize_dob_vec, _normalize_pos_vec, _strip_vec, _map_unique, prepare_audit_frame, NormalizationError)
+
+SAMPLE_VALUES = ["", " ", "99213", " 99213 ", "j1100", "E11.9", "z00.00 ", "25", "GT", "Office", "telehealth  home", "11", "Main Office", "Clinic-2", "BCBS of Texas", "Blue Cross, Blue Shield",
+                 "John Smith, MD", "  jane  doe do.", "Al Park NP ", "O'Neil, Pat", 'Sue-Ann "Wu"', "Dr. Who, M.D.", "Li Ng FACP", "Ana Diaz Jr.", "ÄNNE ßMITH", "tab\tseparated\nname",
+                 "01/31/1950", "1950-01-31", "1/5/1950", "1950-1-5", "01/31/1950 00:00:00", " 12/01/2001", "2001-12-01T00:00", "02/30/2020", "31.01.1950", "01/01/0001", "12/31/9999", "13/45/2020", "not a date"]
+VECTOR_NORMALIZERS = [("code", normalize_code, _normalize_code_vec), ("string", normalize_string, _normalize_string_vec), ("pos", _normalize_pos_value, _normalize_pos_vec),
+                      ("name", normalize_name, _normalize_name_vec), ("dob", normalize_dob, _normalize_dob_vec), ("strip", lambda value: str(value).strip(), _strip_vec)]
+
+def random_values(count=3000, seed=0):
+    """Random strings, provider-style names and dates in assorted formats (including years outside pandas' Timestamp range)."""
+    rnd = random.Random(seed); alphabet = string.ascii_letters + string.digits + " .,()-'\"’\t/Äßé"; values = []
+    for _ in range(count):
+        kind = rnd.random()
+        if kind < 0.4: values.append("".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 15)))); continue
+        if kind < 0.6: values.append(rnd.choice(SAMPLE_VALUES)); continue
+        date = datetime.date(rnd.randint(1, 9999), rnd.randint(1, 12), rnd.randint(1, 28))
+        values.append(rnd.choice(["", " "]) + date.strftime(rnd.choice(["%m/%d/%Y", "%Y-%m-%d", "%m/%d/%y", "%d.%m.%Y"])) + rnd.choice(["", " 00:00:00", "T00:00"]))
+    return values
+
+@pytest.mark.parametrize("name, scalar, vectorized", VECTOR_NORMALIZERS, ids=[name for name, _, _ in VECTOR_NORMALIZERS])
+def test_vectorized_normalizer_matches_scalar(name, scalar, vectorized):
+    values = SAMPLE_VALUES + random_values()
+    assert list(vectorized(pd.Series(values, dtype=object))) == [scalar(value) for value in values]
+
+def scalar_outcome(scalar, value):
+    try: return scalar(value)
+    except Exception: return NormalizationError
+
+@pytest.mark.parametrize("name, scalar, vectorized", VECTOR_NORMALIZERS, ids=[name for name, _, _ in VECTOR_NORMALIZERS])
+def test_map_unique_matches_scalar_on_mixed_columns(name, scalar, vectorized):
+    # Mixed columns (numbers next to strings, as Excel delivers them) skip the vectorized path; 1 and '1' must stay distinct
+    values = [1, "1", 1.5, "", " 11 ", 11, True, "01/31/1950", datetime.date(1950, 1, 31)]
+    results = _map_unique(pd.Series(values, dtype=object), scalar, vectorized)
+    assert [NormalizationError if isinstance(result, NormalizationError) else result for result in results] == [scalar_outcome(scalar, value) for value in values]
+
+def test_prepare_audit_frame_matches_scalar_normalizers(audit_df):
+    prepared = prepare_audit_frame(audit_df)
+    for column, field, scalar in (("ProcedureCode", "cpt", normalize_code), ("DOB", "dob", normalize_dob), ("RenderingProvider", "rendering_provider", normalize_name),
+                                  ("ServiceLocationName", "service_location", normalize_string), ("PlaceOfServiceCode", "pos", _normalize_pos_value), ("ProcedureModifier1", "modifier1", normalize_code)):
+        assert list(prepared[field]) == [scalar(value) for value in audit_df[column]], column
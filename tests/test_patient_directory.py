@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Patient directory: full windows split until complete, and the stored directory topped up by last-modified date."""
+
+import types
+import datetime
+
+import pytest
+
+import tebra_patient_directory
+from mock_tebra_server import MockTebraService, start_mock_server
+from tebra_audit_engine import TebraPatient, create_api_client, build_request_header
+from tebra_patient_directory import PatientDirectoryStore, fetch_patient_directory, load_patient_directory, split_date_range, DIRECTORY_START_DATE, DIRECTORY_WINDOW_DAYS
+
+TODAY = datetime.date.today()
+
+def patient(patient_id, first_name, last_name="Lee", dob="01/31/1950 12:00:00 AM"):
+    return TebraPatient.from_soap(types.SimpleNamespace(ID=patient_id, FirstName=first_name, LastName=last_name, PatientFullName=f"{first_name} {last_name}", DOB=dob))
+
+class FakeGetPatients:
+    """Stands in for get_tebra_patients_soap: answers from {id: (TebraPatient, created, modified)} and records every filter."""
+    def __init__(self, patients): self.patients = dict(patients); self.filters = []; self.error = None
+    def __call__(self, client, header, filter_kwargs, request_types, metrics=None, request_controller=None):
+        self.filters.append(dict(filter_kwargs))
+        if self.error: return [], self.error
+        date_index, field = (2, "LastModifiedDate") if "FromLastModifiedDate" in filter_kwargs else (1, "CreatedDate")
+        from_date, to_date = (datetime.date.fromisoformat(filter_kwargs[f"{bound}{field}"]) for bound in ("From", "To"))
+        return [entry[0] for entry in self.patients.values() if from_date <= entry[date_index] <= to_date], None
+
+@pytest.fixture
+def fake_tebra(monkeypatch):
+    fake = FakeGetPatients({"1": (patient("1", "Ann"), datetime.date(2015, 3, 1), datetime.date(2015, 3, 1)), "2": (patient("2", "Bo"), datetime.date(2019, 7, 9), datetime.date(2020, 1, 2)),
+                            "3": (patient("3", "Cy"), datetime.date(2021, 5, 5), datetime.date(2021, 5, 5))})
+    monkeypatch.setattr(tebra_patient_directory, "get_tebra_patients_soap", fake)
+    return fake
+
+@pytest.fixture
+def store(tmp_path):
+    store = PatientDirectoryStore(str(tmp_path / "patient_directory.sqlite3"))
+    yield store
+    store.close()
+
+FAKE_CLIENT = types.SimpleNamespace(get_type=lambda name: name)
+
+def test_full_windows_are_split_until_every_patient_is_fetched(dataset, tebra):
+    expected, _, _ = fetch_patient_directory(tebra.client, tebra.header)
+    server, wsdl_url = start_mock_server(MockTebraService(dataset, page_limit=3))
+    try:
+        client = create_api_client(wsdl_url=wsdl_url, wsdl_path=None, cache_dir=None); header = build_request_header({"CustomerKey": "test-key", "User": "test", "Password": "test"}, client)
+        patients, requests_sent, errors = fetch_patient_directory(client, header, page_limit=3)
+    finally: server.shutdown(); server.server_close()
+    assert sorted(p.ID for p in patients) == sorted(p.ID for p in expected) == sorted(dataset["patients"]) and not errors
+    assert requests_sent > len(split_date_range(DIRECTORY_START_DATE, TODAY, DIRECTORY_WINDOW_DAYS))
+
+def test_window_still_full_at_one_day_is_reported(fake_tebra):
+    patients, _, errors = fetch_patient_directory(FAKE_CLIENT, None, start_date=datetime.date(2015, 3, 1), end_date=datetime.date(2015, 3, 4), page_limit=1)
+    assert [p.ID for p in patients] == ["1"] and errors == ["GetPatients returned 1 patients for 2015-03-01 alone; some may be missing."]
+
+def test_stored_directory_is_topped_up_with_modified_patients(fake_tebra, store):
+    directory, info = load_patient_directory(FAKE_CLIENT, None, "test-key", store=store)
+    assert (info["source"], info["patients"], info["errors"]) == ("fetched", 3, []) and all("FromCreatedDate" in f for f in fake_tebra.filters)
+    fake_tebra.patients["2"] = (patient("2", "Bob"), datetime.date(2019, 7, 9), TODAY); fake_tebra.patients["4"] = (patient("4", "Di"), TODAY, TODAY); fake_tebra.filters = []
+    directory, info = load_patient_directory(FAKE_CLIENT, None, "test-key", store=store)
+    assert (info["source"], info["patients"], info["updated_patients"]) == ("stored", 4, 2) and directory.get("2").FirstName == "Bob"
+    assert fake_tebra.filters == [{"FromLastModifiedDate": (TODAY - datetime.timedelta(days=1)).isoformat(), "ToLastModifiedDate": TODAY.isoformat()}] # From the day before the last sync
+    assert directory.find("bob lee", "1950-01-31") == ["2"] and directory.find("bo lee", "1950-01-31") == []
+    stored, sync = store.load("test-key"); assert sorted(stored.by_id) == ["1", "2", "3", "4"] and stored.get("2").FirstName == "Bob"
+
+def test_failed_sync_does_not_advance_the_sync_time(fake_tebra, store):
+    load_patient_directory(FAKE_CLIENT, None, "test-key", store=store); _, sync = store.load("test-key")
+    fake_tebra.error = "SOAP Fault (GetPatients): unavailable"
+    _, info = load_patient_directory(FAKE_CLIENT, None, "test-key", store=store)
+    assert info["source"] == "stored" and info["errors"] == ["SOAP Fault (GetPatients): unavailable"] and store.load("test-key")[1] == sync
+    _, info = load_patient_directory(FAKE_CLIENT, None, "test-key", store=store, refresh=True) # A failed full fetch leaves no full sync time, so the next run fetches everything
+    assert info["source"] == "fetched" and store.load("test-key")[1]["full_synced_at"] is None
+    fake_tebra.error = None; _, info = load_patient_directory(FAKE_CLIENT, None, "test-key", store=store)
+    assert (info["source"], info["patients"]) == ("fetched", 3)
+
+def test_old_directory_is_fetched_again(fake_tebra, store):
+    load_patient_directory(FAKE_CLIENT, None, "test-key", store=store)
+    _, info = load_patient_directory(FAKE_CLIENT, None, "test-key", store=store, max_age_hours=0)
+    assert info["source"] == "fetched" and load_patient_directory(FAKE_CLIENT, None, "other-key", store=store)[1]["source"] == "fetched"
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""RequestController: AIMD concurrency limit, jittered retries of transient failures only, and the circuit breaker."""
+
+import time
+import threading
+
+import pytest
+import requests
+import zeep.exceptions
+
+import tebra_request_control
+from mock_tebra_server import MockTebraService, start_mock_server
+from tebra_audit_engine import AuditRun, create_api_client, build_request_header
+from tebra_audit_checkpoint import CheckpointStore, CheckpointedAudit
+from tebra_request_control import RequestController, CircuitOpenError, classify_failure
+
+SERVER_ERROR = zeep.exceptions.TransportError("Service Unavailable", status_code=503)
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch): monkeypatch.setattr(tebra_request_control, "RETRY_BASE_SECONDS", 0.001)
+
+def failing_send(errors, result="ok"):
+    """send() that raises the given errors in turn, then returns result."""
+    errors = list(errors)
+    def send():
+        if errors: raise errors.pop(0)
+        return result
+    return send
+
+def run_concurrently(controller, count, seconds=0.02):
+    """count calls in flight at once; each holds its slot for about seconds."""
+    barrier = threading.Barrier(count)
+    def send(): barrier.wait(timeout=5); time.sleep(seconds)
+    threads = [threading.Thread(target=controller.call, args=("GetCharges", send)) for _ in range(count)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+@pytest.mark.parametrize("error, expected", [
+    (zeep.exceptions.TransportError("Too Many Requests", status_code=429), "throttled"), (SERVER_ERROR, "failed"), (zeep.exceptions.TransportError("Not Found", status_code=404), None),
+    (zeep.exceptions.Fault("Server too busy, try again later.", code="s:Server"), "throttled"), (zeep.exceptions.Fault("Object reference not set to an instance of an object.", code="s:Server"), "failed"),
+    (zeep.exceptions.Fault("Internal error", code=None), "failed"), (zeep.exceptions.Fault("Invalid value for PatientID", code="s:Client"), None),
+    (zeep.exceptions.Fault("Service temporarily unavailable", code="s:Client"), "failed"), (requests.exceptions.ReadTimeout("read timed out"), "failed"),
+    (requests.exceptions.ConnectionError("connection reset"), "failed"), (ValueError("bad value"), None)])
+def test_classify_failure(error, expected):
+    # Every SOAP fault that is not a Client fault (a bad request) counts as a transient server-side failure
+    assert classify_failure(error) == expected
+
+def test_transient_failures_are_retried_with_jittered_backoff():
+    controller = RequestController(4, max_retries=3)
+    assert controller.call("GetCharges", failing_send([SERVER_ERROR, requests.exceptions.ConnectionError("reset")])) == "ok" and controller.retries == 2
+    with pytest.raises(zeep.exceptions.TransportError): controller.call("GetCharges", failing_send([SERVER_ERROR] * 4))
+    assert controller.retries == 5 # Three more, then the fourth failure is raised
+    delays = [controller.backoff_seconds(3) for _ in range(200)]
+    assert all(0 <= delay <= tebra_request_control.RETRY_BASE_SECONDS * 2 ** 3 for delay in delays) and len(set(delays)) > 1
+
+@pytest.mark.parametrize("error", [zeep.exceptions.Fault("Invalid value for PatientID", code="s:Client"), ValueError("bad value")])
+def test_permanent_failures_are_not_retried(error):
+    controller = RequestController(4, max_retries=3); send = failing_send([error, error])
+    with pytest.raises(type(error)): controller.call("GetCharges", send)
+    assert controller.retries == 0
+
+def test_throttling_responses_are_retried():
+    controller = RequestController(4, max_retries=3); responses = iter(["busy", "busy", "ok"])
+    assert controller.call("GetCharges", lambda: next(responses), transient_result=lambda result: result == "busy") == "ok" and controller.retries == 2
+
+def test_limit_grows_while_saturated_and_is_cut_on_failures():
+    controller = RequestController(2, max_limit=8, max_retries=0)
+    for _ in range(10): run_concurrently(controller, int(controller.limit))
+    grown_limit = controller.limit; assert grown_limit > 2 and controller.increases > 0
+    with pytest.raises(zeep.exceptions.TransportError): controller.call("GetCharges", failing_send([SERVER_ERROR]))
+    assert controller.limit == pytest.approx(grown_limit * tebra_request_control.FAILURE_DECREASE_RATIO) and controller.decreases == 1
+    for _ in range(20): controller.call("GetCharges", failing_send([]))
+    assert controller.limit == pytest.approx(grown_limit * tebra_request_control.FAILURE_DECREASE_RATIO) # Without saturation the limit does not grow
+    fixed = RequestController(2, max_limit=8, adaptive=False, max_retries=0)
+    with pytest.raises(zeep.exceptions.TransportError): fixed.call("GetCharges", failing_send([SERVER_ERROR]))
+    assert fixed.limit == 2 and fixed.pool_size() == 2 and controller.pool_size() == 8
+
+def test_circuit_opens_fails_fast_and_half_opens():
+    controller = RequestController(4, max_retries=0, breaker_threshold=3, breaker_cooldown=0.1, breaker_max_wait=0)
+    for _ in range(3):
+        with pytest.raises(zeep.exceptions.TransportError): controller.call("GetCharges", failing_send([SERVER_ERROR]))
+    assert controller.state == "open" and controller.trips == 1
+    with pytest.raises(CircuitOpenError): controller.call("GetCharges", failing_send([]))
+    assert controller.rejections == 1
+    controller.breaker_max_wait = 5.0 # Waits out the cooldown; the probe fails and the circuit opens again for twice as long
+    with pytest.raises(zeep.exceptions.TransportError): controller.call("GetCharges", failing_send([SERVER_ERROR]))
+    assert controller.state == "open" and controller.trips == 2
+    started = time.monotonic(); assert controller.call("GetCharges", failing_send([])) == "ok"
+    assert controller.state == "closed" and time.monotonic() - started >= 0.15
+
+def test_rows_failed_by_an_open_circuit_are_audited_again_on_resume(dataset, audit_df, tmp_path):
+    service = MockTebraService(dataset); server, wsdl_url = start_mock_server(service); store = CheckpointStore(str(tmp_path / "checkpoints.sqlite3"))
+    try:
+        client = create_api_client(wsdl_url=wsdl_url, wsdl_path=None, cache_dir=None); header = build_request_header({"CustomerKey": "test-key", "User": "test", "Password": "test"}, client)
+        expected = AuditRun(client, header).run(audit_df)
+        audit_run = AuditRun(client, header, max_retries=0); controller = audit_run.request_controller; controller.breaker_threshold = 2; controller.breaker_max_wait = 0
+        run = audit_run.run; calls = [0]
+        def outage_run(df):
+            calls[0] += 1; service.fault_rate = 1.0 if calls[0] == 2 else 0.0 # Tebra goes down during the second chunk
+            if calls[0] == 3: raise ConnectionError("connection reset")
+            return run(df)
+        audit_run.run = outage_run
+        with pytest.raises(ConnectionError): CheckpointedAudit(audit_run, store, "test-key", checkpoint_rows=50).run(audit_df)
+        assert controller.trips >= 1 and controller.rejections > 0
+        resumed = CheckpointedAudit(AuditRun(client, header), store, "test-key", checkpoint_rows=50)
+        assert resumed.run(audit_df) == expected
+        assert resumed.resumed_rows == sum(1 for result in expected[:50] if result["Status"] == "Match") # The second chunk's Error rows were not resumed
+    finally: store.close(); server.shutdown(); server.server_close()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""ResponseCache: TTL expiry, least-recently-used eviction by size, refresh and per-customer entries."""
+
+import types
+
+import pytest
+
+import tebra_response_cache
+from tebra_response_cache import ResponseCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Wall clock of tebra_response_cache, advanced by the test: clock[0] += seconds."""
+    clock = [1_700_000_000.0]; monkeypatch.setattr(tebra_response_cache, "time", types.SimpleNamespace(time=lambda: clock[0]))
+    return clock
+
+@pytest.fixture
+def new_cache(tmp_path):
+    caches = []
+    def new_cache(**kwargs): caches.append(ResponseCache(str(tmp_path / "responses.sqlite3"), **kwargs)); return caches[-1]
+    yield new_cache
+    for cache in caches: cache.close()
+
+def test_entries_expire_after_ttl(new_cache, clock):
+    cache = new_cache(ttl_hours=1); cache.put("key", "GetPatient", {"PatientID": "1"}, {"FirstName": "Ann"})
+    clock[0] += 3599; hit, value = cache.get("key", "GetPatient", {"PatientID": "1"})
+    assert hit and value.FirstName == "Ann"
+    clock[0] += 2; assert cache.get("key", "GetPatient", {"PatientID": "1"}) == (False, None)
+    assert (cache.hits, cache.misses) == (1, 1) and cache.stats()["entries"] == 1
+    assert new_cache(ttl_hours=1).stats()["entries"] == 0 # Expired entries are purged when the cache is opened
+
+def test_least_recently_used_entries_are_evicted_first(new_cache, clock):
+    cache = new_cache(max_size_mb=0.008) # About 8 kB: eviction trims four 3 kB responses down to two
+    for patient_id in "1234": cache.put("key", "GetPatient", {"PatientID": patient_id}, "x" * 3000); clock[0] += 1
+    assert cache.get("key", "GetPatient", {"PatientID": "1"})[0]; clock[0] += 1 # Read last, so it is kept
+    assert cache.evict_to_size() == 2 and cache.evictions == 2
+    assert [cache.get("key", "GetPatient", {"PatientID": patient_id})[0] for patient_id in "1234"] == [True, False, False, True]
+    assert cache.stats()["size_bytes"] <= 0.008 * 1024 * 1024 * tebra_response_cache.EVICT_TARGET_RATIO and cache.evict_to_size() == 0
+
+def test_refresh_misses_but_stores_fresh_responses(new_cache, clock):
+    new_cache().put("key", "GetCharges", {"FromServiceDate": "2024-01-01"}, [{"ID": "1"}])
+    refreshing = new_cache(refresh=True); assert refreshing.get("key", "GetCharges", {"FromServiceDate": "2024-01-01"}) == (False, None)
+    refreshing.put("key", "GetCharges", {"FromServiceDate": "2024-01-01"}, [{"ID": "2"}])
+    hit, value = new_cache().get("key", "GetCharges", {"FromServiceDate": "2024-01-01"}); assert hit and [charge.ID for charge in value] == ["2"]
+
+def test_entries_are_kept_per_customer_key(new_cache, clock):
+    cache = new_cache(); cache.put("key-a", "GetPatient", {"PatientID": "1"}, "a"); cache.put("key-b", "GetPatient", {"PatientID": "1"}, "b")
+    assert cache.get("key-a", "GetPatient", {"PatientID": "1"}) == (True, "a") and cache.get("key-b", "GetPatient", {"PatientID": "1"}) == (True, "b")
+    cache.clear("key-a"); assert cache.get("key-a", "GetPatient", {"PatientID": "1"}) == (False, None) and cache.get("key-b", "GetPatient", {"PatientID": "1"}) == (True, "b")
+
+def test_cached_run_only_sends_failed_requests_again(new_audit_run, audit_df, new_cache):
+    expected = new_audit_run(response_cache=new_cache()).run(audit_df)
+    cached_run = new_audit_run(response_cache=new_cache())
+    assert cached_run.run(audit_df) == expected
+    soap_calls = cached_run.metrics.to_dict()["soap_calls"] # Only the unknown PatientID is asked again: error responses are not cached
+    assert list(soap_calls) == ["GetPatient"] and soap_calls["GetPatient"]["count"] == 1
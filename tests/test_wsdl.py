@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""resolve_wsdl_location: local files, and the on-disk snapshot of the remote WSDL with its checksum refresh."""
+
+import os
+import time
+import types
+
+import pytest
+import requests
+
+from tebra_audit_engine import resolve_wsdl_location
+
+WSDL_URL = "https://tebra.invalid/KareoServices.svc?singleWsdl"
+
+class FakeSession:
+    """Stands in for requests.Session: get() returns content, or raises it when it is an exception."""
+    def __init__(self, content): self.content = content; self.requests = 0
+    def get(self, url, timeout=None):
+        self.requests += 1
+        if isinstance(self.content, Exception): raise self.content
+        return types.SimpleNamespace(content=self.content, raise_for_status=lambda: None)
+
+def resolve(cache_dir, content, refresh_hours=24):
+    session = FakeSession(content); location, source = resolve_wsdl_location(WSDL_URL, cache_dir=str(cache_dir), refresh_hours=refresh_hours, session=session)
+    return location, source, session.requests
+
+def age_snapshot(location, hours): past = time.time() - hours * 3600; os.utime(location, (past, past))
+
+def test_snapshot_is_downloaded_once_and_reused_while_fresh(tmp_path):
+    location, source, sent = resolve(tmp_path, b"<wsdl v1/>")
+    assert (source, sent) == ("downloaded", 1) and open(location, "rb").read() == b"<wsdl v1/>"
+    assert resolve(tmp_path, b"<wsdl v2/>") == (location, "snapshot", 0)
+
+def test_stale_snapshot_is_kept_when_the_checksum_is_unchanged(tmp_path):
+    location, _, _ = resolve(tmp_path, b"<wsdl v1/>"); age_snapshot(location, 25)
+    assert resolve(tmp_path, b"<wsdl v1/>") == (location, "snapshot (checksum unchanged)", 1)
+    assert time.time() - os.path.getmtime(location) < 60 and resolve(tmp_path, b"<wsdl v1/>")[1] == "snapshot" # Fresh again: no request until the next refresh
+
+def test_stale_snapshot_is_replaced_when_the_wsdl_changed(tmp_path):
+    location, _, _ = resolve(tmp_path, b"<wsdl v1/>"); age_snapshot(location, 25)
+    assert resolve(tmp_path, b"<wsdl v2/>") == (location, "updated", 1) and open(location, "rb").read() == b"<wsdl v2/>"
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+def test_corrupted_snapshot_is_replaced_on_refresh(tmp_path):
+    location, _, _ = resolve(tmp_path, b"<wsdl v1/>")
+    with open(location, "wb") as f: f.write(b"<wsdl v1")
+    age_snapshot(location, 25)
+    assert resolve(tmp_path, b"<wsdl v1/>")[1] == "updated" and open(location, "rb").read() == b"<wsdl v1/>"
+
+def test_failed_refresh_falls_back_to_the_snapshot(tmp_path):
+    with pytest.raises(requests.exceptions.ConnectionError): resolve(tmp_path, requests.exceptions.ConnectionError("unreachable")) # Nothing to fall back to yet
+    location, _, _ = resolve(tmp_path, b"<wsdl v1/>"); age_snapshot(location, 25)
+    assert resolve(tmp_path, requests.exceptions.ConnectionError("unreachable")) == (location, "snapshot (refresh failed)", 1)
+
+def test_local_file_and_remote_locations(tmp_path):
+    wsdl_file = tmp_path / "kareo.wsdl"; wsdl_file.write_bytes(b"<wsdl/>")
+    assert resolve_wsdl_location(WSDL_URL, wsdl_path=str(wsdl_file), cache_dir=str(tmp_path / "cache"), session=FakeSession(AssertionError("no download"))) == (str(wsdl_file), "local file")
+    with pytest.raises(FileNotFoundError): resolve_wsdl_location(WSDL_URL, wsdl_path=str(tmp_path / "missing.wsdl"))
+    assert resolve_wsdl_location(WSDL_URL, cache_dir=None) == (WSDL_URL, "remote")